@@ -13,12 +13,138 @@ class Settings(BaseSettings):
     default_temperature: float = 0.7
     max_tokens: int = 2000
     
+    # Fournisseurs LLM (routage, failover, hedging)
+    llm_providers: list[str] = ["openai"]  # Ordre de préférence ; "anthropic", "fake"
+    anthropic_model: str = "claude-3-5-sonnet-latest"
+    llm_max_attempts: int = 3
+    llm_backoff_base_ms: float = 200
+    llm_backoff_max_ms: float = 5000
+    llm_hedging: bool = False  # Requête dupliquée si le premier fournisseur est lent
+    llm_hedge_percentile: float = 95
+    llm_hedge_min_samples: int = 20
+    llm_breaker_failure_threshold: int = 5
+    llm_breaker_cooldown_seconds: float = 30
+    prompt_versions: dict[str, int] = {}  # Version épinglée par template, ex: {"analysis.document": 1}
+    
+    # Fournisseur fake (LLM_PROVIDERS=["fake"]) : tests et benchmarks sans réseau
+    fake_latency_ms: float = 50  # Médiane
+    fake_latency_distribution: str = "fixed"  # fixed, uniform, lognormal
+    fake_latency_jitter: float = 0.0  # uniform : ±fraction ; lognormal : sigma
+    fake_ttft_ms: float | None = None  # Streaming ; None = fake_latency_ms
+    fake_tokens_per_second: float = 0  # 0 = pas de temps de génération
+    fake_error_rate: float = 0.0
+    fake_error_status: int = 503
+    fake_stream_abort_rate: float = 0.0  # Coupure en cours de flux
+    fake_reply: str | None = None  # None = écho du dernier message
+    fake_replies: dict[str, str] = {}  # Template de prompt -> réponse (ex: JSON d'analyse)
+    fake_seed: int | None = None
+    
+    # Client HTTP amont (pool de connexions partagé)
+    openai_max_connections: int = 200
+    openai_max_keepalive_connections: int = 200  # = max : pas de fermeture après un pic
+    openai_keepalive_expiry: float = 60  # seconds
+    openai_http2: bool = False  # Nécessite le paquet h2
+    openai_connect_timeout: float = 5
+    openai_read_timeout: float = 60
+    openai_pool_timeout: float = 30  # Attente d'une connexion libre
+    openai_max_retries: int = 0  # Les reprises sont faites par le routeur (failover)
+    
+    # Quotas amont (ordonnanceur) ; 0 = pas de limite
+    upstream_tokens_per_minute: int = 0
+    upstream_requests_per_minute: int = 0
+    upstream_model_tokens_per_minute: dict[str, int] = {}  # ex: {"gpt-4-turbo": 300000}
+    scheduler_weights: dict[str, float] = {"chat": 8, "analysis": 3, "batch": 1}
+    
+    # Streaming SSE
+    sse_heartbeat_interval: float = 15.0  # seconds
+    sse_coalesce_ms: float = 0  # Les deux à 0 : une frame par chunk
+    sse_coalesce_bytes: int = 0
+    
     # Rate Limiting
     rate_limit_requests: int = 100
     rate_limit_window: int = 60  # seconds
     
+    # Clés API (table api_keys, lue via un cache mémoire)
+    api_keys_enabled: bool = False  # Clés reçues vérifiées et identité attachée
+    auth_required: bool = False  # Clé valide obligatoire sur /api/* (implique api_keys_enabled)
+    api_keys_refresh_seconds: float = 60  # Rechargement de fond (révocations visibles après)
+    api_keys_miss_refresh_seconds: float = 5  # Clé inconnue : rechargement anticipé au plus une fois par période
+    
+    # Décompte des tokens par clé (table usage, écrite par lots)
+    usage_tracking: bool = False  # Budgets mensuels des clés appliqués si activé
+    usage_flush_interval: float = 10.0  # seconds
+    
+    # Logging (file bornée, écriture par un thread dédié)
+    log_level: str = "INFO"
+    log_file: str | None = None  # None = stderr
+    log_queue_size: int = 10000  # File pleine : lignes abandonnées (comptées)
+    log_batch_size: int = 256
+    log_sample_rate: float = 1.0  # Part des requêtes 2xx/3xx journalisées
+    log_slow_request_ms: float = 1000  # Toujours journalisées au-delà
+    
+    # Analyse de documents longs (map-reduce)
+    analysis_chunk_tokens: int = 3000  # Au-delà, le document est découpé
+    analysis_chunk_overlap_tokens: int = 150
+    analysis_chunk_concurrency: int = 4
+    analysis_chunk_cache_entries: int = 2048
+    analysis_max_document_bytes: int = 10_000_000
+    
+    # Résultats d'analyse (GET /api/analysis/{id}, ETag)
+    analysis_results_max_entries: int = 4096
+    analysis_results_ttl_seconds: int = 86400
+    analysis_results_persistent: bool = False  # Second niveau SQLite (database_url)
+    analysis_results_cache_control: str = "private, max-age=3600"  # "public" : cache partagé / CDN
+    
+    # Cache sémantique (quasi-doublons) pour /analysis/document et /classify
+    semantic_cache_enabled: bool = False  # Nécessite numpy
+    semantic_cache_embedder: str = "hashing"  # hashing (local), openai
+    semantic_cache_embedding_model: str = "text-embedding-3-small"
+    semantic_cache_dim: int = 512
+    semantic_cache_threshold: float = 0.92  # Similarité cosinus minimale
+    semantic_cache_max_entries: int = 10000
+    semantic_cache_snapshot_path: str | None = None  # Répertoire, relu en mmap au démarrage
+    
+    # Classification par lots
+    classify_batching: bool = False  # Regrouper les requêtes /classify concurrentes
+    classify_batch_window_ms: float = 20
+    classify_batch_max_items: int = 20
+    classify_batch_max_tokens: int = 3000
+    
+    # Jobs d'analyse en masse
+    jobs_concurrency: int = 8
+    jobs_tokens_per_minute: int = 90000
+    jobs_retention_minutes: int = 60
+    jobs_max_items: int = 50000
+    
     # Database
     database_url: str = "sqlite:///./app.db"
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+    db_pool_pre_ping: bool = True
+    db_pool_recycle: int = 1800  # seconds
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kb: int = 20000
+    
+    # Cache des réponses LLM
+    cache_enabled: bool = True
+    cache_max_entries: int = 1024
+    cache_ttl_seconds: int = 3600
+    cache_persistent: bool = False  # Second niveau SQLite (database_url)
+    cache_sampled_responses: bool = False  # Cacher aussi temperature > 0
+    
+    # Historique des conversations
+    history_token_budget: int = 3000
+    history_model_token_budgets: dict[str, int] = {}  # ex: {"gpt-4-turbo": 8000}
+    history_summary_enabled: bool = False  # Résumé glissant des anciens tours
+    conversation_ttl_minutes: int = 60
+    conversation_max_memory_mb: float = 256  # Taille estimée ; 0 : pas de plafond
+    conversation_compress_after_seconds: float = 0  # Inactives compressées (zlib) ; 0 : jamais
+    conversation_sweep_interval: float = 30.0  # seconds
+    
+    # Persistance des conversations (write-behind)
+    conversation_persistence: bool = False
+    conversation_flush_interval: float = 2.0  # seconds
+    conversation_flush_batch_size: int = 200
     
     class Config:
         env_file = ".env"
@@ -27,4 +153,13 @@ class Settings(BaseSettings):
 def get_settings() -> Settings:
     return Settings()
 
-settings = get_settings()
\ No newline at end of file
+class _LazySettings:
+    """Settings chargés au premier accès, pas à l'import des modules."""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+    def __setattr__(self, name, value):
+        setattr(get_settings(), name, value)
+
+settings: Settings = _LazySettings()
\ No newline at end of file
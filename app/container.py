@@ -0,0 +1,140 @@
+# Conteneur des services de l'application
+# app/container.py
+from typing import TYPE_CHECKING
+
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.models.database import dispose_engines, init_db
+from app.services.api_keys import APIKeyStore
+from app.services.conversation import ConversationService, create_conversation_service
+from app.services.jobs import JobManager
+from app.services.llm_service import LLMService
+from app.services.embeddings import build_embedder
+from app.services.result_store import AnalysisResultStore
+from app.services.semantic_cache import SemanticCache
+from app.services.usage import UsageLedger
+from app.utils.log_pipeline import QueuedLogHandler, setup_logging, shutdown_logging
+from app.utils.prompts import prompts
+
+if TYPE_CHECKING:
+    from app.services.classify_batcher import ClassificationBatcher
+    from app.services.document_analysis import ChunkedDocumentAnalyzer
+
+
+class Container:
+    """Services partagés de l'application.
+
+    Créé dans le lifespan (jamais à l'import) : les clients réseau, moteurs
+    de base de données et tâches de fond sont démarrés dans `start()` et
+    arrêtés proprement dans `stop()`.
+    """
+
+    def __init__(self):
+        self.usage = UsageLedger() if settings.usage_tracking else None
+        self.llm_service = LLMService(usage=self.usage)
+        self.conversation_service = create_conversation_service(self.llm_service)
+        self.job_manager = JobManager()
+        self.analysis_results = AnalysisResultStore()
+        self.semantic_cache: SemanticCache | None = None
+        if settings.semantic_cache_enabled:
+            self.semantic_cache = SemanticCache(build_embedder(self.llm_service))
+        self.api_keys = APIKeyStore()
+        # Créés dans start() : leurs primitives asyncio sont liées à la boucle du lifespan
+        self.document_analyzer: "ChunkedDocumentAnalyzer | None" = None
+        self.classify_batcher: "ClassificationBatcher | None" = None
+        self.log_handler: QueuedLogHandler | None = None
+
+    async def start(self):
+        self.log_handler = setup_logging()
+        # Tokens des parties statiques des prompts : comptés une fois
+        prompts.warm(self.llm_service.default_model)
+        await self.llm_service.start()
+        api_keys = settings.api_keys_enabled or settings.auth_required
+        if settings.conversation_persistence or api_keys or self.usage is not None:
+            await init_db()
+        if api_keys:
+            await self.api_keys.start()
+        if self.usage is not None:
+            await self.usage.start()
+        await self.conversation_service.start()
+        if self.semantic_cache is not None:
+            self.semantic_cache.load()
+        self._start_analysis()
+
+    def _start_analysis(self):
+        # Import tardif : ces services et le router importent `current_container`
+        from app.routers.analysis import _analyze_chunk, _classify_fallback
+        from app.services.classify_batcher import ClassificationBatcher
+        from app.services.document_analysis import ChunkedDocumentAnalyzer
+
+        self.document_analyzer = ChunkedDocumentAnalyzer(analyze_chunk=_analyze_chunk)
+        self.classify_batcher = ClassificationBatcher(fallback=_classify_fallback)
+
+    async def stop(self):
+        await self.api_keys.close()
+        await self.job_manager.close()
+        if self.classify_batcher is not None:
+            # Après les jobs, avant le client LLM : les lots en attente sont encore envoyés
+            await self.classify_batcher.stop()
+        await self.conversation_service.close()
+        await self.llm_service.aclose()
+        if self.usage is not None:
+            # Après les jobs et conversations : leurs derniers appels sont comptés
+            await self.usage.close()
+        if self.semantic_cache is not None:
+            self.semantic_cache.save()
+        await dispose_engines()
+        shutdown_logging(self.log_handler)
+
+
+_container: Container | None = None
+
+
+def set_container(container: Container | None):
+    global _container
+    _container = container
+
+
+def current_container() -> Container:
+    """Conteneur de l'application démarrée (pour le code hors requête :
+    jobs, lots, helpers partagés)."""
+    if _container is None:
+        raise RuntimeError("Application services are not started (lifespan has not run)")
+    return _container
+
+
+# Dépendances FastAPI
+def get_container(request: Request) -> Container:
+    return request.app.state.container
+
+
+def get_llm_service(request: Request) -> LLMService:
+    return request.app.state.container.llm_service
+
+
+def get_conversation_service(request: Request) -> ConversationService:
+    return request.app.state.container.conversation_service
+
+
+def get_job_manager(request: Request) -> JobManager:
+    return request.app.state.container.job_manager
+
+
+def get_analysis_results(request: Request) -> AnalysisResultStore:
+    return request.app.state.container.analysis_results
+
+
+def get_usage_ledger(request: Request) -> UsageLedger:
+    usage = request.app.state.container.usage
+    if usage is None:
+        raise HTTPException(status_code=404, detail="Usage tracking is disabled")
+    return usage
+
+
+def get_document_analyzer(request: Request) -> "ChunkedDocumentAnalyzer":
+    return request.app.state.container.document_analyzer
+
+
+def get_classify_batcher(request: Request) -> "ClassificationBatcher":
+    return request.app.state.container.classify_batcher
@@ -1,21 +1,33 @@
 # Point d'entrée FastAPI
 # app/main.py
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.config import settings
-from app.routers import chat, analysis
+from app.container import Container, get_container, set_container
+from app.routers import chat, analysis, jobs, usage
+from app.middleware.auth import AuthMiddleware
 from app.middleware.logging import LoggingMiddleware
-from app.middleware.rate_limit import RateLimitMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.rate_limit import RateLimitMiddleware, InMemoryRateLimitStore
+from app.utils import metrics
+from app.utils.prompts import prompts
+from app.utils.structured_output import parse_stats
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
+    # Startup : Settings, clients et moteurs créés ici, pas à l'import
     print("🚀 Starting AI Backend...")
+    container = Container()
+    await container.start()
+    app.state.container = container
+    set_container(container)
     yield
     # Shutdown
     print("👋 Shutting down...")
+    await container.stop()
+    set_container(None)
+    metrics.mark_process_dead()
 
 app = FastAPI(
     title="AI Backend API",
@@ -33,16 +45,52 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Logging middleware
+# Rate limiting middleware (limites lues dans les Settings au démarrage)
+rate_limit_store = InMemoryRateLimitStore()
+app.add_middleware(RateLimitMiddleware, store=rate_limit_store)
+
+# Clés API (englobe le rate limiting : limite par clé vérifiée)
+app.add_middleware(AuthMiddleware)
+
+# Logging middleware (englobe le rate limiting : les 429 sont journalisés)
 app.add_middleware(LoggingMiddleware)
 
-# Rate limiting middleware
-app.add_middleware(RateLimitMiddleware, requests_per_minute=settings.rate_limit_requests)
+# Métriques (ajouté en dernier : englobe les autres middlewares)
+app.add_middleware(MetricsMiddleware)
 
 # Routers
 app.include_router(chat.router, prefix="/api/chat", tags=["Chat"])
 app.include_router(analysis.router, prefix="/api/analysis", tags=["Analysis"])
+app.include_router(jobs.router, prefix="/api/jobs", tags=["Jobs"])
+app.include_router(usage.router, prefix="/api/usage", tags=["Usage"])
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "version": "1.0.0"}
\ No newline at end of file
+    return {"status": "healthy", "version": "1.0.0"}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Exposition Prometheus (agrégée entre workers en mode multiprocess)."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
+
+@app.get("/stats")
+async def stats(container: Container = Depends(get_container)):
+    llm_service = container.llm_service
+    return {
+        "providers": llm_service.provider_stats(),
+        "scheduler": llm_service.scheduler_stats(),
+        "http_pool": llm_service.pool_stats(),
+        "cache": llm_service.cache_stats(),
+        "coalescing": llm_service.coalescing_stats(),
+        "rate_limit": rate_limit_store.stats(),
+        "classify_batching": container.classify_batcher.stats,
+        "structured_output": parse_stats.to_dict(),
+        "prompts": prompts.stats(),
+        "analysis_results": container.analysis_results.stats(),
+        "conversations": container.conversation_service.stats(),
+        "api_keys": container.api_keys.stats(),
+        "semantic_cache": container.semantic_cache.stats() if container.semantic_cache is not None else {"enabled": False},
+        "usage": container.usage.stats() if container.usage is not None else {"enabled": False},
+        "logging": container.log_handler.stats(),
+    }
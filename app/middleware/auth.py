@@ -1,18 +1,89 @@
+# Authentification par clé API
 # app/middleware/auth.py
-from fastapi import Security, HTTPException
+from fastapi import HTTPException, Request, Security
+from fastapi.responses import JSONResponse
 from fastapi.security import APIKeyHeader
+from starlette.datastructures import Headers
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+from app.config import settings
+from app.services.api_keys import APIKeyIdentity, current_api_key, current_user_id
 
-async def verify_api_key(api_key: str = Security(api_key_header)):
-    """Vérifie la clé API."""
-    if not api_key:
+API_KEY_HEADER = "X-API-Key"
+# Utilisateur final d'une clé (décompte d'usage), libre et non vérifié
+USER_ID_HEADER = "X-User-ID"
+
+# Préfixe des routes protégées quand `auth_required`
+PROTECTED_PREFIX = "/api/"
+
+api_key_header = APIKeyHeader(name=API_KEY_HEADER, auto_error=False)
+
+
+def request_identity(scope: Scope) -> APIKeyIdentity | None:
+    """Identité attachée à la requête par AuthMiddleware."""
+    state = scope.get("state")
+    return state.get("api_key") if state else None
+
+
+class AuthMiddleware:
+    """Middleware ASGI pur : résout la clé API via le cache du conteneur
+    (`APIKeyStore`, sans requête DB par appel) et attache l'identité à la
+    requête (`request.state.api_key`, `current_api_key`) pour le rate
+    limiting, les logs et le décompte des tokens.
+
+    Clé invalide : 403. Sans clé : requête anonyme, ou 401 sur /api/* si
+    `auth_required` (sauf OPTIONS, pour la pré-vérification CORS). Avec une clé valide, l'en-tête X-User-ID sert à
+    ventiler l'usage de la clé par utilisateur final.
+    """
+
+    def __init__(self, app: ASGIApp, required: bool | None = None):
+        self.app = app
+        self.required = settings.auth_required if required is None else required
+        self.enabled = self.required or settings.api_keys_enabled
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Pré-vérification CORS (sans en-têtes d'authentification) : laissée passer
+        if scope["type"] != "http" or not self.enabled or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        identity = None
+        headers = Headers(scope=scope)
+        api_key = headers.get(API_KEY_HEADER)
+        if api_key:
+            identity = await scope["app"].state.container.api_keys.resolve(api_key)
+            if identity is None:
+                response = JSONResponse(status_code=403, content={"detail": "Invalid API key"})
+                await response(scope, receive, send)
+                return
+        elif self.required and scope["path"].startswith(PROTECTED_PREFIX):
+            response = JSONResponse(
+                status_code=401,
+                content={"detail": "API key required"},
+                headers={"WWW-Authenticate": API_KEY_HEADER}
+            )
+            await response(scope, receive, send)
+            return
+
+        user_id = headers.get(USER_ID_HEADER) if identity is not None else None
+        scope.setdefault("state", {})["api_key"] = identity
+        token = current_api_key.set(identity)
+        user_token = current_user_id.set(user_id[:64] if user_id else None)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_user_id.reset(user_token)
+            current_api_key.reset(token)
+
+
+async def verify_api_key(
+    request: Request,
+    api_key: str | None = Security(api_key_header)  # Documente l'en-tête dans OpenAPI
+) -> APIKeyIdentity:
+    """Dépendance : identité de la clé déjà vérifiée par AuthMiddleware."""
+    identity = request_identity(request.scope)
+    if identity is None:
+        if api_key:
+            raise HTTPException(status_code=403, detail="Invalid API key")
         raise HTTPException(status_code=401, detail="API key required")
-    
-    # En production : vérifier contre une DB ou cache
-    valid_keys = {"demo-key-123", "prod-key-456"}
-    
-    if api_key not in valid_keys:
-        raise HTTPException(status_code=403, detail="Invalid API key")
-    
-    return api_key
\ No newline at end of file
+    return identity
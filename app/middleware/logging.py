@@ -1,38 +1,82 @@
 # Logging structuré
 # app/middleware/logging.py
-from fastapi import Request
-from starlette.middleware.base import BaseHTTPMiddleware
-import time
-import json
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 import logging
+import random
+import time
+import uuid
+
+from app.config import settings
+from app.middleware.auth import request_identity
+from app.utils.log_pipeline import current_request_id
+from app.utils.metrics import LOG_SAMPLED_OUT
 
 logger = logging.getLogger("ai_backend")
 
-class LoggingMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        start_time = time.time()
-        
-        # Log request
-        request_log = {
-            "type": "request",
-            "method": request.method,
-            "path": request.url.path,
-            "client_ip": request.client.host,
-        }
-        logger.info(json.dumps(request_log))
-        
-        # Process
-        response = await call_next(request)
-        
-        # Log response
-        duration_ms = (time.time() - start_time) * 1000
-        response_log = {
-            "type": "response",
-            "method": request.method,
-            "path": request.url.path,
-            "status_code": response.status_code,
-            "duration_ms": round(duration_ms, 2)
-        }
-        logger.info(json.dumps(response_log))
-        
-        return response
\ No newline at end of file
+REQUEST_ID_HEADER = "X-Request-ID"
+
+class LoggingMiddleware:
+    """Middleware ASGI pur : n'intercepte que le message de statut, le corps
+    de la réponse (y compris SSE) est transmis tel quel.
+
+    Une ligne par requête, à la fin. Les réponses 2xx/3xx rapides sont
+    échantillonnées (`log_sample_rate`) ; les erreurs et les requêtes lentes
+    sont toujours journalisées. L'identifiant de requête (en-tête
+    X-Request-ID, reçu ou généré) est renvoyé au client et ajouté à tous
+    les logs émis pendant la requête.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        sample_rate: float | None = None,
+        slow_request_ms: float | None = None
+    ):
+        self.app = app
+        self.sample_rate = settings.log_sample_rate if sample_rate is None else sample_rate
+        self.slow_request_ms = settings.log_slow_request_ms if slow_request_ms is None else slow_request_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        request_id = Headers(scope=scope).get(REQUEST_ID_HEADER)
+        if not request_id or len(request_id) > 128:
+            request_id = uuid.uuid4().hex
+        token = current_request_id.set(request_id)
+
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                MutableHeaders(scope=message)[REQUEST_ID_HEADER] = request_id
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            if (
+                status_code >= 400
+                or duration_ms >= self.slow_request_ms
+                or random.random() < self.sample_rate
+            ):
+                if logger.isEnabledFor(logging.INFO):
+                    client = scope.get("client")
+                    identity = request_identity(scope)
+                    logger.info("request", extra={"fields": {
+                        "method": scope["method"],
+                        "path": scope["path"],
+                        "status_code": status_code,
+                        "duration_ms": round(duration_ms, 2),
+                        "client_ip": client[0] if client else None,
+                        "api_key_id": identity.key_id if identity else None,
+                    }})
+            else:
+                LOG_SAMPLED_OUT.inc()
+            current_request_id.reset(token)
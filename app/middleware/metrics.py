@@ -0,0 +1,45 @@
+# Métriques HTTP
+# app/middleware/metrics.py
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+import time
+
+from app.utils.metrics import HTTP_DURATION, HTTP_IN_FLIGHT, HTTP_REQUESTS, current_scope, route_template
+
+
+class MetricsMiddleware:
+    """Middleware ASGI pur : latence par route (gabarit de la route),
+    compteur par statut et requêtes en cours.
+
+    Le scope est exposé aux couches inférieures (`current_endpoint`) pour
+    étiqueter les tokens consommés par route.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        token = current_scope.set(scope)
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            current_scope.reset(token)
+            # Route connue une fois le routage fait
+            route = route_template(scope)
+            method = scope["method"]
+            HTTP_DURATION[(method, route)].observe(time.perf_counter() - start)
+            HTTP_REQUESTS[(method, route, str(status_code))].inc()
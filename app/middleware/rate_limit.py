@@ -1,43 +1,189 @@
 # Rate limiting
 # app/middleware/rate_limit.py
-from fastapi import Request, HTTPException
-from starlette.middleware.base import BaseHTTPMiddleware
-from collections import defaultdict
-from datetime import datetime, timedelta
-import asyncio
-
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, requests_per_minute: int = 60):
-        super().__init__(app)
-        self.requests_per_minute = requests_per_minute
-        self.requests: dict[str, list[datetime]] = defaultdict(list)
-        self._lock = asyncio.Lock()
-    
-    async def dispatch(self, request: Request, call_next):
-        # Identifier le client (IP ou API key)
-        client_id = request.client.host
-        
-        async with self._lock:
-            now = datetime.now()
-            window_start = now - timedelta(minutes=1)
-            
-            # Nettoyer les anciennes requêtes
-            self.requests[client_id] = [
-                ts for ts in self.requests[client_id]
-                if ts > window_start
-            ]
-            
-            # Vérifier la limite
-            if len(self.requests[client_id]) >= self.requests_per_minute:
-                raise HTTPException(
-                    status_code=429,
-                    detail="Rate limit exceeded. Please wait before making more requests."
-                )
-            
-            # Enregistrer cette requête
-            self.requests[client_id].append(now)
-        
-        return await call_next(request)
+from fastapi.responses import JSONResponse
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Protocol
+import math
+import time
+
+from app.config import settings
+from app.middleware.auth import request_identity
+from app.utils.metrics import RATE_LIMIT_ALLOWED, RATE_LIMIT_REJECTED
+
+
+@dataclass
+class RateLimitDecision:
+    allowed: bool
+    limit: int
+    remaining: int
+    retry_after: int = 0
+
+
+class RateLimitStore(Protocol):
+    """Stockage des compteurs (mémoire locale, ou partagé entre workers)."""
+
+    async def hit(self, client_id: str, limit: int, window: float) -> RateLimitDecision: ...
+
+
+class InMemoryRateLimitStore:
+    """Compteur à fenêtre glissante, mémoire constante par client.
+
+    Chaque client garde deux compteurs (fenêtre précédente et courante) ; la
+    fenêtre glissante est estimée par pondération. Les clients sont rangés
+    par dernier accès, ce qui permet d'évincer les inactifs au fil de l'eau.
+    Toutes les opérations sont synchrones : aucun verrou n'est nécessaire
+    sur la boucle asyncio.
+    """
+
+    # Nombre max de clients inactifs évincés par requête
+    EVICT_BATCH = 8
+
+    def __init__(self):
+        # client_id -> [index_fenetre, compteur_precedent, compteur_courant, dernier_acces]
+        self._clients: "OrderedDict[str, list]" = OrderedDict()
+        self.allowed = 0
+        self.rejected = 0
+        self.evicted = 0
+
+    async def hit(self, client_id: str, limit: int, window: float) -> RateLimitDecision:
+        now = time.monotonic()
+        current = int(now // window)
+
+        entry = self._clients.get(client_id)
+        if entry is None:
+            entry = [current, 0, 0, now]
+            self._clients[client_id] = entry
+        else:
+            self._clients.move_to_end(client_id)
+            if entry[0] != current:
+                entry[1] = entry[2] if entry[0] == current - 1 else 0
+                entry[2] = 0
+                entry[0] = current
+            entry[3] = now
+
+        self._evict_idle(now, window)
+
+        elapsed = (now % window) / window
+        estimated = entry[1] * (1 - elapsed) + entry[2]
+
+        if estimated + 1 > limit:
+            self.rejected += 1
+            return RateLimitDecision(
+                allowed=False,
+                limit=limit,
+                remaining=0,
+                retry_after=self._retry_after(entry, limit, window, elapsed)
+            )
+
+        entry[2] += 1
+        self.allowed += 1
+        return RateLimitDecision(
+            allowed=True,
+            limit=limit,
+            remaining=max(0, int(limit - estimated - 1))
+        )
+
+    @staticmethod
+    def _retry_after(entry: list, limit: int, window: float, elapsed: float) -> int:
+        previous, count = entry[1], entry[2]
+        if count + 1 > limit or previous == 0:
+            # Attendre la fenêtre suivante
+            return max(1, math.ceil((1 - elapsed) * window))
+        # Attendre que la part de la fenêtre précédente décroisse suffisamment
+        needed = 1 - (limit - count - 1) / previous
+        return max(1, math.ceil((needed - elapsed) * window))
+
+    def _evict_idle(self, now: float, window: float):
+        for _ in range(self.EVICT_BATCH):
+            if not self._clients:
+                return
+            client_id, entry = next(iter(self._clients.items()))
+            if now - entry[3] < 2 * window:
+                return
+            del self._clients[client_id]
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "evicted": self.evicted,
+            "tracked_clients": len(self._clients),
+        }
+
+
+def get_client_id(scope: Scope) -> str:
+    """Identifie le client : clé API vérifiée (AuthMiddleware), sinon IP.
+
+    Une clé non vérifiée n'est jamais utilisée : changer d'en-tête ne
+    suffit pas à contourner la limite par IP."""
+    identity = request_identity(scope)
+    if identity is not None:
+        return f"key:{identity.key_id}"
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI pur : pas de tâche ni de file intermédiaire par requête,
+    les réponses streamées (SSE) passent sans être bufferisées.
+
+    Sans limites explicites, celles des Settings sont lues à la construction
+    de la pile de middlewares (au démarrage, pas à l'import). Une clé API
+    peut avoir sa propre limite (`requests_per_minute` de la table api_keys).
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        requests_per_minute: int | None = None,
+        window_seconds: int | None = None,
+        store: RateLimitStore | None = None
+    ):
+        self.app = app
+        self.requests_per_minute = (
+            settings.rate_limit_requests if requests_per_minute is None else requests_per_minute
+        )
+        self.window_seconds = settings.rate_limit_window if window_seconds is None else window_seconds
+        self.store = store or InMemoryRateLimitStore()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        identity = request_identity(scope)
+        limit = self.requests_per_minute
+        if identity is not None and identity.requests_per_minute is not None:
+            limit = identity.requests_per_minute
+
+        decision = await self.store.hit(get_client_id(scope), limit, self.window_seconds)
+
+        headers = {
+            "X-RateLimit-Limit": str(decision.limit),
+            "X-RateLimit-Remaining": str(decision.remaining),
+        }
+
+        if not decision.allowed:
+            RATE_LIMIT_REJECTED.inc()
+            response = JSONResponse(
+                status_code=429,
+                content={"detail": "Rate limit exceeded. Please wait before making more requests."},
+                headers={**headers, "Retry-After": str(decision.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+        RATE_LIMIT_ALLOWED.inc()
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).update(headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
 
 # Dans main.py
-# app.add_middleware(RateLimitMiddleware, requests_per_minute=100)
\ No newline at end of file
+# app.add_middleware(RateLimitMiddleware, requests_per_minute=100, store=InMemoryRateLimitStore())
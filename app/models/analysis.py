@@ -3,7 +3,7 @@ from fastapi import APIRouter, UploadFile, File, HTTPException
 from pydantic import BaseModel
 from typing import List, Optional
 
-from app.services.llm_service import llm_service
+from app.container import current_container
 from app.models.schemas import Message, Role
 
 router = APIRouter()
@@ -55,7 +55,7 @@ JSON (uniquement, sans markdown) :
     
     messages = [Message(role=Role.USER, content=analysis_prompt)]
     
-    result = await llm_service.complete(
+    result = await current_container().llm_service.complete(
         messages=messages,
         temperature=0.0  # Déterministe pour l'analyse
     )
@@ -93,7 +93,7 @@ Réponds avec un JSON :
 """
     
     messages = [Message(role=Role.USER, content=prompt)]
-    result = await llm_service.complete(messages=messages, temperature=0.0)
+    result = await current_container().llm_service.complete(messages=messages, temperature=0.0)
     
     import json
     return json.loads(result["content"])
\ No newline at end of file
@@ -1,9 +1,12 @@
 # SQLAlchemy models (DB)
 # app/models/database.py
-from sqlalchemy import Column, String, Text, DateTime, Integer, ForeignKey, create_engine
+from sqlalchemy import Boolean, Column, String, Text, DateTime, Integer, ForeignKey, Index, create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
+from functools import lru_cache
 
 from app.config import settings
 
@@ -30,14 +33,122 @@ class DBMessage(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     conversation = relationship("Conversation", back_populates="messages")
+    
+    # Chargement de la fin de l'historique d'une conversation
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at"),
+    )
+
+class APIKey(Base):
+    __tablename__ = "api_keys"
+    
+    id = Column(String(36), primary_key=True)
+    key_hash = Column(String(64), unique=True, nullable=False)  # SHA-256 de la clé, jamais la clé
+    name = Column(String(100), nullable=False)
+    requests_per_minute = Column(Integer, nullable=True)  # None : rate_limit_requests
+    monthly_token_budget = Column(Integer, nullable=True)  # None : illimité
+    allowed_models = Column(Text, nullable=True)  # Liste séparée par des virgules, None : tous
+    active = Column(Boolean, default=True, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UsageRecord(Base):
+    __tablename__ = "usage"
+    
+    # Une ligne par (mois, clé, utilisateur, modèle, route) ; "" si absent
+    period = Column(String(7), primary_key=True)  # YYYY-MM (UTC)
+    api_key_id = Column(String(36), primary_key=True)
+    user_id = Column(String(64), primary_key=True)
+    model = Column(String(100), primary_key=True)
+    endpoint = Column(String(200), primary_key=True)
+    requests = Column(Integer, default=0, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 # Setup
-engine = create_engine(settings.database_url)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def to_async_url(database_url: str) -> str:
+    """sqlite:// -> sqlite+aiosqlite://, postgresql:// -> postgresql+asyncpg://"""
+    url = make_url(database_url)
+    driver = ASYNC_DRIVERS.get(url.drivername)
+    if driver is None:
+        return database_url  # Déjà un driver async explicite
+    return url.set(drivername=driver).render_as_string(hide_password=False)
+
+def _engine_options(database_url: str) -> dict:
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}  # Pool statique : pas de réglage de taille
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+    }
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")  # Lectures concurrentes aux écritures
+    cursor.execute("PRAGMA synchronous=NORMAL")  # Sûr en WAL, bien moins de fsync
+    cursor.execute(f"PRAGMA busy_timeout={settings.sqlite_busy_timeout_ms}")
+    cursor.execute(f"PRAGMA cache_size=-{settings.sqlite_cache_size_kb}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def _configure(sync_engine: Engine):
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _set_sqlite_pragmas)
+
+# Moteurs créés au premier usage (pas à l'import)
+@lru_cache()
+def get_engine() -> Engine:
+    engine = create_engine(settings.database_url, **_engine_options(settings.database_url))
+    _configure(engine)
+    return engine
+
+@lru_cache()
+def get_sessionmaker() -> sessionmaker:
+    return sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+
+# Moteur async : à utiliser depuis les routes et services async
+@lru_cache()
+def get_async_engine() -> AsyncEngine:
+    async_engine = create_async_engine(
+        to_async_url(settings.database_url),
+        **_engine_options(settings.database_url)
+    )
+    _configure(async_engine.sync_engine)
+    return async_engine
+
+@lru_cache()
+def get_async_sessionmaker() -> async_sessionmaker[AsyncSession]:
+    return async_sessionmaker(get_async_engine(), expire_on_commit=False, autoflush=False)
 
 def get_db():
-    db = SessionLocal()
+    db = get_sessionmaker()()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with get_async_sessionmaker()() as db:
+        yield db
+
+async def init_db():
+    """Crée les tables manquantes."""
+    async with get_async_engine().begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+async def dispose_engines():
+    """Ferme les pools de connexions des moteurs déjà créés."""
+    if get_async_engine.cache_info().currsize:
+        await get_async_engine().dispose()
+    if get_engine.cache_info().currsize:
+        get_engine().dispose()
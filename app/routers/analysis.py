@@ -1,15 +1,96 @@
 # Endpoints analyse
 # app/routers/analysis.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel, Field
-from typing import List, Optional
-import json
-
-from app.services.llm_service import llm_service
-from app.models.schemas import Message, Role
+from typing import Any, Awaitable, Callable, List, Optional
+import asyncio
+
+from app.middleware.auth import API_KEY_HEADER
+from app.config import settings
+from app.container import current_container, get_analysis_results
+from app.services.result_store import AnalysisResultStore, etag_matches
+from app.services.scheduler import cancel_on_disconnect, priority
+from app.utils.prompts import prompts
+from app.utils.structured_output import StructuredOutputError, complete_structured
+from app.utils.tokens import count_tokens
 
 router = APIRouter()
 
+def _relocate_entities(entities: List[dict], text: str) -> List[dict]:
+    """Entités d'un texte quasi identique replacées dans `text` ; celles qui
+    n'y figurent pas sont retirées."""
+    relocated = []
+    for entity in entities:
+        if not entity["text"]:
+            continue
+        start = text.find(entity["text"], max(0, entity["start"] - 50))
+        if start < 0:
+            start = text.find(entity["text"])
+        if start >= 0:
+            relocated.append({**entity, "start": start, "end": start + len(entity["text"])})
+    return relocated
+
+
+async def stored_result(
+    request: Request,
+    response: Response,
+    operation: str,
+    prompt_names: List[str],
+    inputs: Any,
+    compute: Callable[[], Awaitable[BaseModel]],
+    cacheable: Callable[[dict], bool] = lambda result: True,
+    semantic: bool = False
+) -> dict:
+    """Résultat adressé par contenu : même opération, modèle, versions de
+    prompts et entrées -> même id, et le résultat déjà calculé est renvoyé
+    sans appel LLM. Il reste consultable en GET /api/analysis/{id}.
+
+    `semantic` : à défaut, un résultat dont le texte (`inputs["text"]`) est
+    assez proche est renvoyé, avec sa similarité (cache sémantique) et ses
+    entités replacées dans le texte de la requête."""
+    container = request.app.state.container
+    store: AnalysisResultStore = container.analysis_results
+    model = current_container().llm_service.default_model
+    prompt_keys = [prompts.get(name).key for name in prompt_names]
+    result_id = store.result_id(operation, model, prompt_keys, inputs)
+    stored = await store.get(result_id)
+
+    semantic_cache = container.semantic_cache if semantic else None
+    similarity = vector = None
+    if stored is None and semantic_cache is not None:
+        # Même espace : mêmes entrées hors texte (catégories...)
+        namespace = store.result_id(
+            operation, model, prompt_keys, {k: v for k, v in inputs.items() if k != "text"}
+        )
+        vector = await semantic_cache.embed(inputs["text"])
+        match = semantic_cache.search(namespace, vector)
+        if match is not None:
+            stored = await store.get(match.result_id)
+            if stored is None:
+                semantic_cache.discard(match)
+            else:
+                result_id, similarity = match.result_id, round(match.score, 4)
+
+    if stored is None:
+        result = (await cancel_on_disconnect(request, compute())).model_dump()
+        if not cacheable(result):
+            # Résultat partiel (erreurs par item) : renvoyé sans être conservé
+            return result
+        stored = await store.put(result_id, operation, result)
+        if vector is not None:
+            semantic_cache.add(namespace, vector, result_id)
+
+    response.headers["ETag"] = stored["etag"]
+    response.headers["Location"] = f"{request.scope.get('root_path', '')}/api/analysis/{result_id}"
+    if similarity is not None:
+        result = {**stored["result"], "id": result_id, "similarity": similarity}
+        if "entities" in result:
+            result["entities"] = _relocate_entities(result["entities"], inputs["text"])
+        return result
+    return {**stored["result"], "id": result_id}
+
+
 # Models pour l'analyse de document
 class SentimentResult(BaseModel):
     sentiment: str  # POSITIVE, NEGATIVE, NEUTRAL
@@ -25,67 +106,84 @@ class EntityResult(BaseModel):
 class AnalysisResponse(BaseModel):
     summary: str
     sentiment: SentimentResult
-    entities: List[EntityResult]
+    entities: List[EntityResult] = []
     key_points: List[str]
     tokens_used: int
 
-@router.post("/document", response_model=AnalysisResponse)
-async def analyze_document(text: str):
-    """Analyse complète d'un document."""
-
-    # Prompt d'analyse structurée
-    analysis_prompt = f"""
-Analyse le document suivant et retourne un JSON avec cette structure exacte :
-{{
-  "summary": "Résumé en 2-3 phrases",
-  "sentiment": {{
-    "sentiment": "POSITIVE|NEGATIVE|NEUTRAL",
-    "confidence": 0.0-1.0,
-    "explanation": "Explication courte"
-  }},
-  "entities": [
-    {{"text": "entité", "type": "PERSON|ORG|LOCATION|DATE", "start": 0, "end": 10}}
-  ],
-  "key_points": ["Point 1", "Point 2", "Point 3"]
-}}
-
-Document :
-{text}
-
-JSON (uniquement, sans markdown) :
-"""
-
-    messages = [Message(role=Role.USER, content=analysis_prompt)]
-
-    result = await llm_service.complete(
-        messages=messages,
-        temperature=0.0  # Déterministe pour l'analyse
-    )
+class AnalysisResult(AnalysisResponse):
+    id: Optional[str] = None
+    similarity: Optional[float] = None  # Résultat d'un texte quasi identique
+
+async def _analyze_single(text: str) -> AnalysisResponse:
+    """Analyse d'un document en un seul prompt."""
+
+    prompt = prompts.get("analysis.document").render(text=text)
 
     try:
-        # Extraire le JSON de la réponse (enlever les markdown backticks si présents)
-        content = result["content"].strip()
-        if content.startswith("```"):
-            # Enlever les markdown code blocks
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-
-        analysis = json.loads(content)
-
-        return AnalysisResponse(
-            summary=analysis["summary"],
-            sentiment=SentimentResult(**analysis["sentiment"]),
-            entities=[EntityResult(**e) for e in analysis.get("entities", [])],
-            key_points=analysis["key_points"],
-            tokens_used=result["tokens"]
+        analysis, result = await complete_structured(
+            prompt.messages(),
+            AnalysisResponse,
+            endpoint="analysis.document",
+            result_fields={"tokens_used": "tokens"},
+            temperature=0.0,  # Déterministe pour l'analyse
+            prompt_tokens=prompt.tokens
         )
-    except (json.JSONDecodeError, KeyError) as e:
+        prompt.record(result)
+        return analysis
+    except StructuredOutputError as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to parse LLM response: {str(e)}"
         )
 
+async def _analyze_chunk(text: str) -> dict:
+    return (await _analyze_single(text)).model_dump()
+
+async def analyze_text(text: str) -> AnalysisResponse:
+    """Analyse complète ; les documents longs passent par le découpage en chunks."""
+    if count_tokens(text) <= settings.analysis_chunk_tokens:
+        return await _analyze_single(text)
+    return AnalysisResponse(**await current_container().document_analyzer.analyze(text))
+
+class DocumentRequest(BaseModel):
+    text: str = Field(..., min_length=1)
+
+def _store_document(request: Request, response: Response, text: str) -> Awaitable[dict]:
+    return stored_result(
+        request, response, "document", ["analysis.document", "analysis.merge"],
+        {"text": text}, lambda: analyze_text(text), semantic=True
+    )
+
+@router.post("/document", response_model=AnalysisResult)
+async def analyze_document(
+    request: Request,
+    response: Response,
+    body: Optional[DocumentRequest] = None,
+    text: Optional[str] = Query(None, deprecated=True, description="Préférer le corps JSON")
+):
+    """Analyse complète d'un document (texte dans le corps JSON)."""
+    if body is None and not text:
+        raise HTTPException(status_code=422, detail="Missing document text")
+    return await _store_document(request, response, body.text if body is not None else text)
+
+@router.post("/document/upload", response_model=AnalysisResult)
+async def analyze_document_upload(request: Request, response: Response):
+    """Analyse d'un document envoyé en texte brut (corps lu en streaming)."""
+    parts: List[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > settings.analysis_max_document_bytes:
+            raise HTTPException(status_code=413, detail="Document too large")
+        parts.append(chunk)
+    try:
+        text = b"".join(parts).decode("utf-8")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Document must be UTF-8 text")
+    if not text.strip():
+        raise HTTPException(status_code=422, detail="Empty document")
+    return await _store_document(request, response, text)
+
 # Classification de texte
 class ClassifyRequest(BaseModel):
     text: str
@@ -96,38 +194,95 @@ class ClassifyResponse(BaseModel):
     confidence: float
     reasoning: str
 
-@router.post("/classify", response_model=ClassifyResponse)
-async def classify_text(request: ClassifyRequest):
-    """Classifie un texte dans des catégories données."""
-
-    categories_str = ", ".join(request.categories)
+class ClassifyResult(ClassifyResponse):
+    id: Optional[str] = None
+    similarity: Optional[float] = None  # Résultat d'un texte quasi identique
 
-    prompt = f"""
-Classifie le texte dans UNE des catégories suivantes : {categories_str}
-Texte : "{request.text}"
-Réponds avec un JSON :
-{{"category": "CATÉGORIE", "confidence": 0.0-1.0, "reasoning": "explication"}}
-JSON uniquement :
-"""
+async def _classify_one(text: str, categories: List[str]) -> tuple[ClassifyResponse, int]:
+    """Classification unitaire (un appel LLM par texte), avec ses tokens."""
 
-    messages = [Message(role=Role.USER, content=prompt)]
-    result = await llm_service.complete(messages=messages, temperature=0.0)
+    prompt = prompts.get("classify.single").render(categories=", ".join(categories), text=text)
 
     try:
-        content = result["content"].strip()
-        if content.startswith("```"):
-            content = content.split("```")[1]
-            if content.startswith("json"):
-                content = content[4:]
-
-        data = json.loads(content)
-        return ClassifyResponse(**data)
-    except (json.JSONDecodeError, KeyError) as e:
+        classification, result = await complete_structured(
+            prompt.messages(),
+            ClassifyResponse,
+            endpoint="analysis.classify",
+            temperature=0.0,
+            prompt_tokens=prompt.tokens
+        )
+        prompt.record(result)
+        return classification, result["tokens"]
+    except StructuredOutputError as e:
         raise HTTPException(
             status_code=500,
             detail=f"Failed to parse classification response: {str(e)}"
         )
 
+async def _classify_fallback(text: str, categories: List[str]) -> dict:
+    classification, tokens = await _classify_one(text, categories)
+    return {**classification.model_dump(), "tokens": tokens}
+
+async def classify_with_tokens(text: str, categories: List[str]) -> tuple[ClassifyResponse, int]:
+    """Classification d'un texte, regroupée en lots si `classify_batching`,
+    avec les tokens consommés (sa part de l'appel groupé)."""
+    if settings.classify_batching:
+        # Regroupé avec les requêtes concurrentes de mêmes catégories
+        data = await current_container().classify_batcher.classify(text, categories)
+        return ClassifyResponse(**data), data.get("tokens", 0)
+    return await _classify_one(text, categories)
+
+async def classify(text: str, categories: List[str]) -> ClassifyResponse:
+    return (await classify_with_tokens(text, categories))[0]
+
+@router.post("/classify", response_model=ClassifyResult)
+async def classify_text(request: ClassifyRequest, http_request: Request, response: Response):
+    """Classifie un texte dans des catégories données."""
+    return await stored_result(
+        http_request, response, "classify",
+        ["classify.single", "classify.batch"] if settings.classify_batching else ["classify.single"],
+        {"text": request.text, "categories": request.categories},
+        lambda: classify(request.text, request.categories),
+        semantic=True
+    )
+
+# Classification de plusieurs textes en un minimum d'appels
+class ClassifyBatchRequest(BaseModel):
+    texts: List[str] = Field(..., min_items=1, max_items=1000)
+    categories: List[str] = Field(..., min_items=2, max_items=10)
+
+class ClassifyBatchItem(BaseModel):
+    index: int
+    result: Optional[ClassifyResponse] = None
+    error: Optional[str] = None
+
+class ClassifyBatchResponse(BaseModel):
+    results: List[ClassifyBatchItem]
+    id: Optional[str] = None
+
+async def _classify_many(texts: List[str], categories: List[str]) -> ClassifyBatchResponse:
+    results = await current_container().classify_batcher.classify_many(texts, categories)
+
+    items = []
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            detail = getattr(result, "detail", None) or str(result)
+            items.append(ClassifyBatchItem(index=index, error=str(detail)))
+        else:
+            items.append(ClassifyBatchItem(index=index, result=ClassifyResponse(**result)))
+    return ClassifyBatchResponse(results=items)
+
+@router.post("/classify/batch", response_model=ClassifyBatchResponse)
+async def classify_batch(request: ClassifyBatchRequest, http_request: Request, response: Response):
+    """Classifie plusieurs textes, regroupés en lots dans chaque prompt."""
+    with priority("batch"):
+        return await stored_result(
+            http_request, response, "classify.batch", ["classify.batch", "classify.single"],
+            {"texts": request.texts, "categories": request.categories},
+            lambda: _classify_many(request.texts, request.categories),
+            cacheable=lambda result: not any(item["error"] for item in result["results"])
+        )
+
 # Traitement par batch
 class BatchRequest(BaseModel):
     texts: List[str] = Field(..., min_items=1, max_items=10)
@@ -141,34 +296,67 @@ class BatchResult(BaseModel):
 class BatchResponse(BaseModel):
     results: List[BatchResult]
     total_tokens: int
+    id: Optional[str] = None
+
+async def process_one(text: str, operation: str) -> BatchResult:
+    """Applique une opération simple (summarize, sentiment) à un texte."""
+    if operation not in ("summarize", "sentiment"):
+        raise HTTPException(status_code=400, detail=f"Unknown operation: {operation}")
+
+    prompt = prompts.get(f"batch.{operation}").render(text=text)
+    # Appelé aussi hors requête (jobs) : services du conteneur démarré
+    result = await current_container().llm_service.complete(
+        messages=prompt.messages(),
+        temperature=0.0,
+        prompt_tokens=prompt.tokens
+    )
+    prompt.record(result)
 
-@router.post("/batch", response_model=BatchResponse)
-async def batch_process(request: BatchRequest):
-    """Traite plusieurs textes en parallèle."""
-
-    import asyncio
-
-    async def process_one(text: str) -> BatchResult:
-        if request.operation == "summarize":
-            prompt = f"Résume en une phrase : {text}"
-        elif request.operation == "sentiment":
-            prompt = f"Sentiment (POSITIVE/NEGATIVE/NEUTRAL) : {text}\nRéponds avec juste le mot."
-        else:
-            raise HTTPException(status_code=400, detail=f"Unknown operation: {request.operation}")
-
-        messages = [Message(role=Role.USER, content=prompt)]
-        result = await llm_service.complete(messages=messages, temperature=0.0)
-
-        return BatchResult(
-            text=text[:100] + "..." if len(text) > 100 else text,
-            result=result["content"],
-            tokens=result["tokens"]
-        )
+    return BatchResult(
+        text=text[:100] + "..." if len(text) > 100 else text,
+        result=result["content"],
+        tokens=result["tokens"]
+    )
 
+async def _process_all(texts: List[str], operation: str) -> BatchResponse:
     # Traitement parallèle
-    results = await asyncio.gather(*[process_one(t) for t in request.texts])
-
+    results = await asyncio.gather(*[process_one(t, operation) for t in texts])
     return BatchResponse(
         results=results,
         total_tokens=sum(r.tokens for r in results)
     )
+
+@router.post("/batch", response_model=BatchResponse)
+async def batch_process(request: BatchRequest, http_request: Request, response: Response):
+    """Traite plusieurs textes en parallèle."""
+    if request.operation not in ("summarize", "sentiment"):
+        raise HTTPException(status_code=400, detail=f"Unknown operation: {request.operation}")
+
+    with priority("batch"):
+        return await stored_result(
+            http_request, response, f"batch.{request.operation}", [f"batch.{request.operation}"],
+            {"texts": request.texts},
+            lambda: _process_all(request.texts, request.operation)
+        )
+
+# Consultation d'un résultat par son id
+@router.get("/{result_id}")
+async def get_result(
+    result_id: str,
+    if_none_match: Optional[str] = Header(None),
+    store: AnalysisResultStore = Depends(get_analysis_results)
+):
+    """Résultat déjà calculé (id renvoyé par les POST ci-dessus).
+
+    Réponse cacheable (ETag, Cache-Control) : 304 sans corps si le client
+    a déjà cette version."""
+    stored = await store.get(result_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+    headers = {"ETag": stored["etag"], "Cache-Control": settings.analysis_results_cache_control}
+    if settings.api_keys_enabled or settings.auth_required:
+        # Résultats par client : un cache partagé ne doit pas les mélanger
+        headers["Vary"] = API_KEY_HEADER
+    if etag_matches(if_none_match, stored["etag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({**stored["result"], "id": result_id}, headers=headers)
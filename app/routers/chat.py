@@ -1,18 +1,25 @@
 # Endpoints chat
 # app/routers/chat.py
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import StreamingResponse
-from uuid import uuid4
-import json
 
+from app.config import settings
 from app.models.schemas import ChatRequest, ChatResponse, Message, Role
-from app.services.llm_service import llm_service
-from app.services.conversation import conversation_service
+from app.container import get_conversation_service, get_llm_service
+from app.services.llm_service import LLMService
+from app.services.conversation import ConversationService
+from app.services.scheduler import cancel_on_disconnect
+from app.utils.sse import DONE_FRAME, json_frame, sse_content_frames
 
 router = APIRouter()
 
 @router.post("/", response_model=ChatResponse)
-async def chat(request: ChatRequest):
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    llm_service: LLMService = Depends(get_llm_service),
+    conversation_service: ConversationService = Depends(get_conversation_service)
+):
     """Endpoint de chat simple."""
     try:
         # Construire les messages
@@ -24,19 +31,23 @@ async def chat(request: ChatRequest):
         
         # Historique de conversation (si existant)
         if request.conversation_id:
-            history = await conversation_service.get_history(request.conversation_id)
+            history = await conversation_service.get_history(
+                request.conversation_id,
+                model=llm_service.default_model
+            )
             messages.extend(history)
         else:
-            request.conversation_id = str(uuid4())
+            request.conversation_id = conversation_service.new_conversation_id()
         
         # Message utilisateur
         messages.append(Message(role=Role.USER, content=request.message))
         
-        # Appel LLM
-        result = await llm_service.complete(
+        # Appel LLM (annulé, et retiré de la file, si le client se déconnecte)
+        result = await cancel_on_disconnect(http_request, llm_service.complete(
             messages=messages,
-            temperature=request.temperature
-        )
+            temperature=request.temperature,
+            priority="chat"
+        ))
         
         # Sauvegarder dans l'historique
         await conversation_service.add_message(
@@ -55,29 +66,89 @@ async def chat(request: ChatRequest):
             model=result["model"]
         )
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/stream")
-async def chat_stream(request: ChatRequest):
+async def chat_stream(
+    request: ChatRequest,
+    llm_service: LLMService = Depends(get_llm_service),
+    conversation_service: ConversationService = Depends(get_conversation_service)
+):
     """Endpoint de chat avec streaming."""
-    
+
+    messages = []
+    if request.system_prompt:
+        messages.append(Message(role=Role.SYSTEM, content=request.system_prompt))
+
+    # Historique de conversation (si existant)
+    if request.conversation_id:
+        history = await conversation_service.get_history(
+            request.conversation_id,
+            model=llm_service.default_model
+        )
+        messages.extend(history)
+    else:
+        request.conversation_id = conversation_service.new_conversation_id()
+
+    messages.append(Message(role=Role.USER, content=request.message))
+
+    stream = await llm_service.complete(
+        messages=messages,
+        temperature=request.temperature,
+        stream=True,
+        priority="chat"
+    )
+
     async def generate():
-        messages = []
-        if request.system_prompt:
-            messages.append(Message(role=Role.SYSTEM, content=request.system_prompt))
-        messages.append(Message(role=Role.USER, content=request.message))
-        
-        async for chunk in await llm_service.complete(
-            messages=messages,
-            temperature=request.temperature,
-            stream=True
-        ):
-            yield f"data: {json.dumps({'content': chunk})}\n\n"
-        
-        yield "data: [DONE]\n\n"
-    
+        parts: list[str] = []
+
+        async def collect():
+            async for chunk in stream:
+                parts.append(chunk)
+                yield chunk
+
+        try:
+            async for frame in sse_content_frames(
+                collect(),
+                coalesce_ms=settings.sse_coalesce_ms,
+                coalesce_bytes=settings.sse_coalesce_bytes,
+                heartbeat_interval=settings.sse_heartbeat_interval
+            ):
+                yield frame
+        except Exception as e:
+            # Erreur amont après l'envoi des en-têtes : signalée dans le flux
+            # (la réponse partielle n'est pas gardée dans l'historique)
+            yield json_frame({"error": str(getattr(e, "detail", None) or e)})
+            yield DONE_FRAME
+            return
+        finally:
+            # Client déconnecté : arrêter le flux amont
+            await stream.aclose()
+
+        # Sauvegarder dans l'historique une fois la réponse complète
+        content = "".join(parts)
+        await conversation_service.add_message(
+            request.conversation_id,
+            Message(role=Role.USER, content=request.message)
+        )
+        await conversation_service.add_message(
+            request.conversation_id,
+            Message(role=Role.ASSISTANT, content=content),
+            tokens=stream.usage.completion_tokens if stream.usage else None
+        )
+
+        yield json_frame({
+            "conversation_id": request.conversation_id,
+            "tokens_used": stream.usage.total_tokens if stream.usage else 0,
+            "model": stream.model
+        })
+        yield DONE_FRAME
+
     return StreamingResponse(
         generate(),
-        media_type="text/event-stream"
-    )
\ No newline at end of file
+        media_type="text/event-stream",
+        headers={"X-Conversation-ID": request.conversation_id}
+    )
@@ -0,0 +1,150 @@
+# Endpoints jobs d'analyse en masse
+# app/routers/jobs.py
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from typing import List, Optional
+import json
+
+from app.config import settings
+from app.routers.analysis import analyze_text, classify_with_tokens, process_one
+from app.container import get_job_manager
+from app.services.jobs import JobManager, register_operation
+
+router = APIRouter()
+
+# Opérations disponibles pour les jobs
+async def _analyze(text: str, params: dict):
+    result = await analyze_text(text)
+    return result.model_dump(exclude={"tokens_used"}), result.tokens_used
+
+async def _classify(text: str, params: dict):
+    result, tokens = await classify_with_tokens(text, params["categories"])
+    return result.model_dump(), tokens
+
+async def _summarize(text: str, params: dict):
+    result = await process_one(text, "summarize")
+    return result.result, result.tokens
+
+async def _sentiment(text: str, params: dict):
+    result = await process_one(text, "sentiment")
+    return result.result, result.tokens
+
+register_operation("summarize", _summarize)
+register_operation("sentiment", _sentiment)
+register_operation("analyze", _analyze)
+register_operation("classify", _classify)
+
+class JobRequest(BaseModel):
+    operation: str = Field(..., description="summarize, sentiment, analyze or classify")
+    texts: List[str] = Field(..., min_length=1)
+    categories: Optional[List[str]] = Field(None, description="Requis pour classify")
+
+class JobStatus(BaseModel):
+    job_id: str
+    operation: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    tokens_used: int
+    created_at: str
+    finished_at: Optional[str] = None
+    results: Optional[List[dict]] = None
+
+def _submit(
+    job_manager: JobManager,
+    operation: str,
+    texts: List[str],
+    categories: Optional[List[str]]
+) -> JobStatus:
+    if operation not in job_manager.operations:
+        raise HTTPException(status_code=400, detail=f"Unknown operation: {operation}")
+    if operation == "classify" and (not categories or len(categories) < 2):
+        raise HTTPException(status_code=400, detail="classify requires at least 2 categories")
+    if not texts:
+        raise HTTPException(status_code=400, detail="No texts to process")
+    if len(texts) > settings.jobs_max_items:
+        raise HTTPException(status_code=413, detail=f"Too many items (max {settings.jobs_max_items})")
+    job = job_manager.submit(operation, texts, {"categories": categories} if categories else {})
+    return JobStatus(**job.progress())
+
+@router.post("/", response_model=JobStatus, status_code=202)
+async def submit_job(request: JobRequest, job_manager: JobManager = Depends(get_job_manager)):
+    """Soumet un job à partir d'une liste de textes."""
+    return _submit(job_manager, request.operation, request.texts, request.categories)
+
+@router.post("/jsonl", response_model=JobStatus, status_code=202)
+async def submit_jsonl_job(
+    request: Request,
+    operation: str,
+    categories: Optional[List[str]] = Query(None),
+    job_manager: JobManager = Depends(get_job_manager)
+):
+    """Soumet un job à partir d'un corps JSONL (une ligne par document).
+
+    Chaque ligne est soit une chaîne JSON, soit un objet avec un champ `text`.
+    """
+    texts: List[str] = []
+    remainder = b""
+    line_number = 0
+
+    def parse(line: bytes):
+        nonlocal line_number
+        line_number += 1
+        if not line.strip():
+            return
+        try:
+            item = json.loads(line)
+            texts.append(item if isinstance(item, str) else item["text"])
+        except (json.JSONDecodeError, KeyError, TypeError):
+            raise HTTPException(status_code=400, detail=f"Invalid JSONL at line {line_number}")
+
+    # Lecture incrémentale du corps
+    async for chunk in request.stream():
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            parse(line)
+        if len(texts) > settings.jobs_max_items:
+            raise HTTPException(status_code=413, detail=f"Too many items (max {settings.jobs_max_items})")
+    parse(remainder)
+
+    return _submit(job_manager, operation, texts, categories)
+
+@router.get("/{job_id}", response_model=JobStatus)
+async def get_job(
+    job_id: str,
+    include_results: bool = False,
+    offset: int = 0,
+    limit: int = 100,
+    job_manager: JobManager = Depends(get_job_manager)
+):
+    """Progression d'un job, avec éventuellement une page de résultats partiels."""
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    status = JobStatus(**job.progress())
+    if include_results:
+        status.results = job.results[offset:offset + limit]
+    return status
+
+@router.get("/{job_id}/results")
+async def stream_job_results(job_id: str, job_manager: JobManager = Depends(get_job_manager)):
+    """Résultats par item en NDJSON, au fil du traitement."""
+    if job_manager.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    async def generate():
+        async for result in job_manager.stream_results(job_id):
+            yield json.dumps(result, ensure_ascii=False).encode("utf-8") + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+@router.delete("/{job_id}", response_model=JobStatus)
+async def cancel_job(job_id: str, job_manager: JobManager = Depends(get_job_manager)):
+    """Annule un job en cours (les résultats déjà obtenus restent consultables)."""
+    job = await job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobStatus(**job.progress())
@@ -0,0 +1,19 @@
+# Endpoint consommation de tokens
+# app/routers/usage.py
+from fastapi import APIRouter, Depends
+
+from app.container import get_usage_ledger
+from app.middleware.auth import verify_api_key
+from app.services.api_keys import APIKeyIdentity
+from app.services.usage import UsageLedger
+
+router = APIRouter()
+
+@router.get("/")
+async def get_usage(
+    identity: APIKeyIdentity = Depends(verify_api_key),
+    usage: UsageLedger = Depends(get_usage_ledger)
+):
+    """Tokens consommés ce mois par la clé appelante (par modèle, route et
+    utilisateur), avec son budget restant."""
+    return await usage.usage(identity)
@@ -0,0 +1,215 @@
+# Clés API (base de données + cache mémoire)
+# app/services/api_keys.py
+import argparse
+import asyncio
+import hashlib
+import logging
+import secrets
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Optional
+from uuid import uuid4
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.models.database import APIKey, get_async_sessionmaker
+from app.services.coalescing import SingleFlight
+
+logger = logging.getLogger("ai_backend")
+
+
+@dataclass(frozen=True, slots=True)
+class APIKeyIdentity:
+    """Identité résolue d'une clé (jamais la clé elle-même)."""
+
+    key_id: str
+    name: str
+    requests_per_minute: Optional[int] = None
+    monthly_token_budget: Optional[int] = None
+    models: Optional[frozenset[str]] = None  # None : tous les modèles
+
+    def allows_model(self, model: str) -> bool:
+        return self.models is None or model in self.models
+
+
+# Identité de la requête courante (posée par AuthMiddleware)
+current_api_key: ContextVar[APIKeyIdentity | None] = ContextVar("current_api_key", default=None)
+# Utilisateur final déclaré par le client de la clé (en-tête X-User-ID)
+current_user_id: ContextVar[str | None] = ContextVar("current_user_id", default=None)
+
+
+def hash_api_key(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+def _identity(row: APIKey) -> APIKeyIdentity:
+    models = None
+    if row.allowed_models:
+        models = frozenset(m.strip() for m in row.allowed_models.split(",") if m.strip())
+    return APIKeyIdentity(
+        key_id=row.id,
+        name=row.name,
+        requests_per_minute=row.requests_per_minute,
+        monthly_token_budget=row.monthly_token_budget,
+        models=models
+    )
+
+
+class APIKeyStore:
+    """Clés actives gardées en mémoire, indexées par empreinte SHA-256.
+
+    La table est rechargée en entier en tâche de fond : une requête
+    authentifiée ne touche jamais la base. Une clé absente du cache est
+    refusée ; pour qu'une clé tout juste créée soit acceptée sans attendre
+    le prochain rechargement, un échec déclenche un rechargement anticipé,
+    au plus une fois toutes les `miss_refresh_seconds` : des clés
+    aléatoires en rafale ne coûtent pas plus d'une requête DB par période.
+
+    L'index porte sur l'empreinte, pas sur la clé : le temps de recherche
+    ne renseigne pas sur la clé.
+    """
+
+    def __init__(self, refresh_seconds: float | None = None, miss_refresh_seconds: float | None = None):
+        self.refresh_seconds = refresh_seconds or settings.api_keys_refresh_seconds
+        self.miss_refresh_seconds = (
+            settings.api_keys_miss_refresh_seconds if miss_refresh_seconds is None else miss_refresh_seconds
+        )
+        self._keys: dict[str, APIKeyIdentity] = {}
+        self._refreshed_at = 0.0  # time.monotonic() du dernier rechargement
+        self._refreshes = SingleFlight()
+        self._refresh_task: asyncio.Task | None = None
+        self.hits = 0
+        self.misses = 0
+        self.miss_refreshes = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+
+    async def start(self):
+        """Chargement initial puis rechargement périodique (lifespan)."""
+        await self.refresh()
+        self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                # Base indisponible : on garde les clés déjà chargées
+                self.refresh_errors += 1
+                logger.error(f"API key refresh failed: {e}")
+
+    async def refresh(self):
+        async with get_async_sessionmaker()() as db:
+            rows = (await db.scalars(select(APIKey).where(APIKey.active.is_(True)))).all()
+        # Remplacement en bloc : les lecteurs voient l'ancien ou le nouveau dict
+        self._keys = {row.key_hash: _identity(row) for row in rows}
+        self._refreshed_at = time.monotonic()
+        self.refreshes += 1
+
+    async def resolve(self, api_key: str) -> APIKeyIdentity | None:
+        """Identité de la clé, ou None si elle est inconnue ou révoquée."""
+        digest = hash_api_key(api_key)
+        identity = self._keys.get(digest)
+        if identity is not None:
+            self.hits += 1
+            return identity
+
+        self.misses += 1
+        if time.monotonic() - self._refreshed_at < self.miss_refresh_seconds:
+            return None
+        # Rechargement anticipé, partagé par les échecs concurrents
+        self.miss_refreshes += 1
+        try:
+            await self._refreshes.do("refresh", self.refresh)
+        except Exception as e:
+            self.refresh_errors += 1
+            self._refreshed_at = time.monotonic()  # Pas de nouvel essai avant la période
+            logger.error(f"API key refresh failed: {e}")
+            return None
+        return self._keys.get(digest)
+
+    def stats(self) -> dict:
+        return {
+            "keys": len(self._keys),
+            "hits": self.hits,
+            "misses": self.misses,
+            "miss_refreshes": self.miss_refreshes,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+        }
+
+
+async def create_api_key(
+    name: str,
+    requests_per_minute: int | None = None,
+    monthly_token_budget: int | None = None,
+    models: list[str] | None = None
+) -> tuple[str, APIKeyIdentity]:
+    """Crée une clé ; la clé en clair n'est renvoyée qu'ici (seule son
+    empreinte est stockée)."""
+    api_key = f"sk-{secrets.token_urlsafe(32)}"
+    row = APIKey(
+        id=str(uuid4()),
+        key_hash=hash_api_key(api_key),
+        name=name,
+        requests_per_minute=requests_per_minute,
+        monthly_token_budget=monthly_token_budget,
+        allowed_models=",".join(models) if models else None,
+        active=True
+    )
+    async with get_async_sessionmaker()() as db:
+        db.add(row)
+        await db.commit()
+    return api_key, _identity(row)
+
+
+async def revoke_api_key(key_id: str) -> bool:
+    """Désactive une clé (effective au prochain rechargement des workers)."""
+    async with get_async_sessionmaker()() as db:
+        row = await db.get(APIKey, key_id)
+        if row is None:
+            return False
+        row.active = False
+        await db.commit()
+    return True
+
+
+async def _main(args: argparse.Namespace):
+    from app.models.database import dispose_engines, init_db
+
+    await init_db()
+    try:
+        if args.command == "create":
+            api_key, identity = await create_api_key(
+                args.name, args.requests_per_minute, args.monthly_token_budget, args.models
+            )
+            print(f"id:  {identity.key_id}\nkey: {api_key}")
+        elif not await revoke_api_key(args.key_id):
+            raise SystemExit(f"Unknown key id: {args.key_id}")
+    finally:
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gestion des clés API")
+    commands = parser.add_subparsers(dest="command", required=True)
+    create = commands.add_parser("create")
+    create.add_argument("--name", required=True)
+    create.add_argument("--requests-per-minute", type=int)
+    create.add_argument("--monthly-token-budget", type=int)
+    create.add_argument("--models", nargs="+")
+    revoke = commands.add_parser("revoke")
+    revoke.add_argument("key_id")
+    asyncio.run(_main(parser.parse_args()))
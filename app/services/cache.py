@@ -0,0 +1,196 @@
+# Cache des réponses LLM
+# app/services/cache.py
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Optional, Protocol
+
+from sqlalchemy.engine import make_url
+
+
+def make_cache_key(
+    model: str,
+    messages: list[dict],
+    temperature: float,
+    max_tokens: int,
+    response_format: dict | None = None
+) -> str:
+    """Clé normalisée (model, messages, temperature, max_tokens)."""
+    payload = {
+        "model": model.strip().lower(),
+        "messages": [
+            {"role": m["role"], "content": m["content"].strip()}
+            for m in messages
+        ],
+        "temperature": round(float(temperature), 4),
+        "max_tokens": int(max_tokens),
+        "response_format": response_format,
+    }
+    raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    l2_hits: int = 0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        total = self.hits + self.misses
+        data["hit_ratio"] = round(self.hits / total, 4) if total else 0.0
+        return data
+
+
+class CacheTier(Protocol):
+    """Interface d'un niveau de cache (mémoire, SQLite, ...)."""
+
+    async def get(self, key: str) -> Optional[dict]: ...
+
+    async def set(self, key: str, value: dict, ttl: float) -> None: ...
+
+    async def clear(self) -> None: ...
+
+
+class LRUCache:
+    """Cache LRU borné en mémoire avec TTL par entrée."""
+
+    def __init__(self, max_entries: int, stats: CacheStats):
+        self._data: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+        self._max_entries = max_entries
+        self._stats = stats
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self._stats.expirations += 1
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+            self._stats.evictions += 1
+
+    async def clear(self) -> None:
+        self._data.clear()
+
+
+class SQLiteCache:
+    """Second niveau persistant, dans la base SQLite de l'application."""
+
+    def __init__(self, database_url: str, table: str = "llm_cache"):
+        if not table.isidentifier():
+            raise ValueError(f"Invalid cache table name: {table}")
+        path = make_url(database_url).database or ":memory:"
+        self._table = table
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def supports(database_url: str) -> bool:
+        return make_url(database_url).drivername.startswith("sqlite")
+
+    def _get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT value, expires_at FROM {self._table} WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < time.time():
+                self._conn.execute(f"DELETE FROM {self._table} WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+        return json.loads(row[0])
+
+    def _set(self, key: str, value: dict, ttl: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), time.time() + ttl)
+            )
+            self._conn.commit()
+
+    def _clear(self) -> None:
+        with self._lock:
+            self._conn.execute(f"DELETE FROM {self._table}")
+            self._conn.commit()
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        await asyncio.to_thread(self._set, key, value, ttl)
+
+    async def clear(self) -> None:
+        await asyncio.to_thread(self._clear)
+
+
+class ResponseCache:
+    """Cache à deux niveaux : LRU en mémoire puis SQLite (optionnel)."""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 3600,
+        database_url: Optional[str] = None,
+        table: str = "llm_cache"
+    ):
+        self.stats = CacheStats()
+        self._ttl = ttl_seconds
+        self._memory = LRUCache(max_entries, self.stats)
+        self._persistent: Optional[CacheTier] = None
+        if database_url and SQLiteCache.supports(database_url):
+            self._persistent = SQLiteCache(database_url, table)
+
+    async def get(self, key: str) -> Optional[dict]:
+        value = await self._memory.get(key)
+        if value is None and self._persistent is not None:
+            value = await self._persistent.get(key)
+            if value is not None:
+                self.stats.l2_hits += 1
+                # Remonter l'entrée dans le niveau mémoire
+                await self._memory.set(key, value, self._ttl)
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+        return value
+
+    async def set(self, key: str, value: dict) -> None:
+        await self._memory.set(key, value, self._ttl)
+        if self._persistent is not None:
+            await self._persistent.set(key, value, self._ttl)
+
+    async def clear(self) -> None:
+        await self._memory.clear()
+        if self._persistent is not None:
+            await self._persistent.clear()
+
+    def get_stats(self) -> dict:
+        return {**self.stats.to_dict(), "size": len(self._memory)}
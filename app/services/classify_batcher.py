@@ -0,0 +1,203 @@
+# Classification par lots (micro-batching)
+# app/services/classify_batcher.py
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, Dict, List, Sequence, Set
+
+from app.config import settings
+from app.container import current_container
+from app.services.api_keys import current_api_key
+from app.utils.prompts import Rendered, prompts
+from app.utils.structured_output import StructuredOutputError, parse_json, response_format_for
+from app.utils.tokens import count_tokens
+
+logger = logging.getLogger("ai_backend")
+
+# Classification unitaire, utilisée en repli : (texte, catégories) -> dict (avec "tokens")
+SingleClassifier = Callable[[str, List[str]], Awaitable[dict]]
+
+# Tokens de réponse prévus par item du lot
+RESPONSE_TOKENS_PER_ITEM = 80
+
+
+def build_batch_prompt(texts: Sequence[str], categories: Sequence[str]) -> Rendered:
+    items = "\n".join(f"[{i}] {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts))
+    return prompts.get("classify.batch").render(categories=", ".join(categories), items=items)
+
+
+def parse_batch_response(content: str, size: int) -> Dict[int, dict]:
+    """Résultats valides par index ; les items illisibles sont absents."""
+    try:
+        data = parse_json(content)
+    except StructuredOutputError:
+        return {}
+    if isinstance(data, dict):
+        data = data.get("results", [])
+    if not isinstance(data, list):
+        return {}
+
+    results: Dict[int, dict] = {}
+    for position, item in enumerate(data):
+        if not isinstance(item, dict):
+            continue
+        index = item.get("index", position)
+        if not isinstance(index, int) or not 0 <= index < size:
+            continue
+        if all(key in item for key in ("category", "confidence", "reasoning")):
+            results[index] = {
+                "category": item["category"],
+                "confidence": item["confidence"],
+                "reasoning": item["reasoning"],
+            }
+    return results
+
+
+class ClassificationBatcher:
+    """Regroupe plusieurs classifications en un seul appel LLM.
+
+    Les requêtes concurrentes d'une même clé API ayant les mêmes catégories
+    sont accumulées pendant `window_ms` (ou jusqu'à `max_items` /
+    `max_tokens`) puis envoyées ensemble. Les items dont la réponse est illisible sont reclassés un par
+    un via `fallback`.
+
+    Chaque résultat porte `tokens` : sa part des tokens de l'appel groupé
+    (ou ceux de son appel unitaire).
+    """
+
+    def __init__(
+        self,
+        fallback: SingleClassifier,
+        window_ms: float | None = None,
+        max_items: int | None = None,
+        max_tokens: int | None = None
+    ):
+        self._fallback = fallback
+        self._window = (window_ms if window_ms is not None else settings.classify_batch_window_ms) / 1000
+        self._max_items = max_items or settings.classify_batch_max_items
+        self._max_tokens = max_tokens or settings.classify_batch_max_tokens
+        # (clé API, catégories) -> [(texte, tokens, future)]
+        self._pending: Dict[tuple, list] = {}
+        self._pending_tokens: Dict[tuple, int] = {}
+        self._timers: Dict[tuple, asyncio.TimerHandle] = {}
+        # Lots en cours : référencés pour ne pas être collectés, et attendus à l'arrêt
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "upstream_calls": 0, "fallbacks": 0}
+
+    async def classify(self, text: str, categories: List[str]) -> dict:
+        """Classifie un texte via le prochain lot pour ces catégories."""
+        self.stats["requests"] += 1
+        # Un lot par clé API : l'appel groupé tourne dans le contexte de
+        # l'appelant (budget, modèles autorisés, décompte d'usage)
+        identity = current_api_key.get()
+        key = (identity.key_id if identity else "", tuple(categories))
+        tokens = count_tokens(text)
+
+        if key in self._pending and self._pending_tokens[key] + tokens > self._max_tokens:
+            self._flush(key)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self._pending.setdefault(key, [])
+        batch.append((text, tokens, future))
+        self._pending_tokens[key] = self._pending_tokens.get(key, 0) + tokens
+
+        if len(batch) >= self._max_items:
+            self._flush(key)
+        elif len(batch) == 1:
+            self._timers[key] = loop.call_later(self._window, self._flush, key)
+
+        return await future
+
+    def _flush(self, key: tuple):
+        batch = self._pending.pop(key, None)
+        self._pending_tokens.pop(key, None)
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        if batch:
+            task = asyncio.create_task(self._run(list(key[1]), batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        """Envoie les lots en attente et attend les lots en cours (arrêt)."""
+        for key in list(self._pending):
+            self._flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, categories: List[str], batch: list):
+        texts = [text for text, _, _ in batch]
+        try:
+            results = await self.classify_many(texts, categories)
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, _, future), result in zip(batch, results):
+            if future.done():
+                continue  # Appelant annulé
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    async def classify_many(
+        self,
+        texts: List[str],
+        categories: List[str]
+    ) -> List[dict | Exception]:
+        """Classifie une liste de textes en lots bornés par le budget de tokens."""
+        packs: List[List[int]] = [[]]
+        pack_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = count_tokens(text)
+            if packs[-1] and (
+                pack_tokens + tokens > self._max_tokens or len(packs[-1]) >= self._max_items
+            ):
+                packs.append([])
+                pack_tokens = 0
+            packs[-1].append(index)
+            pack_tokens += tokens
+
+        results: List[dict | Exception] = [None] * len(texts)
+        packed = await asyncio.gather(*[
+            self._classify_pack([texts[i] for i in pack], categories) for pack in packs if pack
+        ])
+        for pack, pack_results in zip(packs, packed):
+            for index, result in zip(pack, pack_results):
+                results[index] = result
+        return results
+
+    async def _classify_pack(self, texts: List[str], categories: List[str]) -> List[dict | Exception]:
+        parsed: Dict[int, dict] = {}
+        if len(texts) > 1:
+            self.stats["upstream_calls"] += 1
+            prompt = build_batch_prompt(texts, categories)
+            llm_service = current_container().llm_service
+            try:
+                result = await llm_service.complete(
+                    messages=prompt.messages(),
+                    temperature=0.0,
+                    max_tokens=RESPONSE_TOKENS_PER_ITEM * len(texts),
+                    response_format=response_format_for(llm_service.default_model),
+                    prompt_tokens=prompt.tokens
+                )
+                prompt.record(result)
+                parsed = parse_batch_response(result["content"], len(texts))
+                # Tokens de l'appel répartis entre les items lus
+                share, extra = divmod(result["tokens"], len(parsed) or 1)
+                for position, index in enumerate(sorted(parsed)):
+                    parsed[index]["tokens"] = share + (1 if position < extra else 0)
+            except Exception as e:
+                logger.warning(f"Batched classification failed, falling back: {e}")
+
+        # Repli unitaire pour les items manquants
+        missing = [i for i in range(len(texts)) if i not in parsed]
+        if missing:
+            self.stats["fallbacks"] += len(missing)
+            fallbacks = await asyncio.gather(
+                *[self._fallback(texts[i], categories) for i in missing],
+                return_exceptions=True
+            )
+            parsed.update(zip(missing, fallbacks))
+        return [parsed[i] for i in range(len(texts))]
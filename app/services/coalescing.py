@@ -0,0 +1,156 @@
+# Coalescence des requêtes LLM identiques (single-flight)
+# app/services/coalescing.py
+import asyncio
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncGenerator, AsyncIterator, Awaitable, Callable, Optional
+
+
+@dataclass
+class CoalesceStats:
+    requests: int = 0
+    upstream_calls: int = 0
+    coalesced: int = 0
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["coalesce_ratio"] = (
+            round(self.coalesced / self.requests, 4) if self.requests else 0.0
+        )
+        return data
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Partage un seul appel amont entre les appelants identiques concurrents.
+
+    L'appel tourne dans sa propre tâche : l'annulation d'un appelant ne
+    l'interrompt pas tant qu'il reste d'autres appelants en attente.
+    """
+
+    def __init__(self):
+        self._inflight: dict[str, _Flight] = {}
+        self.stats = CoalesceStats()
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.stats.requests += 1
+        flight = self._inflight.get(key)
+        if flight is None:
+            self.stats.upstream_calls += 1
+            flight = _Flight(asyncio.ensure_future(fn()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.stats.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            # Plus personne n'attend : inutile de continuer l'appel amont. La
+            # clé est libérée tout de suite : un nouvel appelant ne doit pas
+            # rejoindre un appel en cours d'annulation
+            if flight.waiters == 0 and not flight.task.done():
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+
+class _SharedStream:
+    """Flux amont partagé : les chunks déjà reçus sont bufferisés pour être rejoués."""
+
+    def __init__(self):
+        self.chunks: list[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.cond = asyncio.Condition()
+
+
+class StreamCoalescer:
+    """Permet aux flux identiques de s'attacher à un flux amont en cours."""
+
+    def __init__(self):
+        self._streams: dict[str, _SharedStream] = {}
+        self.stats = CoalesceStats()
+
+    def subscribe(
+        self,
+        key: str,
+        factory: Callable[[], AsyncGenerator[str, None]]
+    ) -> AsyncIterator[str]:
+        self.stats.requests += 1
+        shared = self._streams.get(key)
+        if shared is None:
+            self.stats.upstream_calls += 1
+            shared = _SharedStream()
+            self._streams[key] = shared
+            shared.task = asyncio.ensure_future(self._pump(key, shared, factory))
+        else:
+            self.stats.coalesced += 1
+        return self._replay(key, shared)
+
+    async def _pump(
+        self,
+        key: str,
+        shared: _SharedStream,
+        factory: Callable[[], AsyncGenerator[str, None]]
+    ):
+        upstream = factory()
+        try:
+            async for chunk in upstream:
+                async with shared.cond:
+                    shared.chunks.append(chunk)
+                    shared.cond.notify_all()
+        except asyncio.CancelledError:
+            shared.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            shared.error = e
+        finally:
+            # Fermeture explicite (annulation comprise) : libère la connexion
+            # HTTP et la réservation de l'ordonnanceur sans attendre le GC
+            await upstream.aclose()
+            # Les nouveaux appelants ne doivent plus rejoindre ce flux
+            if self._streams.get(key) is shared:
+                del self._streams[key]
+            shared.done = True
+            async with shared.cond:
+                shared.cond.notify_all()
+
+    async def _replay(self, key: str, shared: _SharedStream) -> AsyncIterator[str]:
+        # Compté au premier pas du générateur : un flux jamais itéré ne
+        # retient pas le flux amont
+        index = 0
+        shared.subscribers += 1
+        try:
+            while True:
+                while index < len(shared.chunks):
+                    yield shared.chunks[index]
+                    index += 1
+                if shared.done:
+                    if shared.error is not None:
+                        raise shared.error
+                    return
+                async with shared.cond:
+                    await shared.cond.wait_for(
+                        lambda: shared.done or len(shared.chunks) > index
+                    )
+        finally:
+            shared.subscribers -= 1
+            if shared.subscribers == 0 and shared.task and not shared.task.done():
+                # Retiré avant l'annulation (qui attend la fermeture de l'amont)
+                if self._streams.get(key) is shared:
+                    del self._streams[key]
+                shared.task.cancel()
@@ -1,57 +1,589 @@
 # Gestion conversations
 # app/services/conversation.py
-from typing import Dict, List
-from datetime import datetime, timedelta
-from app.models.schemas import Message
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+from collections import OrderedDict, deque
+from datetime import datetime
+from functools import partial
+from uuid import uuid4
+from sqlalchemy import insert, select, update
+from app.config import settings
+from app.models.database import Conversation, DBMessage, get_async_sessionmaker
+from app.models.schemas import Message, Role
+from app.services.llm_service import LLMService
+from app.utils.prompts import prompts
+from app.utils.tokens import count_message_tokens
 import asyncio
+import json
+import logging
+import sys
+import time
+import zlib
+
+logger = logging.getLogger("ai_backend")
+
+# Préfixe du message système qui porte le résumé
+SUMMARY_PREFIX = "Résumé de la conversation précédente : "
+
+# Résume (messages évincés, résumé précédent) en un texte court
+Summarizer = Callable[[List[Message], Optional[str]], Awaitable[str]]
+
+
+class _Turn:
+    """Message stocké : le rôle est le membre (unique) de l'enum Role, pas
+    une copie de chaîne ; le Message Pydantic n'est construit qu'à la lecture."""
+
+    __slots__ = ("role", "content", "tokens")
+
+    def __init__(self, role: Role, content: str, tokens: int):
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+    def message(self) -> Message:
+        return Message.model_construct(role=self.role, content=self.content)
+
+
+class _History:
+    """Historique d'une conversation, avec le nombre de tokens de chaque message.
+
+    Une conversation inactive peut être compressée : ses messages sont
+    sérialisés dans `packed` (zlib) et la deque est libérée.
+    """
+
+    __slots__ = (
+        "system", "messages", "tokens", "summary", "summary_tokens", "pending", "summarizing",
+        "last_access", "size", "packed"
+    )
+
+    def __init__(self):
+        self.system: Optional[_Turn] = None
+        self.messages: Optional[Deque[_Turn]] = deque()
+        self.tokens = 0
+        self.summary: Optional[str] = None
+        self.summary_tokens = 0  # Tokens du message de résumé (préfixe compris)
+        self.pending: List[Message] = []
+        self.summarizing = False
+        self.last_access = 0.0  # time.monotonic()
+        self.size = 0  # Octets estimés, tels que comptés dans le total du service
+        self.packed: Optional[bytes] = None
+
+    def measure(self) -> int:
+        """Taille mémoire estimée (objets, chaînes, deque)."""
+        size = _HISTORY_BYTES
+        if self.summary:
+            size += sys.getsizeof(self.summary)
+        if self.packed is not None:
+            return size + sys.getsizeof(self.packed)
+        size += _DEQUE_BYTES + sum(_TURN_BYTES + sys.getsizeof(t.content) for t in self.messages)
+        if self.system is not None:
+            size += _TURN_BYTES + sys.getsizeof(self.system.content)
+        return size
+
+    def pack(self):
+        turns = [[t.role.value, t.tokens, t.content] for t in self.messages]
+        system = self.system and [self.system.role.value, self.system.tokens, self.system.content]
+        self.packed = zlib.compress(json.dumps([system, turns], ensure_ascii=False).encode("utf-8"))
+        self.system = None
+        self.messages = None
+
+    def unpack(self):
+        system, turns = json.loads(zlib.decompress(self.packed))
+        self.system = _Turn(Role(system[0]), system[2], system[1]) if system else None
+        self.messages = deque(_Turn(Role(role), content, tokens) for role, tokens, content in turns)
+        self.packed = None
+
+
+# Surcoûts fixes pour l'estimation (pointeur dans la deque, entrée de l'OrderedDict et clé uuid)
+_TURN_BYTES = sys.getsizeof(_Turn(Role.USER, "", 0)) + 8
+_DEQUE_BYTES = sys.getsizeof(deque())
+_HISTORY_BYTES = sys.getsizeof(_History()) + sys.getsizeof([]) + 200
+
+
+async def summarize_with_llm(llm_service: LLMService, messages: List[Message], previous: Optional[str]) -> str:
+    """Résumé glissant des anciens tours via le LLM."""
+    transcript = "\n".join(f"{m.role.value}: {m.content}" for m in messages)
+    prompt = prompts.get("conversation.summary").render(previous=previous or "(aucun)", transcript=transcript)
+    result = await llm_service.complete(
+        messages=prompt.messages(),
+        temperature=0.0,
+        max_tokens=300,
+        prompt_tokens=prompt.tokens
+    )
+    prompt.record(result)
+    return result["content"].strip()
+
 
 class ConversationService:
-    """Gestion des conversations en mémoire (pour démo)."""
-    
-    def __init__(self, max_messages: int = 20, ttl_minutes: int = 60):
-        self._conversations: Dict[str, List[Message]] = {}
-        self._timestamps: Dict[str, datetime] = {}
+    """Gestion des conversations en mémoire (pour démo).
+
+    L'historique est borné par un budget de tokens (par modèle) ; le message
+    système initial est toujours conservé. En mode résumé, les tours évincés
+    sont compactés en arrière-plan dans un message de résumé.
+
+    Les conversations sont rangées par dernier accès (LRU, la plus ancienne
+    en tête) : l'expiration est vérifiée à l'accès, et les conversations
+    expirées sont retirées par la tête, quelques-unes à chaque écriture et
+    par le balayage périodique, qui ne parcourt que celles-là. Au-delà de
+    `max_memory_mb` (taille estimée), les moins récemment utilisées sont
+    évincées. Avec `compress_after_seconds`, les conversations inactives
+    passent dans une seconde LRU, compressées (zlib), et sont décompressées
+    au prochain accès.
+    """
+
+    # Nombre max de conversations expirées retirées par écriture
+    EVICT_BATCH = 8
+    # Le balayage rend la main à la boucle tous les SWEEP_CHUNK traitements
+    SWEEP_CHUNK = 100
+
+    def __init__(
+        self,
+        max_messages: int = 20,
+        ttl_minutes: int | None = None,
+        token_budget: int | None = None,
+        model_token_budgets: Dict[str, int] | None = None,
+        summarizer: Summarizer | None = None,
+        max_memory_mb: float | None = None,
+        compress_after_seconds: float | None = None,
+        sweep_interval: float | None = None
+    ):
+        # conversation_id -> historique, du moins au plus récemment utilisé
+        self._hot: "OrderedDict[str, _History]" = OrderedDict()
+        self._cold: "OrderedDict[str, _History]" = OrderedDict()  # Compressées, même ordre
         self._max_messages = max_messages
-        self._ttl = timedelta(minutes=ttl_minutes)
-        
-        # Cleanup automatique
-        asyncio.create_task(self._cleanup_loop())
-    
-    async def get_history(self, conversation_id: str) -> List[Message]:
-        """Récupère l'historique d'une conversation."""
-        return self._conversations.get(conversation_id, [])
-    
-    async def add_message(self, conversation_id: str, message: Message):
+        self._ttl = (ttl_minutes or settings.conversation_ttl_minutes) * 60
+        self._token_budget = token_budget or settings.history_token_budget
+        self._model_token_budgets = (
+            model_token_budgets if model_token_budgets is not None
+            else settings.history_model_token_budgets
+        )
+        # Stockage borné au plus grand budget : chaque modèle est tronqué à la lecture
+        self._storage_budget = max([self._token_budget, *self._model_token_budgets.values()])
+        self._summarizer = summarizer
+        max_memory_mb = settings.conversation_max_memory_mb if max_memory_mb is None else max_memory_mb
+        self._max_bytes = int(max_memory_mb * 2 ** 20)
+        self._compress_after = (
+            settings.conversation_compress_after_seconds if compress_after_seconds is None
+            else compress_after_seconds
+        )
+        self._sweep_interval = sweep_interval or settings.conversation_sweep_interval
+        self._memory = 0
+        self._cleanup_task: asyncio.Task | None = None
+        # Résumés en cours : référencés, et annulés à l'arrêt
+        self._summaries: set[asyncio.Task] = set()
+        self.expired = 0
+        self.evicted = 0
+        self.compressions = 0
+        self.decompressions = 0
+
+    def new_conversation_id(self) -> str:
+        """Crée une conversation vide (connue comme nouvelle : rien à charger)."""
+        conversation_id = str(uuid4())
+        history = self._create(conversation_id)
+        self._evict(history.last_access)
+        return conversation_id
+
+    def token_budget(self, model: str | None = None) -> int:
+        """Budget de tokens de l'historique pour un modèle."""
+        if model and model in self._model_token_budgets:
+            return self._model_token_budgets[model]
+        return self._token_budget
+
+    def _lookup(self, conversation_id: str) -> Optional[_History]:
+        """Conversation non expirée, replacée en fin de LRU (décompressée si besoin)."""
+        now = time.monotonic()
+        history = self._hot.get(conversation_id)
+        if history is not None:
+            if now - history.last_access > self._ttl:
+                self._remove(self._hot, conversation_id)
+                self.expired += 1
+                return None
+            self._hot.move_to_end(conversation_id)
+        else:
+            history = self._cold.get(conversation_id)
+            if history is None:
+                return None
+            if now - history.last_access > self._ttl:
+                self._remove(self._cold, conversation_id)
+                self.expired += 1
+                return None
+            del self._cold[conversation_id]
+            history.unpack()
+            self.decompressions += 1
+            self._hot[conversation_id] = history
+            self._resize(history)
+        history.last_access = now
+        return history
+
+    def _create(self, conversation_id: str) -> _History:
+        history = _History()
+        history.last_access = time.monotonic()
+        self._hot[conversation_id] = history
+        self._resize(history)
+        return history
+
+    def _resize(self, history: _History):
+        size = history.measure()
+        self._memory += size - history.size
+        history.size = size
+
+    def _remove(self, lru: "OrderedDict[str, _History]", conversation_id: str):
+        self._memory -= lru.pop(conversation_id).size
+
+    def _evict(self, now: float):
+        # Expirées : quelques-unes par appel, depuis la tête des LRU
+        for lru in (self._cold, self._hot):
+            for _ in range(self.EVICT_BATCH):
+                if not lru:
+                    break
+                conversation_id, history = next(iter(lru.items()))
+                if now - history.last_access <= self._ttl:
+                    break
+                self._remove(lru, conversation_id)
+                self.expired += 1
+        # Plafond mémoire : compressées d'abord, jamais la conversation courante (en fin de LRU)
+        while self._max_bytes and self._memory > self._max_bytes and len(self._hot) + len(self._cold) > 1:
+            lru = self._cold or self._hot
+            self._remove(lru, next(iter(lru)))
+            self.evicted += 1
+
+    async def get_history(self, conversation_id: str, model: str | None = None) -> List[Message]:
+        """Récupère l'historique d'une conversation, tronqué au budget du modèle."""
+        history = self._lookup(conversation_id)
+        if history is None:
+            return []
+
+        budget = self.token_budget(model)
+        head: List[Message] = []
+        if history.system is not None:
+            head.append(history.system.message())
+            budget -= history.system.tokens
+        if history.summary:
+            head.append(Message.model_construct(role=Role.SYSTEM, content=SUMMARY_PREFIX + history.summary))
+            budget -= history.summary_tokens
+
+        # Messages les plus récents qui tiennent dans le budget
+        tail: List[Message] = []
+        for turn in reversed(history.messages):
+            if turn.tokens > budget:
+                break
+            tail.append(turn.message())
+            budget -= turn.tokens
+        tail.reverse()
+        return head + tail
+
+    async def add_message(self, conversation_id: str, message: Message, tokens: int | None = None):
         """Ajoute un message à une conversation."""
-        if conversation_id not in self._conversations:
-            self._conversations[conversation_id] = []
-        
-        self._conversations[conversation_id].append(message)
-        self._timestamps[conversation_id] = datetime.now()
-        
-        # Limiter la taille
-        if len(self._conversations[conversation_id]) > self._max_messages:
-            # Garder le premier (system) et les plus récents
-            self._conversations[conversation_id] = (
-                self._conversations[conversation_id][:1] +
-                self._conversations[conversation_id][-(self._max_messages-1):]
-            )
-    
+        history = self._lookup(conversation_id) or self._create(conversation_id)
+
+        if tokens is None:
+            tokens = count_message_tokens(message.content)
+        turn = _Turn(Role(message.role), message.content, tokens)
+
+        # Le premier message système est épinglé
+        if message.role == Role.SYSTEM and history.system is None and not history.messages:
+            history.system = turn
+        else:
+            history.messages.append(turn)
+            history.tokens += tokens
+
+            # Limiter la taille (nombre de messages et budget de tokens)
+            evicted: List[Message] = []
+            while history.messages and (
+                len(history.messages) > self._max_messages
+                or history.tokens > self._storage_budget
+            ):
+                old = history.messages.popleft()
+                history.tokens -= old.tokens
+                evicted.append(old.message())
+
+            if evicted and self._summarizer is not None:
+                history.pending.extend(evicted)
+                if not history.summarizing:
+                    history.summarizing = True
+                    task = asyncio.create_task(self._summarize(history))
+                    self._summaries.add(task)
+                    task.add_done_callback(self._summaries.discard)
+
+        self._resize(history)
+        self._evict(history.last_access)
+
+    async def _summarize(self, history: _History):
+        """Compacte les messages évincés dans le résumé (hors chemin de requête).
+        La taille du résumé est comptée au prochain ajout."""
+        try:
+            while history.pending:
+                batch, history.pending = history.pending, []
+                summary = await self._summarizer(batch, history.summary)
+                history.summary = summary
+                history.summary_tokens = count_message_tokens(SUMMARY_PREFIX + summary)
+        except Exception as e:
+            logger.warning(f"Conversation summary failed: {e}")
+        finally:
+            history.summarizing = False
+
     async def clear_conversation(self, conversation_id: str):
         """Supprime une conversation."""
-        self._conversations.pop(conversation_id, None)
-        self._timestamps.pop(conversation_id, None)
-    
+        for lru in (self._hot, self._cold):
+            if conversation_id in lru:
+                self._remove(lru, conversation_id)
+
+    async def start(self):
+        """Appelé au démarrage de l'application (lifespan)."""
+        # Expiration et compression en tâche de fond
+        self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def close(self):
+        """Appelé à l'arrêt de l'application."""
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+        for task in list(self._summaries):
+            task.cancel()
+        if self._summaries:
+            await asyncio.gather(*self._summaries, return_exceptions=True)
+
     async def _cleanup_loop(self):
-        """Nettoie les conversations expirées."""
         while True:
-            await asyncio.sleep(300)  # Check toutes les 5 minutes
-            now = datetime.now()
-            expired = [
-                cid for cid, ts in self._timestamps.items()
-                if now - ts > self._ttl
-            ]
-            for cid in expired:
-                await self.clear_conversation(cid)
-
-conversation_service = ConversationService()
\ No newline at end of file
+            await asyncio.sleep(self._sweep_interval)
+            await self.sweep()
+
+    async def sweep(self):
+        """Retire les conversations expirées et compresse les inactives.
+
+        Les deux LRU sont parcourues depuis la tête et le parcours s'arrête à
+        la première conversation encore active : le coût suit le nombre de
+        conversations traitées, pas le nombre total.
+        """
+        now = time.monotonic()
+        done = 0
+        for lru in (self._cold, self._hot):
+            while lru:
+                conversation_id, history = next(iter(lru.items()))
+                if now - history.last_access <= self._ttl:
+                    break
+                self._remove(lru, conversation_id)
+                self.expired += 1
+                done += 1
+                if done % self.SWEEP_CHUNK == 0:
+                    await asyncio.sleep(0)
+
+        if not self._compress_after:
+            return
+        while self._hot:
+            conversation_id, history = next(iter(self._hot.items()))
+            # Un résumé en cours écrit dans l'historique : compressé au prochain passage
+            if now - history.last_access < self._compress_after or history.summarizing:
+                break
+            del self._hot[conversation_id]
+            history.pack()
+            self._resize(history)
+            # Compressées dans l'ordre des accès : la LRU froide reste ordonnée
+            self._cold[conversation_id] = history
+            self.compressions += 1
+            done += 1
+            if done % self.SWEEP_CHUNK == 0:
+                await asyncio.sleep(0)
+
+    def stats(self) -> dict:
+        return {
+            "conversations": len(self._hot) + len(self._cold),
+            "compressed": len(self._cold),
+            "memory_bytes": self._memory,
+            "max_memory_bytes": self._max_bytes,
+            "expired": self.expired,
+            "evicted": self.evicted,
+            "compressions": self.compressions,
+            "decompressions": self.decompressions,
+        }
+
+_last_message_ns = 0
+
+
+def _message_id() -> str:
+    """Id de message strictement croissant dans le processus (36 caractères max) :
+    préfixe en nanosecondes, suffixe aléatoire."""
+    global _last_message_ns
+    _last_message_ns = max(time.time_ns(), _last_message_ns + 1)
+    return f"{_last_message_ns:016x}-{uuid4().hex[:19]}"
+
+
+class PersistentConversationService(ConversationService):
+    """Conversations persistées en base, avec cache mémoire chaud.
+
+    Les messages sont écrits en différé (write-behind) : ils sont bufferisés
+    puis insérés par lots, à intervalle régulier, dès que le lot atteint
+    `flush_batch_size`, et à l'arrêt via `close()`. Une conversation absente
+    du cache est rechargée depuis la base (uniquement la fin de l'historique),
+    complétée des messages pas encore écrits ; les ids sans historique sont
+    mémorisés un temps pour ne pas interroger la base à chaque tour.
+    """
+
+    # Ids connus sans historique en base : durée et nombre max
+    MISSING_TTL = 60.0
+    MISSING_MAX_ENTRIES = 10_000
+
+    def __init__(
+        self,
+        flush_interval: float | None = None,
+        flush_batch_size: int | None = None,
+        **kwargs
+    ):
+        super().__init__(**kwargs)
+        self._flush_interval = flush_interval or settings.conversation_flush_interval
+        self._flush_batch_size = flush_batch_size or settings.conversation_flush_batch_size
+        self._buffer: List[dict] = []  # Lignes `messages` pas encore écrites
+        self._writing: List[dict] = []  # Lot en cours d'écriture (pas encore commité)
+        # conversation_id -> expiration (monotonic), la plus ancienne en tête
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._flush_lock = asyncio.Lock()
+        self._size_flush: asyncio.Task | None = None
+        self._flush_task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+
+    async def get_history(self, conversation_id: str, model: str | None = None) -> List[Message]:
+        await self._ensure_loaded(conversation_id)
+        return await super().get_history(conversation_id, model)
+
+    async def add_message(self, conversation_id: str, message: Message, tokens: int | None = None):
+        await self._ensure_loaded(conversation_id)
+        if tokens is None:
+            tokens = count_message_tokens(message.content)
+        await super().add_message(conversation_id, message, tokens)
+        self._missing.pop(conversation_id, None)
+
+        self._buffer.append({
+            "id": _message_id(),
+            "conversation_id": conversation_id,
+            "role": message.role.value,
+            "content": message.content,
+            "tokens": tokens,
+            "created_at": datetime.utcnow(),
+        })
+        if len(self._buffer) >= self._flush_batch_size and (
+            self._size_flush is None or self._size_flush.done()
+        ):
+            self._size_flush = asyncio.create_task(self.flush())
+
+    def _unwritten(self, conversation_id: str) -> List[dict]:
+        """Messages pas encore commités : lot en cours d'écriture puis buffer."""
+        return [m for m in self._writing + self._buffer if m["conversation_id"] == conversation_id]
+
+    async def _ensure_loaded(self, conversation_id: str):
+        if self._lookup(conversation_id) is not None:
+            return
+        expires = self._missing.get(conversation_id)
+        if expires is not None:
+            if expires > time.monotonic():
+                return
+            del self._missing[conversation_id]
+
+        # Relevé avant la requête : un lot commité pendant celle-ci n'y figure
+        # peut-être pas, et n'est plus dans le buffer ensuite
+        unwritten = self._unwritten(conversation_id)
+        rows = await self._load_tail(conversation_id, self._max_messages)
+        unwritten += self._unwritten(conversation_id)
+        if self._lookup(conversation_id) is not None:
+            return
+
+        seen = {row[0] for row in rows}
+        for m in unwritten:
+            if m["id"] not in seen:
+                seen.add(m["id"])
+                rows.append((m["id"], m["role"], m["content"], m["tokens"]))
+        if not rows:
+            self._missing[conversation_id] = time.monotonic() + self.MISSING_TTL
+            while len(self._missing) > self.MISSING_MAX_ENTRIES:
+                self._missing.popitem(last=False)
+            return
+        for _, role, content, tokens in rows:
+            await ConversationService.add_message(
+                self, conversation_id, Message(role=Role(role), content=content), tokens
+            )
+
+    @staticmethod
+    async def _load_tail(conversation_id: str, limit: int) -> list[tuple[str, str, str, int | None]]:
+        """Derniers messages (id, rôle, contenu, tokens), via l'index
+        (conversation_id, created_at) ; l'id, croissant, départage les
+        messages de même horodatage."""
+        async with get_async_sessionmaker()() as db:
+            rows = (await db.execute(
+                select(DBMessage.id, DBMessage.role, DBMessage.content, DBMessage.tokens)
+                .where(DBMessage.conversation_id == conversation_id)
+                .order_by(DBMessage.created_at.desc(), DBMessage.id.desc())
+                .limit(limit)
+            )).all()
+        return [tuple(row) for row in reversed(rows)]
+
+    async def flush(self):
+        """Écrit les messages bufferisés en un seul commit."""
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            self._writing = batch
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                # Remettre le lot en tête du buffer pour le prochain essai
+                self._buffer[:0] = batch
+                logger.error(f"Conversation flush failed ({len(batch)} messages): {e}")
+            except BaseException:
+                # Annulé en cours d'écriture : le lot n'est pas perdu
+                self._buffer[:0] = batch
+                raise
+            finally:
+                self._writing = []
+
+    @staticmethod
+    async def _write_batch(batch: List[dict]):
+        now = datetime.utcnow()
+        conversation_ids = {m["conversation_id"] for m in batch}
+        async with get_async_sessionmaker()() as db:
+            existing = set(await db.scalars(
+                select(Conversation.id).where(Conversation.id.in_(conversation_ids))
+            ))
+            if existing:
+                await db.execute(
+                    update(Conversation)
+                    .where(Conversation.id.in_(existing))
+                    .values(updated_at=now)
+                )
+            new_ids = conversation_ids - existing
+            if new_ids:
+                await db.execute(insert(Conversation), [
+                    {"id": cid, "created_at": now, "updated_at": now} for cid in new_ids
+                ])
+            # Insertion en masse (executemany), sans passer par l'unit of work de l'ORM
+            await db.execute(insert(DBMessage), batch)
+            await db.commit()
+
+    async def _flush_loop(self):
+        # Arrêt coopératif : jamais annulé au milieu d'une écriture
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def start(self):
+        await super().start()
+        # Flush périodique
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        await super().close()
+        self._stopping.set()
+        if self._flush_task is not None:
+            await self._flush_task
+        await self.flush()
+
+def create_conversation_service(llm_service: LLMService) -> ConversationService:
+    """Service configuré par les Settings (appelé par le conteneur)."""
+    summarizer = partial(summarize_with_llm, llm_service) if settings.history_summary_enabled else None
+    if settings.conversation_persistence:
+        return PersistentConversationService(summarizer=summarizer)
+    return ConversationService(summarizer=summarizer)
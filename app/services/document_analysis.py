@@ -0,0 +1,180 @@
+# Analyse de documents longs (map-reduce)
+# app/services/document_analysis.py
+import asyncio
+import hashlib
+from collections import defaultdict
+from typing import Awaitable, Callable, List
+
+from app.config import settings
+from app.container import current_container
+from app.services.cache import ResponseCache
+from app.utils.chunking import Chunk, chunk_text
+from app.utils.prompts import prompts
+from app.utils.structured_output import StructuredOutputError, parse_json, response_format_for
+from app.utils.tokens import count_tokens
+
+# Analyse d'un texte court -> dict au format AnalysisResponse
+ChunkAnalyzer = Callable[[str], Awaitable[dict]]
+
+
+class ChunkedDocumentAnalyzer:
+    """Analyse un document long par chunks puis fusionne les résultats.
+
+    - map : chaque chunk est analysé (concurrence bornée), avec un cache par
+      empreinte du contenu : ré-analyser un document modifié ne renvoie au
+      LLM que les chunks qui ont changé ;
+    - reduce : les résumés et points clés sont fusionnés par groupes tenant
+      dans `analysis_chunk_tokens`, puis les fusions entre elles, jusqu'à un
+      seul résultat ; le sentiment est agrégé (pondéré par la taille des
+      chunks) et les entités sont replacées aux offsets du document complet.
+
+    `chunk_prompt` est le template utilisé par `analyze_chunk` : sa version
+    fait partie de la clé du cache des chunks.
+    """
+
+    def __init__(self, analyze_chunk: ChunkAnalyzer, chunk_prompt: str = "analysis.document"):
+        self._analyze_chunk = analyze_chunk
+        self._chunk_prompt = chunk_prompt
+        self._semaphore = asyncio.Semaphore(settings.analysis_chunk_concurrency)
+        self._cache = ResponseCache(
+            max_entries=settings.analysis_chunk_cache_entries,
+            ttl_seconds=settings.cache_ttl_seconds
+        )
+
+    def chunk(self, text: str) -> List[Chunk]:
+        return chunk_text(
+            text,
+            max_tokens=settings.analysis_chunk_tokens,
+            overlap_tokens=settings.analysis_chunk_overlap_tokens
+        )
+
+    async def analyze(self, text: str) -> dict:
+        chunks = self.chunk(text)
+        partials = await asyncio.gather(*[self._analyze_cached(c) for c in chunks])
+        return await self._reduce(chunks, partials)
+
+    async def _analyze_cached(self, chunk: Chunk) -> dict:
+        model = current_container().llm_service.default_model
+        prompt = prompts.get(self._chunk_prompt).key
+        key = hashlib.sha256(f"{model}\0{prompt}\0{chunk.text}".encode("utf-8")).hexdigest()
+        cached = await self._cache.get(key)
+        if cached is not None:
+            return {**cached, "tokens_used": 0}
+        async with self._semaphore:
+            result = await self._analyze_chunk(chunk.text)
+        await self._cache.set(key, result)
+        return result
+
+    async def _reduce(self, chunks: List[Chunk], partials: List[dict]) -> dict:
+        merged = await self._merge_summaries(partials)
+        return {
+            "summary": merged["summary"],
+            "key_points": merged["key_points"],
+            "sentiment": self._merge_sentiment(chunks, partials),
+            "entities": self._merge_entities(chunks, partials),
+            "tokens_used": merged["tokens_used"] + sum(p["tokens_used"] for p in partials),
+        }
+
+    async def _merge_summaries(self, partials: List[dict]) -> dict:
+        """Fusion par niveaux : chaque niveau divise au moins par deux le
+        nombre de résultats, le prompt de fusion restant borné."""
+        tokens_used = 0
+        while True:
+            groups = self._merge_groups(partials)
+            merged = await asyncio.gather(*[self._merge_group(group) for group in groups])
+            tokens_used += sum(m["tokens_used"] for m in merged)
+            if len(merged) == 1:
+                return {**merged[0], "tokens_used": tokens_used}
+            partials = merged
+
+    @staticmethod
+    def _section(partial: dict) -> str:
+        return f"Résumé : {partial['summary']}\nPoints clés : " + "; ".join(partial["key_points"])
+
+    def _merge_groups(self, partials: List[dict]) -> List[List[dict]]:
+        """Groupes consécutifs tenant dans le budget (deux résultats au moins
+        par groupe, pour que la fusion progresse)."""
+        groups: List[List[dict]] = [[]]
+        group_tokens = 0
+        for partial in partials:
+            tokens = count_tokens(self._section(partial))
+            if len(groups[-1]) >= 2 and group_tokens + tokens > settings.analysis_chunk_tokens:
+                groups.append([])
+                group_tokens = 0
+            groups[-1].append(partial)
+            group_tokens += tokens
+        return groups
+
+    async def _merge_group(self, partials: List[dict]) -> dict:
+        sections = "\n\n".join(
+            f"Partie {i + 1} :\n{self._section(p)}" for i, p in enumerate(partials)
+        )
+        prompt = prompts.get("analysis.merge").render(sections=sections)
+        llm_service = current_container().llm_service
+        async with self._semaphore:
+            result = await llm_service.complete(
+                messages=prompt.messages(),
+                temperature=0.0,
+                response_format=response_format_for(llm_service.default_model),
+                prompt_tokens=prompt.tokens
+            )
+        prompt.record(result)
+        try:
+            data = parse_json(result["content"])
+            return {
+                "summary": data["summary"],
+                "key_points": data["key_points"],
+                "tokens_used": result["tokens"],
+            }
+        except (StructuredOutputError, KeyError, TypeError):
+            # Repli : concaténation des analyses partielles
+            key_points = list(dict.fromkeys(kp for p in partials for kp in p["key_points"]))
+            return {
+                "summary": " ".join(p["summary"] for p in partials),
+                "key_points": key_points,
+                "tokens_used": result["tokens"],
+            }
+
+    @staticmethod
+    def _merge_sentiment(chunks: List[Chunk], partials: List[dict]) -> dict:
+        weights: dict[str, float] = defaultdict(float)
+        for chunk, partial in zip(chunks, partials):
+            sentiment = partial["sentiment"]
+            weights[sentiment["sentiment"]] += len(chunk.text) * float(sentiment["confidence"])
+        label = max(weights, key=weights.get)
+        total = sum(weights.values()) or 1.0
+        # Explication du chunk le plus représentatif du sentiment retenu
+        best = max(
+            (p for p in partials if p["sentiment"]["sentiment"] == label),
+            key=lambda p: float(p["sentiment"]["confidence"])
+        )
+        return {
+            "sentiment": label,
+            "confidence": round(weights[label] / total, 3),
+            "explanation": best["sentiment"]["explanation"],
+        }
+
+    @staticmethod
+    def _merge_entities(chunks: List[Chunk], partials: List[dict]) -> List[dict]:
+        entities = []
+        seen = set()
+        for chunk, partial in zip(chunks, partials):
+            for entity in partial["entities"]:
+                # Offsets du LLM peu fiables : on relocalise le texte dans le chunk
+                local = chunk.text.find(entity["text"], max(0, entity["start"] - 50))
+                if local < 0:
+                    local = chunk.text.find(entity["text"])
+                if local < 0:
+                    local = min(entity["start"], len(chunk.text))
+                    end = min(entity["end"], len(chunk.text))
+                else:
+                    end = local + len(entity["text"])
+                start, end = chunk.start + local, chunk.start + end
+                # Les zones de chevauchement produisent des doublons
+                key = (entity["text"], entity["type"], start)
+                if key in seen:
+                    continue
+                seen.add(key)
+                entities.append({**entity, "start": start, "end": end})
+        entities.sort(key=lambda e: e["start"])
+        return entities
@@ -0,0 +1,110 @@
+# Embeddings (cache sémantique)
+# app/services/embeddings.py
+import asyncio
+import hashlib
+import math
+import re
+from collections import Counter
+from typing import Protocol
+
+from app.config import settings
+
+try:
+    import numpy as np
+except ImportError:  # Optionnel : seulement si semantic_cache_enabled
+    np = None
+
+_WORD = re.compile(r"\w+")
+
+# Au-delà, l'embedding local est calculé hors de la boucle asyncio
+THREAD_THRESHOLD_CHARS = 20_000
+
+
+class Embedder(Protocol):
+    """Texte -> vecteur float32 normalisé (similarité cosinus = produit scalaire)."""
+
+    name: str
+    dim: int
+
+    async def embed(self, texts: list[str]) -> "np.ndarray": ...
+
+
+def _normalize(vectors: "np.ndarray") -> "np.ndarray":
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashingEmbedder:
+    """Embedder local, sans modèle ni réseau : mots et paires de mots
+    hachés (blake2b, stable d'un processus à l'autre) dans `dim` cases
+    signées, pondérés en TF sous-linéaire (1 + log tf).
+
+    Sans IDF (qui ferait dériver les vecteurs déjà indexés) : adapté aux
+    quasi-doublons (modèles d'e-mails, tickets renvoyés), pas à la
+    similarité de sens.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim: int | None = None):
+        if np is None:
+            raise RuntimeError("The semantic cache requires numpy (pip install numpy)")
+        self.dim = dim or settings.semantic_cache_dim
+
+    def _features(self, text: str) -> Counter:
+        words = _WORD.findall(text.lower())
+        return Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])])
+
+    def _embed_one(self, text: str, out: "np.ndarray"):
+        for feature, count in self._features(text).items():
+            h = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            out[h % self.dim] += (1.0 + math.log(count)) * (1.0 if h >> 63 else -1.0)
+
+    def _embed(self, texts: list[str]) -> "np.ndarray":
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for text, row in zip(texts, vectors):
+            self._embed_one(text, row)
+        return _normalize(vectors)
+
+    async def embed(self, texts: list[str]) -> "np.ndarray":
+        if sum(len(t) for t in texts) > THREAD_THRESHOLD_CHARS:
+            return await asyncio.to_thread(self._embed, texts)
+        return self._embed(texts)
+
+
+class OpenAIEmbedder:
+    """Embeddings OpenAI, via le client (et le pool HTTP) du fournisseur."""
+
+    name = "openai"
+
+    # Les modèles d'embedding sont limités à ~8k tokens : début du texte
+    MAX_CHARS = 24_000
+
+    def __init__(self, provider, model: str | None = None, dim: int | None = None):
+        if np is None:
+            raise RuntimeError("The semantic cache requires numpy (pip install numpy)")
+        self.provider = provider
+        self.model = model or settings.semantic_cache_embedding_model
+        self.dim = dim or settings.semantic_cache_dim
+
+    async def embed(self, texts: list[str]) -> "np.ndarray":
+        response = await self.provider._ensure_client().embeddings.create(
+            model=self.model,
+            input=[t[:self.MAX_CHARS] for t in texts],
+            dimensions=self.dim
+        )
+        return _normalize(np.array([d.embedding for d in response.data], dtype=np.float32))
+
+
+def build_embedder(llm_service) -> Embedder:
+    """Embedder configuré (`semantic_cache_embedder`)."""
+    name = settings.semantic_cache_embedder
+    if name == "hashing":
+        return HashingEmbedder()
+    if name == "openai":
+        for provider in llm_service.router.providers:
+            if provider.name == "openai":
+                return OpenAIEmbedder(provider)
+        raise RuntimeError("The openai embedder requires the openai provider (LLM_PROVIDERS)")
+    raise ValueError(f"Unknown embedder: {name}")
@@ -0,0 +1,185 @@
+# Jobs d'analyse en masse
+# app/services/jobs.py
+import asyncio
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from app.config import settings
+from app.services.scheduler import TokenBucket, current_priority
+from app.utils.tokens import count_tokens
+
+# Opération : (texte, paramètres) -> (résultat sérialisable, tokens consommés)
+JobOperation = Callable[[str, dict], Awaitable[tuple[Any, int]]]
+
+# Tokens estimés pour le prompt d'instruction et la réponse
+PROMPT_OVERHEAD_TOKENS = 300
+
+# Opérations disponibles, enregistrées à l'import par les routers
+OPERATIONS: Dict[str, JobOperation] = {}
+
+
+def register_operation(name: str, operation: JobOperation):
+    OPERATIONS[name] = operation
+
+
+@dataclass
+class Job:
+    id: str
+    operation: str
+    params: dict
+    texts: List[str]
+    total: int = 0
+    status: str = "pending"  # pending, running, completed, cancelled
+    created_at: datetime = field(default_factory=datetime.now)
+    finished_at: Optional[datetime] = None
+    completed: int = 0
+    failed: int = 0
+    tokens_used: int = 0
+    # Résultats dans l'ordre de fin de traitement
+    results: List[dict] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+    updated: asyncio.Event = field(default_factory=asyncio.Event)
+
+    @property
+    def done(self) -> bool:
+        return self.status in ("completed", "cancelled")
+
+    def progress(self) -> dict:
+        return {
+            "job_id": self.id,
+            "operation": self.operation,
+            "status": self.status,
+            "total": self.total,
+            "completed": self.completed,
+            "failed": self.failed,
+            "tokens_used": self.tokens_used,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobManager:
+    """Exécute les jobs avec une concurrence bornée et un budget de tokens/minute.
+
+    Chaque item est traité indépendamment : une erreur est enregistrée dans
+    son résultat sans interrompre le reste du job.
+    """
+
+    def __init__(
+        self,
+        concurrency: int | None = None,
+        tokens_per_minute: int | None = None,
+        retention_minutes: int | None = None
+    ):
+        self._operations = OPERATIONS
+        self._jobs: Dict[str, Job] = {}
+        self._concurrency = concurrency or settings.jobs_concurrency
+        self._bucket = TokenBucket(tokens_per_minute or settings.jobs_tokens_per_minute)
+        self._retention = (retention_minutes or settings.jobs_retention_minutes) * 60
+
+    @property
+    def operations(self) -> List[str]:
+        return sorted(self._operations)
+
+    def submit(self, operation: str, texts: List[str], params: dict | None = None) -> Job:
+        if operation not in self._operations:
+            raise ValueError(f"Unknown operation: {operation}")
+        self._evict_finished()
+        job = Job(
+            id=str(uuid4()),
+            operation=operation,
+            params=params or {},
+            texts=texts,
+            total=len(texts)
+        )
+        self._jobs[job.id] = job
+        job.task = asyncio.create_task(self._run(job))
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    async def cancel(self, job_id: str) -> Optional[Job]:
+        job = self._jobs.get(job_id)
+        if job is not None and job.task is not None and not job.task.done():
+            job.task.cancel()
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                pass
+        return job
+
+    async def close(self):
+        """Annule les jobs en cours (arrêt de l'application)."""
+        for job in list(self._jobs.values()):
+            await self.cancel(job.id)
+
+    async def stream_results(self, job_id: str) -> AsyncIterator[dict]:
+        """Résultats déjà disponibles, puis les suivants au fil de l'eau."""
+        job = self._jobs[job_id]
+        index = 0
+        while True:
+            while index < len(job.results):
+                yield job.results[index]
+                index += 1
+            if job.done:
+                return
+            job.updated.clear()
+            await job.updated.wait()
+
+    async def _run(self, job: Job):
+        current_priority.set("batch")
+        job.status = "running"
+        operation = self._operations[job.operation]
+        indices = iter(range(job.total))
+
+        async def worker():
+            for index in indices:
+                await self._process_item(job, operation, index)
+
+        try:
+            await asyncio.gather(*[worker() for _ in range(min(self._concurrency, job.total))])
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+            raise
+        finally:
+            job.finished_at = datetime.now()
+            job.texts = []  # Libérer les entrées
+            job.updated.set()
+
+    async def _process_item(self, job: Job, operation: JobOperation, index: int):
+        text = job.texts[index]
+        estimated = count_tokens(text) + PROMPT_OVERHEAD_TOKENS
+        await self._bucket.acquire(estimated)
+        try:
+            result, tokens = await operation(text, job.params)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._bucket.adjust(-estimated)  # Rien de consommé (approximation)
+            job.failed += 1
+            job.results.append({"index": index, "status": "error", "error": _error_message(e)})
+        else:
+            self._bucket.adjust((tokens or estimated) - estimated)
+            job.completed += 1
+            job.tokens_used += tokens
+            job.results.append({"index": index, "status": "ok", "result": result, "tokens": tokens})
+        job.updated.set()
+
+    def _evict_finished(self):
+        now = datetime.now()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at and (now - job.finished_at).total_seconds() > self._retention
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+def _error_message(error: Exception) -> str:
+    detail = getattr(error, "detail", None)  # HTTPException des opérations
+    return str(detail) if detail is not None else f"{type(error).__name__}: {error}"
+
@@ -1,68 +1,240 @@
 # Wrapper LLM
 # app/services/llm_service.py
-from openai import AsyncOpenAI
+from fastapi import HTTPException
+
 from app.config import settings
 from app.models.schemas import Message
-from typing import AsyncIterator
+from app.services.api_keys import current_api_key
+from app.services.cache import ResponseCache, make_cache_key
+from app.services.coalescing import SingleFlight, StreamCoalescer
+from app.services.provider_router import ProviderRouter
+from app.services.providers import StreamUsage, build_providers
+from app.services.scheduler import UpstreamScheduler, current_priority
+from app.services.usage import UsageLedger
+from app.utils.metrics import CACHE_HITS, CACHE_MISSES
+from app.utils.tokens import MESSAGE_OVERHEAD, count_message_tokens
+from typing import AsyncIterator, Callable
+
+class CompletionStream:
+    """Flux de chunks de texte ; `usage` est renseigné à la fin du flux."""
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[str | StreamUsage],
+        model: str,
+        on_usage: Callable[[str, int, int], None] | None = None
+    ):
+        self._chunks = chunks
+        self.model = model
+        self.usage: StreamUsage | None = None
+        self._on_usage = on_usage
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        while True:
+            chunk = await self._chunks.__anext__()
+            if isinstance(chunk, StreamUsage):
+                self.usage = chunk
+                if self._on_usage is not None:
+                    self._on_usage(self.model, chunk.prompt_tokens, chunk.completion_tokens)
+                continue
+            return chunk
+
+    async def aclose(self):
+        """Arrête le flux (et l'appel amont s'il n'a plus d'abonnés)."""
+        await self._chunks.aclose()
 
 class LLMService:
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.openai_api_key)
+    def __init__(self, usage: UsageLedger | None = None):
+        self.usage = usage
+        self.router = ProviderRouter(build_providers())
+        self.scheduler = UpstreamScheduler()
         self.default_model = settings.default_model
-    
+        self.cache: ResponseCache | None = None
+        if settings.cache_enabled:
+            self.cache = ResponseCache(
+                max_entries=settings.cache_max_entries,
+                ttl_seconds=settings.cache_ttl_seconds,
+                database_url=settings.database_url if settings.cache_persistent else None
+            )
+        self.single_flight = SingleFlight()
+        self.stream_coalescer = StreamCoalescer()
+
+    async def start(self):
+        """Crée les clients amont (appelé dans le lifespan)."""
+        await self.router.start()
+
+    async def aclose(self):
+        """Ferme les clients amont et leurs connexions."""
+        await self.router.aclose()
+
     async def complete(
         self,
         messages: list[Message],
         model: str | None = None,
         temperature: float = 0.7,
         max_tokens: int = 2000,
-        stream: bool = False
-    ) -> dict | AsyncIterator[str]:
-        """Génère une complétion."""
-        
+        stream: bool = False,
+        cache: bool | None = None,
+        coalesce: bool | None = None,
+        response_format: dict | None = None,
+        priority: str | None = None,
+        prompt_tokens: int | None = None,
+        cache_if: Callable[[dict], bool] | None = None
+    ) -> dict | CompletionStream:
+        """Génère une complétion.
+
+        `cache=None` : seules les requêtes déterministes (temperature 0) sont
+        mises en cache, sauf si `cache_sampled_responses` est activé.
+        `coalesce=None` : les requêtes déterministes identiques en vol
+        partagent un seul appel amont.
+        `response_format` : mode JSON / schéma JSON (voir utils.structured_output).
+        `priority` : classe de l'ordonnanceur amont (chat, analysis, batch) ;
+        par défaut celle de la requête courante.
+        `prompt_tokens` : tokens des messages s'ils sont déjà connus (templates
+        de utils.prompts), pour ne pas re-tokeniser le prompt.
+        `cache_if` : condition supplémentaire de mise en cache (ex: sortie
+        structurée valide), pour ne pas resservir une réponse inutilisable.
+        """
+
         formatted_messages = [
             {"role": m.role.value, "content": m.content}
             for m in messages
         ]
-        
+
         model = model or self.default_model
-        
+        priority = priority or current_priority.get()
+
+        identity = current_api_key.get()
+        if identity is not None and not identity.allows_model(model):
+            raise HTTPException(status_code=403, detail=f"API key not allowed to use model '{model}'")
+        if self.usage is not None:
+            self.usage.check_budget()
+        on_usage = self.usage.record if self.usage is not None else None
+
+        if coalesce is None:
+            coalesce = temperature == 0
+
         if stream:
-            return self._stream_complete(formatted_messages, model, temperature, max_tokens)
-        
-        response = await self.client.chat.completions.create(
-            model=model,
-            messages=formatted_messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        
+            if coalesce:
+                key = make_cache_key(model, formatted_messages, temperature, max_tokens)
+                return CompletionStream(self.stream_coalescer.subscribe(
+                    key,
+                    lambda: self._stream_complete(
+                        formatted_messages, model, temperature, max_tokens, priority, prompt_tokens
+                    )
+                ), model, on_usage)
+            return CompletionStream(
+                self._stream_complete(
+                    formatted_messages, model, temperature, max_tokens, priority, prompt_tokens
+                ),
+                model,
+                on_usage
+            )
+
+        if cache is None:
+            cache = temperature == 0 or settings.cache_sampled_responses
+        cache = cache and self.cache is not None
+
+        key = make_cache_key(model, formatted_messages, temperature, max_tokens, response_format)
+        if cache:
+            cached = await self.cache.get(key)
+            if cached is not None:
+                CACHE_HITS.inc()
+                return {**cached, "cached": True}
+            CACHE_MISSES.inc()
+
+        async def fetch() -> dict:
+            result = await self._create(
+                formatted_messages, model, temperature, max_tokens, response_format, priority, prompt_tokens
+            )
+            # Ne pas cacher les réponses tronquées
+            if cache and result["finish_reason"] == "stop" and (cache_if is None or cache_if(result)):
+                await self.cache.set(key, result)
+            return result
+
+        if coalesce:
+            result = await self.single_flight.do(key, fetch)
+        else:
+            result = await fetch()
+        # Décompté pour chaque appelant servi (coalescé compris), pas pour le cache
+        if on_usage is not None:
+            on_usage(model, result["prompt_tokens"], result["completion_tokens"])
+        return result
+
+    async def _create(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict | None = None,
+        priority: str | None = None,
+        prompt_tokens: int | None = None
+    ) -> dict:
+        """Appel amont non streamé (admis par l'ordonnanceur, routé avec failover)."""
+        estimated = self._estimate_tokens(messages, model, max_tokens, prompt_tokens)
+        async with self.scheduler.reserve(model, estimated, priority) as reservation:
+            result = await self.router.create(messages, model, temperature, max_tokens, response_format)
+            reservation.settle(result["tokens"])
+        return result
+
+    @staticmethod
+    def _estimate_tokens(
+        messages: list[dict],
+        model: str,
+        max_tokens: int,
+        prompt_tokens: int | None = None
+    ) -> int:
+        """Tokens décomptés par le fournisseur avant l'appel : prompt + max_tokens."""
+        if prompt_tokens is not None:
+            return prompt_tokens + MESSAGE_OVERHEAD * len(messages) + max_tokens
+        return sum(count_message_tokens(m["content"], model) for m in messages) + max_tokens
+
+    def cache_stats(self) -> dict:
+        """Compteurs hit/miss/eviction du cache de réponses."""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.get_stats()}
+
+    def scheduler_stats(self) -> dict:
+        """Files d'attente de l'ordonnanceur amont."""
+        return self.scheduler.stats()
+
+    def pool_stats(self) -> dict:
+        """Saturation des pools de connexions HTTP amont."""
+        return self.router.pool_stats()
+
+    def provider_stats(self) -> dict:
+        """Santé des fournisseurs (circuits, erreurs, latences)."""
+        return self.router.stats()
+
+    def coalescing_stats(self) -> dict:
+        """Appels amont économisés par la coalescence."""
         return {
-            "content": response.choices[0].message.content,
-            "tokens": response.usage.total_tokens,
-            "model": model,
-            "finish_reason": response.choices[0].finish_reason
+            "completions": self.single_flight.stats.to_dict(),
+            "streams": self.stream_coalescer.stats.to_dict(),
         }
-    
+
     async def _stream_complete(
         self,
         messages: list[dict],
         model: str,
         temperature: float,
-        max_tokens: int
-    ) -> AsyncIterator[str]:
-        """Streaming de la réponse."""
-        stream = await self.client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            stream=True
-        )
-        
-        async for chunk in stream:
-            if chunk.choices[0].delta.content:
-                yield chunk.choices[0].delta.content
-
-# Singleton
-llm_service = LLMService()
\ No newline at end of file
+        max_tokens: int,
+        priority: str | None = None,
+        prompt_tokens: int | None = None
+    ) -> AsyncIterator[str | StreamUsage]:
+        """Streaming de la réponse (chunks de texte, puis l'usage en dernier)."""
+        estimated = self._estimate_tokens(messages, model, max_tokens, prompt_tokens)
+        async with self.scheduler.reserve(model, estimated, priority) as reservation:
+            chunks = self.router.stream(messages, model, temperature, max_tokens)
+            try:
+                async for chunk in chunks:
+                    if isinstance(chunk, StreamUsage):
+                        reservation.settle(chunk.total_tokens)
+                    yield chunk
+            finally:
+                await chunks.aclose()
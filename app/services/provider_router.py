@@ -0,0 +1,383 @@
+# Routage entre fournisseurs LLM (latence, failover, hedging)
+# app/services/provider_router.py
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import AsyncIterator
+
+from app.config import settings
+from app.services.providers import LLMProvider, ProviderError, StreamUsage
+from app.utils.metrics import (
+    UPSTREAM_DURATION, UPSTREAM_ERRORS, UPSTREAM_IN_FLIGHT, UPSTREAM_TTFT, record_tokens
+)
+
+logger = logging.getLogger("ai_backend")
+
+
+class CircuitBreaker:
+    """closed -> open après `failure_threshold` échecs consécutifs ; après
+    `cooldown` secondes, half_open laisse passer une requête de test."""
+
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def available(self) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() - self.opened_at >= self.cooldown
+        return not self._probing
+
+    def acquire(self):
+        """Début d'un appel : hors état closed, c'est la requête de test."""
+        if self.state != "closed":
+            self.state = "half_open"
+            self._probing = True
+
+    def release(self):
+        """Appel annulé sans résultat (perdant d'un hedge)."""
+        self._probing = False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class ProviderHealth:
+    """Latences et erreurs récentes d'un fournisseur (fenêtre glissante).
+
+    `latencies` ne contient que des complétions simples réussies (base du
+    hedging et du score) ; le time-to-first-token des flux a sa propre
+    fenêtre.
+    """
+
+    def __init__(self, window: int = 200):
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.ttfts: deque[float] = deque(maxlen=window)
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.failovers = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, latency: float | None, ok: bool):
+        """`latency=None` : issue comptée sans échantillon de latence."""
+        self.requests += 1
+        self.outcomes.append(ok)
+        if not ok:
+            self.errors += 1
+        elif latency is not None:
+            self.latencies.append(latency)
+
+    def percentile(self, p: float, values: deque[float] | None = None) -> float | None:
+        values = self.latencies if values is None else values
+        if not values:
+            return None
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def score(self, min_samples: int) -> float:
+        """p95 pénalisé par le taux d'erreur ; 0 tant que l'échantillon est
+        trop petit, pour que chaque fournisseur soit mesuré."""
+        if len(self.latencies) < min_samples:
+            return 0.0
+        return self.percentile(95) * (1 + 4 * self.error_rate)
+
+
+class ProviderRouter:
+    """Choisit un fournisseur par latence observée (p50/p95) et taux
+    d'erreur, bascule sur le suivant en cas de 429/5xx/timeout (backoff
+    exponentiel avec jitter), et peut envoyer une requête dupliquée
+    (hedging) au second fournisseur quand le premier dépasse son
+    percentile de latence ; la requête perdante est annulée.
+
+    Le hedging ne concerne que les complétions simples : un flux n'est
+    basculé que tant qu'aucun chunk n'a été envoyé au client.
+    """
+
+    def __init__(self, providers: list[LLMProvider]):
+        self.providers = providers
+        self.health = {p.name: ProviderHealth() for p in providers}
+        self.breakers = {
+            p.name: CircuitBreaker(
+                settings.llm_breaker_failure_threshold,
+                settings.llm_breaker_cooldown_seconds
+            )
+            for p in providers
+        }
+        self.min_samples = settings.llm_hedge_min_samples
+
+    async def start(self):
+        for provider in self.providers:
+            await provider.start()
+
+    async def aclose(self):
+        for provider in self.providers:
+            await provider.aclose()
+
+    def _ranked(self) -> list[LLMProvider]:
+        # Tri stable : à score égal, l'ordre de llm_providers est conservé
+        return sorted(self.providers, key=lambda p: self.health[p.name].score(self.min_samples))
+
+    def _candidates(self) -> list[LLMProvider]:
+        """Fournisseurs à essayer, dans l'ordre (au moins un, même si tous
+        les circuits sont ouverts, pour ne pas refuser sans essayer)."""
+        ranked = self._ranked()
+        allowed = [p for p in ranked if self.breakers[p.name].available()]
+        return allowed or ranked[:1]
+
+    @staticmethod
+    def _model_for(provider: LLMProvider, model: str) -> str:
+        return model if provider.supports(model) else provider.default_model
+
+    @staticmethod
+    def _upstream_fault(error: BaseException) -> bool:
+        """Échec imputable au fournisseur (429, 5xx, timeout, réseau), par
+        opposition à une requête refusée (400, 401...) qui ne dit rien de
+        sa santé."""
+        return not isinstance(error, ProviderError) or error.retryable
+
+    def _record(
+        self,
+        provider: LLMProvider,
+        started: float,
+        error: BaseException | None = None,
+        sample: bool = True
+    ) -> float:
+        """Issue d'un appel. Seules les complétions simples réussies donnent
+        un échantillon de latence (`sample=False` pour un flux)."""
+        latency = time.perf_counter() - started
+        if error is None:
+            self.health[provider.name].record(latency if sample else None, True)
+            self.breakers[provider.name].record_success()
+        else:
+            self.health[provider.name].record(None, not self._upstream_fault(error))
+            self._record_failure(provider, error)
+        return latency
+
+    def _record_failure(self, provider: LLMProvider, error: BaseException):
+        if self._upstream_fault(error):
+            self.breakers[provider.name].record_failure()
+        else:
+            self.breakers[provider.name].release()
+        status = getattr(error, "status_code", None) or type(error).__name__
+        UPSTREAM_ERRORS[(provider.name, str(status))].inc()
+
+    async def _backoff(self, attempt: int):
+        base = settings.llm_backoff_base_ms / 1000
+        cap = settings.llm_backoff_max_ms / 1000
+        # Full jitter : évite que les clients réessaient tous en même temps
+        await asyncio.sleep(random.uniform(0, min(cap, base * 2 ** attempt)))
+
+    async def _call(self, provider: LLMProvider, messages, model, temperature, max_tokens, response_format) -> dict:
+        model = self._model_for(provider, model)
+        self.breakers[provider.name].acquire()
+        in_flight = UPSTREAM_IN_FLIGHT[(provider.name,)]
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            result = await provider.create(messages, model, temperature, max_tokens, response_format)
+        except asyncio.CancelledError:
+            # Perdant d'un hedge : ni succès ni échec
+            self.breakers[provider.name].release()
+            raise
+        except Exception as e:
+            self._record(provider, started, error=e)
+            raise
+        finally:
+            in_flight.dec()
+        latency = self._record(provider, started)
+        UPSTREAM_DURATION[(provider.name, model)].observe(latency)
+        record_tokens(model, result.get("prompt_tokens", 0), result.get("completion_tokens", 0))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("llm call", extra={"fields": {
+                "provider": provider.name,
+                "model": model,
+                "latency_ms": round(latency * 1000, 1),
+                "tokens": result["tokens"],
+            }})
+        return {**result, "provider": provider.name}
+
+    def _hedge_delay(self, provider: LLMProvider) -> float | None:
+        health = self.health[provider.name]
+        if not settings.llm_hedging or len(health.latencies) < self.min_samples:
+            return None
+        return health.percentile(settings.llm_hedge_percentile)
+
+    async def _hedged(self, primary: LLMProvider, secondary: LLMProvider | None, *args) -> dict:
+        delay = self._hedge_delay(primary) if secondary is not None else None
+        first = asyncio.create_task(self._call(primary, *args))
+        if delay is None:
+            return await first
+
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+
+            self.health[primary.name].hedges += 1
+            second = asyncio.create_task(self._call(secondary, *args))
+            pending.add(second)
+            error: BaseException | None = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.health[secondary.name].hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Annuler la requête perdante (ou les deux si l'appelant est annulé)
+            for task in pending:
+                task.cancel()
+
+    async def create(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict | None = None
+    ) -> dict:
+        args = (messages, model, temperature, max_tokens, response_format)
+        last_error: Exception | None = None
+        for attempt in range(settings.llm_max_attempts):
+            candidates = self._candidates()
+            # Tentative suivante : fournisseur suivant (ou le même s'il est seul)
+            primary = candidates[attempt % len(candidates)]
+            others = [p for p in candidates if p is not primary]
+            try:
+                return await self._hedged(primary, others[0] if others else None, *args)
+            except ProviderError as e:
+                if not e.retryable:
+                    raise
+                last_error = e
+            except asyncio.TimeoutError:
+                last_error = ProviderError(primary.name, "timeout")
+            self.health[primary.name].failovers += 1
+            logger.warning(f"LLM call failed on {primary.name} ({last_error}), attempt {attempt + 1}")
+            if attempt + 1 < settings.llm_max_attempts:
+                await self._backoff(attempt)
+        raise last_error
+
+    async def stream(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str | StreamUsage]:
+        last_error: Exception | None = None
+        for attempt in range(settings.llm_max_attempts):
+            candidates = self._candidates()
+            provider = candidates[attempt % len(candidates)]
+            upstream_model = self._model_for(provider, model)
+            self.breakers[provider.name].acquire()
+            in_flight = UPSTREAM_IN_FLIGHT[(provider.name,)]
+            in_flight.inc()
+            started = time.perf_counter()
+            chunks = provider.stream(messages, upstream_model, temperature, max_tokens)
+            try:
+                # Le failover n'est possible qu'avant le premier chunk
+                first = await chunks.__anext__()
+            except StopAsyncIteration:
+                in_flight.dec()
+                self._record(provider, started, sample=False)
+                return
+            except ProviderError as e:
+                in_flight.dec()
+                self._record(provider, started, error=e)
+                if not e.retryable:
+                    raise
+                last_error = e
+                self.health[provider.name].failovers += 1
+                logger.warning(f"LLM stream failed on {provider.name} ({e}), attempt {attempt + 1}")
+                if attempt + 1 < settings.llm_max_attempts:
+                    await self._backoff(attempt)
+                continue
+            except BaseException:
+                # Annulation (ou erreur inattendue) : ni succès ni échec
+                in_flight.dec()
+                self.breakers[provider.name].release()
+                raise
+
+            # Time-to-first-token, dans sa propre fenêtre ; l'issue du flux
+            # (circuit, taux d'erreur) n'est enregistrée qu'à la fin
+            ttft = time.perf_counter() - started
+            self.health[provider.name].ttfts.append(ttft)
+            UPSTREAM_TTFT[(provider.name, upstream_model)].observe(ttft)
+            try:
+                yield first
+                async for chunk in chunks:
+                    if isinstance(chunk, StreamUsage):
+                        record_tokens(upstream_model, chunk.prompt_tokens, chunk.completion_tokens)
+                    yield chunk
+            except Exception as e:
+                # Coupure après le premier chunk : plus de failover, mais comptée
+                self._record(provider, started, error=e)
+                raise
+            except BaseException:
+                # Client parti (ou annulation) : ni succès ni échec
+                self.breakers[provider.name].release()
+                raise
+            else:
+                self._record(provider, started, sample=False)
+            finally:
+                in_flight.dec()
+                await chunks.aclose()
+            return
+        raise last_error
+
+    def pool_stats(self) -> dict:
+        """Pools de connexions HTTP des fournisseurs qui en exposent un."""
+        return {
+            provider.name: provider.pool_stats()
+            for provider in self.providers
+            if hasattr(provider, "pool_stats")
+        }
+
+    def stats(self) -> dict:
+        """Santé par fournisseur : circuit, taux d'erreur, latences."""
+        stats = {}
+        for provider in self.providers:
+            health = self.health[provider.name]
+            p50, p95 = health.percentile(50), health.percentile(95)
+            ttft_p50 = health.percentile(50, health.ttfts)
+            stats[provider.name] = {
+                "circuit": self.breakers[provider.name].state,
+                "requests": health.requests,
+                "errors": health.errors,
+                "error_rate": round(health.error_rate, 4),
+                "p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+                "ttft_p50_ms": round(ttft_p50 * 1000, 1) if ttft_p50 is not None else None,
+                "failovers": health.failovers,
+                "hedges": health.hedges,
+                "hedge_wins": health.hedge_wins,
+            }
+        return stats
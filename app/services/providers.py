@@ -0,0 +1,549 @@
+# Fournisseurs LLM (OpenAI, Anthropic, fake)
+# app/services/providers.py
+import asyncio
+import logging
+import math
+import random
+import weakref
+from dataclasses import dataclass
+from typing import AsyncIterator, Protocol
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from app.config import settings
+
+try:
+    import anthropic
+except ImportError:  # Optionnel : seulement si "anthropic" est dans llm_providers
+    anthropic = None
+
+logger = logging.getLogger("ai_backend")
+
+
+@dataclass
+class StreamUsage:
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+
+
+class ProviderError(Exception):
+    """Erreur amont normalisée ; `retryable` pilote le failover."""
+
+    def __init__(self, provider: str, message: str, status_code: int | None = None):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+
+    @property
+    def retryable(self) -> bool:
+        # Pas de statut : timeout ou erreur réseau
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+class LLMProvider(Protocol):
+    """Interface d'un fournisseur : complétion simple et streaming."""
+
+    name: str
+    default_model: str
+
+    async def start(self) -> None: ...
+
+    async def aclose(self) -> None: ...
+
+    def supports(self, model: str) -> bool: ...
+
+    async def create(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict | None = None
+    ) -> dict: ...
+
+    def stream(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str | StreamUsage]: ...
+
+
+def build_http_client() -> httpx.AsyncClient:
+    """Client HTTP partagé par tous les appels OpenAI : pool de connexions
+    keep-alive dimensionné pour la concurrence attendue (pas de nouvelle
+    connexion TLS par requête), HTTP/2 optionnel (paquet `h2`)."""
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_keepalive_connections,
+            keepalive_expiry=settings.openai_keepalive_expiry
+        ),
+        timeout=openai.Timeout(
+            settings.openai_read_timeout,
+            connect=settings.openai_connect_timeout,
+            pool=settings.openai_pool_timeout
+        ),
+        http2=settings.openai_http2
+    )
+
+
+class PoolStats:
+    """Occupation du pool de connexions HTTP d'un client."""
+
+    def __init__(self, max_connections: int):
+        self.max_connections = max_connections
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.connections_opened = 0
+        self._seen = weakref.WeakSet()
+
+    def begin(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def end(self):
+        self.in_flight -= 1
+
+    def observe(self, http_client: httpx.AsyncClient | None) -> list:
+        """Connexions actuelles du pool ; compte celles jamais vues."""
+        pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        for connection in connections:
+            if connection not in self._seen:
+                self._seen.add(connection)
+                self.connections_opened += 1
+        return connections
+
+    def to_dict(self, http_client: httpx.AsyncClient | None) -> dict:
+        connections = self.observe(http_client)
+        idle = sum(1 for c in connections if c.is_idle())
+        return {
+            "max_connections": self.max_connections,
+            "connections": len(connections),
+            "idle_connections": idle,
+            "connections_opened": self.connections_opened,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            # Requêtes en attente d'une connexion libre
+            "waiting": max(0, self.in_flight - self.max_connections),
+            "saturation": round(self.in_flight / self.max_connections, 4) if self.max_connections else 0.0,
+            "requests": self.requests,
+        }
+
+
+class OpenAIProvider:
+    name = "openai"
+
+    def __init__(self, client: AsyncOpenAI | None = None, default_model: str | None = None):
+        # Client créé dans `start()` (lifespan) sauf s'il est fourni
+        self.client = client
+        self.default_model = default_model or settings.default_model
+        self._http_client: httpx.AsyncClient | None = None
+        self.pool = PoolStats(settings.openai_max_connections)
+
+    async def start(self):
+        self._ensure_client()
+
+    async def aclose(self):
+        if self._http_client is not None:
+            await self.client.close()
+            self.client = None
+            self._http_client = None
+
+    def _ensure_client(self) -> AsyncOpenAI:
+        if self.client is None:
+            self._http_client = build_http_client()
+            self.client = AsyncOpenAI(
+                api_key=settings.openai_api_key,
+                http_client=self._http_client,
+                max_retries=settings.openai_max_retries
+            )
+        return self.client
+
+    def pool_stats(self) -> dict:
+        return self.pool.to_dict(self._http_client)
+
+    def supports(self, model: str) -> bool:
+        return model.startswith(("gpt-", "o1", "o3", "o4", "chatgpt-"))
+
+    def _error(self, e: Exception) -> ProviderError:
+        return ProviderError(self.name, str(e), getattr(e, "status_code", None))
+
+    async def create(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict | None = None
+    ) -> dict:
+        options = {"response_format": response_format} if response_format else {}
+        client = self._ensure_client()
+        self.pool.begin()
+        try:
+            response = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                **options
+            )
+        except openai.APIError as e:
+            raise self._error(e) from e
+        finally:
+            self.pool.end()
+            self.pool.observe(self._http_client)
+
+        return {
+            "content": response.choices[0].message.content,
+            "tokens": response.usage.total_tokens,
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "model": model,
+            "finish_reason": response.choices[0].finish_reason
+        }
+
+    async def stream(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str | StreamUsage]:
+        client = self._ensure_client()
+        self.pool.begin()
+        try:
+            stream = await client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+        except BaseException as e:
+            self.pool.end()
+            if isinstance(e, openai.APIError):
+                raise self._error(e) from e
+            raise
+
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if chunk.usage is not None:
+                    yield StreamUsage(
+                        prompt_tokens=chunk.usage.prompt_tokens,
+                        completion_tokens=chunk.usage.completion_tokens,
+                        total_tokens=chunk.usage.total_tokens
+                    )
+        except openai.APIError as e:
+            raise self._error(e) from e
+        finally:
+            # Client déconnecté ou erreur : libérer la connexion amont
+            await stream.close()
+            self.pool.end()
+            self.pool.observe(self._http_client)
+
+
+class AnthropicProvider:
+    name = "anthropic"
+
+    # finish_reason au format OpenAI
+    STOP_REASONS = {"end_turn": "stop", "stop_sequence": "stop", "max_tokens": "length"}
+
+    def __init__(self, api_key: str | None = None, default_model: str | None = None):
+        if anthropic is None:
+            raise RuntimeError("The 'anthropic' package is required for the anthropic provider")
+        self._api_key = api_key
+        self.client = None  # Créé dans `start()` (lifespan)
+        self.default_model = default_model or settings.anthropic_model
+
+    async def start(self):
+        self._ensure_client()
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.close()
+            self.client = None
+
+    def _ensure_client(self):
+        if self.client is None:
+            self.client = anthropic.AsyncAnthropic(
+                api_key=self._api_key or settings.anthropic_api_key,
+                max_retries=0  # Les reprises sont faites par le routeur
+            )
+        return self.client
+
+    def supports(self, model: str) -> bool:
+        return model.startswith("claude")
+
+    def _error(self, e: Exception) -> ProviderError:
+        return ProviderError(self.name, str(e), getattr(e, "status_code", None))
+
+    @staticmethod
+    def _convert(messages: list[dict]) -> tuple[str, list[dict]]:
+        """Messages OpenAI -> (system, messages) : l'API attend le prompt
+        système à part et des rôles user/assistant alternés."""
+        system = "\n\n".join(m["content"] for m in messages if m["role"] == "system")
+        converted: list[dict] = []
+        for m in messages:
+            if m["role"] == "system":
+                continue
+            if converted and converted[-1]["role"] == m["role"]:
+                converted[-1]["content"] += "\n\n" + m["content"]
+            else:
+                converted.append({"role": m["role"], "content": m["content"]})
+        if not converted or converted[0]["role"] != "user":
+            converted.insert(0, {"role": "user", "content": "..."})
+        return system, converted
+
+    async def create(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict | None = None
+    ) -> dict:
+        # Pas de `response_format` : le parsing tolérant et la réparation
+        # de utils.structured_output prennent le relais
+        system, converted = self._convert(messages)
+        try:
+            response = await self._ensure_client().messages.create(
+                model=model,
+                system=system or anthropic.NOT_GIVEN,
+                messages=converted,
+                temperature=min(temperature, 1.0),
+                max_tokens=max_tokens
+            )
+        except anthropic.APIError as e:
+            raise self._error(e) from e
+
+        return {
+            "content": "".join(block.text for block in response.content if block.type == "text"),
+            "tokens": response.usage.input_tokens + response.usage.output_tokens,
+            "prompt_tokens": response.usage.input_tokens,
+            "completion_tokens": response.usage.output_tokens,
+            "model": model,
+            "finish_reason": self.STOP_REASONS.get(response.stop_reason, response.stop_reason)
+        }
+
+    async def stream(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str | StreamUsage]:
+        system, converted = self._convert(messages)
+        try:
+            stream = await self._ensure_client().messages.create(
+                model=model,
+                system=system or anthropic.NOT_GIVEN,
+                messages=converted,
+                temperature=min(temperature, 1.0),
+                max_tokens=max_tokens,
+                stream=True
+            )
+        except anthropic.APIError as e:
+            raise self._error(e) from e
+
+        prompt_tokens = 0
+        try:
+            async for event in stream:
+                if event.type == "message_start":
+                    prompt_tokens = event.message.usage.input_tokens
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    yield event.delta.text
+                elif event.type == "message_delta":
+                    completion_tokens = event.usage.output_tokens
+                    yield StreamUsage(
+                        prompt_tokens=prompt_tokens,
+                        completion_tokens=completion_tokens,
+                        total_tokens=prompt_tokens + completion_tokens
+                    )
+        except anthropic.APIError as e:
+            raise self._error(e) from e
+        finally:
+            await stream.close()
+
+
+class FakeProvider:
+    """Fournisseur local (tests, benchmarks) : aucun appel réseau.
+
+    Sans paramètre explicite, le comportement vient des Settings `fake_*` :
+    - latence tirée selon `latency_distribution` (fixed, uniform : ±jitter
+      en fraction, lognormal : sigma = jitter) autour de `latency` ;
+    - en streaming, premier chunk après `ttft` (même loi), puis un mot
+      (~un token) toutes les 1/`tokens_per_second` s ; en non streamé, la
+      latence plus le temps de génération ;
+    - erreurs injectées avant la réponse (`error_rate`, statut
+      `error_status`) ou en cours de flux (`stream_abort_rate`) ;
+    - réponse : `replies` (préfixe du dernier message -> réponse), sinon
+      `reply`, sinon écho du dernier message.
+    Les tirages sont reproductibles avec `seed`.
+    """
+
+    DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+    def __init__(
+        self,
+        name: str = "fake",
+        latency: float | None = None,
+        error_rate: float | None = None,
+        error_status: int | None = None,
+        reply: str | None = None,
+        latency_distribution: str | None = None,
+        latency_jitter: float | None = None,
+        ttft: float | None = None,
+        tokens_per_second: float | None = None,
+        stream_abort_rate: float | None = None,
+        replies: dict[str, str] | None = None,
+        seed: int | None = None
+    ):
+        self.name = name
+        self.default_model = "fake-model"
+        self.latency = settings.fake_latency_ms / 1000 if latency is None else latency
+        self.latency_distribution = latency_distribution or settings.fake_latency_distribution
+        if self.latency_distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown fake latency distribution: {self.latency_distribution}")
+        self.latency_jitter = settings.fake_latency_jitter if latency_jitter is None else latency_jitter
+        if ttft is None and settings.fake_ttft_ms is not None:
+            ttft = settings.fake_ttft_ms / 1000
+        self.ttft = self.latency if ttft is None else ttft
+        self.tokens_per_second = (
+            settings.fake_tokens_per_second if tokens_per_second is None else tokens_per_second
+        )
+        self.error_rate = settings.fake_error_rate if error_rate is None else error_rate
+        self.error_status = error_status or settings.fake_error_status
+        self.stream_abort_rate = (
+            settings.fake_stream_abort_rate if stream_abort_rate is None else stream_abort_rate
+        )
+        self.reply = settings.fake_reply if reply is None else reply
+        if replies is None:
+            replies = self._template_replies(settings.fake_replies)
+        self.replies = replies
+        self._random = random.Random(settings.fake_seed if seed is None else seed)
+        self.calls = 0
+
+    @staticmethod
+    def _template_replies(by_template: dict[str, str]) -> dict[str, str]:
+        """Réponses par nom de template (Settings) -> par préfixe de prompt."""
+        from app.utils.prompts import prompts
+
+        return {prompts.get(name).prefix: reply for name, reply in by_template.items()}
+
+    async def start(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+    def supports(self, model: str) -> bool:
+        return True
+
+    def _content(self, messages: list[dict]) -> str:
+        last = messages[-1]["content"]
+        for prefix, reply in self.replies.items():
+            if last.startswith(prefix):
+                return reply
+        if self.reply is not None:
+            return self.reply
+        return f"Réponse simulée : {last[:200]}"
+
+    def _delay(self, median: float) -> float:
+        if median <= 0 or self.latency_distribution == "fixed" or not self.latency_jitter:
+            return max(0.0, median)
+        if self.latency_distribution == "uniform":
+            return max(0.0, median * (1 + self._random.uniform(-self.latency_jitter, self.latency_jitter)))
+        # lognormal : médiane `median`, queue à droite
+        return self._random.lognormvariate(math.log(median), self.latency_jitter)
+
+    def _generation_time(self, content: str) -> float:
+        if not self.tokens_per_second:
+            return 0.0
+        return len(content.split(" ")) / self.tokens_per_second
+
+    async def _call(self, delay: float):
+        self.calls += 1
+        await asyncio.sleep(delay)
+        if self.error_rate and self._random.random() < self.error_rate:
+            raise ProviderError(self.name, "injected error", self.error_status)
+
+    @staticmethod
+    def _usage(messages: list[dict], content: str) -> tuple[int, int]:
+        return sum(len(m["content"]) for m in messages) // 4, len(content) // 4
+
+    async def create(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int,
+        response_format: dict | None = None
+    ) -> dict:
+        content = self._content(messages)
+        await self._call(self._delay(self.latency) + self._generation_time(content))
+        prompt_tokens, completion_tokens = self._usage(messages, content)
+        return {
+            "content": content,
+            "tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "model": model,
+            "finish_reason": "stop"
+        }
+
+    async def stream(
+        self,
+        messages: list[dict],
+        model: str,
+        temperature: float,
+        max_tokens: int
+    ) -> AsyncIterator[str | StreamUsage]:
+        content = self._content(messages)
+        await self._call(self._delay(self.ttft))
+        words = content.split(" ")
+        abort_at = -1
+        if self.stream_abort_rate and self._random.random() < self.stream_abort_rate:
+            abort_at = self._random.randrange(len(words))
+        interval = 1 / self.tokens_per_second if self.tokens_per_second else 0
+        for i, word in enumerate(words):
+            if i == abort_at:
+                raise ProviderError(self.name, "injected stream abort", self.error_status)
+            yield word + " "
+            await asyncio.sleep(interval)
+        prompt_tokens, completion_tokens = self._usage(messages, content)
+        yield StreamUsage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens
+        )
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "anthropic": AnthropicProvider,
+    "fake": FakeProvider,
+}
+
+
+def build_providers(names: list[str] | None = None) -> list[LLMProvider]:
+    """Instancie les fournisseurs configurés, dans l'ordre de préférence."""
+    providers = []
+    for name in names or settings.llm_providers:
+        try:
+            providers.append(PROVIDERS[name]())
+        except (KeyError, RuntimeError) as e:
+            logger.warning(f"LLM provider '{name}' unavailable: {e}")
+    if not providers:
+        raise RuntimeError("No LLM provider available (check LLM_PROVIDERS)")
+    return providers
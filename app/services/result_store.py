@@ -0,0 +1,73 @@
+# Résultats d'analyse adressés par contenu
+# app/services/result_store.py
+import hashlib
+import json
+import time
+from typing import Any, Optional, Sequence
+
+from app.config import settings
+from app.services.cache import ResponseCache
+
+
+class AnalysisResultStore:
+    """Résultats d'analyse rangés sous un id dérivé de leurs entrées
+    (opération, modèle, versions des prompts, texte) : la même demande
+    retrouve le même résultat, en POST comme en GET.
+
+    L'ETag est dérivé du contenu du résultat (et non de l'id) : si un
+    résultat expiré est recalculé différemment, les clients le voient.
+    """
+
+    def __init__(
+        self,
+        max_entries: int | None = None,
+        ttl_seconds: float | None = None,
+        database_url: Optional[str] = None
+    ):
+        if database_url is None and settings.analysis_results_persistent:
+            database_url = settings.database_url
+        self._cache = ResponseCache(
+            max_entries=max_entries or settings.analysis_results_max_entries,
+            ttl_seconds=ttl_seconds or settings.analysis_results_ttl_seconds,
+            database_url=database_url,
+            table="analysis_results"
+        )
+
+    @staticmethod
+    def result_id(operation: str, model: str, prompt_versions: Sequence[str], inputs: Any) -> str:
+        payload = {
+            "operation": operation,
+            "model": model,
+            "prompts": list(prompt_versions),
+            "inputs": inputs,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    async def get(self, result_id: str) -> Optional[dict]:
+        return await self._cache.get(result_id)
+
+    async def put(self, result_id: str, operation: str, result: dict) -> dict:
+        body = json.dumps(result, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        stored = {
+            "id": result_id,
+            "operation": operation,
+            "etag": f'"{hashlib.sha256(body.encode("utf-8")).hexdigest()[:16]}"',
+            "created_at": round(time.time(), 3),
+            "result": result,
+        }
+        await self._cache.set(result_id, stored)
+        return stored
+
+    def stats(self) -> dict:
+        return self._cache.get_stats()
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """En-tête If-None-Match (liste, `*`, ETags faibles W/) contre un ETag."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip() for tag in if_none_match.split(","))
+    return any(tag.removeprefix("W/") == etag for tag in candidates)
@@ -0,0 +1,309 @@
+# Ordonnancement des appels amont (budget tokens/minute, priorités)
+# app/services/scheduler.py
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable
+
+from fastapi import HTTPException, Request
+
+from app.config import settings
+from app.utils.metrics import SCHEDULER_CANCELLED, SCHEDULER_QUEUE, SCHEDULER_WAIT
+
+# Classes de priorité, de la plus à la moins prioritaire
+PRIORITIES = ("chat", "analysis", "batch")
+
+# Priorité des appels LLM de la requête / tâche courante
+current_priority: ContextVar[str] = ContextVar("current_priority", default="analysis")
+
+
+@contextmanager
+def priority(name: str):
+    """Classe de priorité des appels LLM faits dans ce bloc (et des tâches
+    qui y sont créées)."""
+    token = current_priority.set(name)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+
+class TokenBucket:
+    """Budget de tokens par minute, réapprovisionné en continu."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self._tokens = float(tokens_per_minute)
+        self._rate = tokens_per_minute / 60.0
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self, tokens: int):
+        """Attend que `tokens` soient disponibles (premier arrivé, premier servi)."""
+        tokens = min(tokens, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self._rate)
+                self._refill()
+            self._tokens -= tokens
+
+    def wait_time(self, tokens: int) -> float:
+        """Secondes avant que `tokens` soient disponibles (0 : tout de suite)."""
+        self._refill()
+        missing = min(tokens, self.capacity) - self._tokens
+        return max(0.0, missing / self._rate)
+
+    def consume(self, tokens: int):
+        self._refill()
+        self._tokens -= min(tokens, self.capacity)
+
+    def adjust(self, delta: int):
+        """Corrige l'estimation une fois la consommation réelle connue."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens - delta)
+
+
+class _Waiter:
+    __slots__ = ("future", "tokens", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, tokens: int):
+        self.future = future
+        self.tokens = tokens
+        self.enqueued_at = time.perf_counter()
+
+
+class _ClassStats:
+    __slots__ = (
+        "depth", "admitted", "cancelled", "wait_total", "wait_max",
+        "queue_gauge", "wait_histogram", "cancelled_counter"
+    )
+
+    def __init__(self, model: str, priority: str):
+        self.depth = 0
+        self.admitted = 0
+        self.cancelled = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.queue_gauge = SCHEDULER_QUEUE[(model, priority)]
+        self.wait_histogram = SCHEDULER_WAIT[(model, priority)]
+        self.cancelled_counter = SCHEDULER_CANCELLED[(model, priority)]
+
+    def enqueued(self):
+        self.depth += 1
+        self.queue_gauge.inc()
+
+    def admitted_after(self, waited: float):
+        self.depth -= 1
+        self.queue_gauge.dec()
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.wait_histogram.observe(waited)
+
+    def cancelled_before_admission(self):
+        self.depth -= 1
+        self.queue_gauge.dec()
+
+    def to_dict(self) -> dict:
+        return {
+            "queue_depth": self.depth,
+            "admitted": self.admitted,
+            "cancelled": self.cancelled,
+            "avg_wait_ms": round(self.wait_total / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self.wait_max * 1000, 1),
+        }
+
+
+class _ModelQueue:
+    """Files par classe de priorité et budgets (tokens, requêtes) d'un modèle."""
+
+    def __init__(self, model: str, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.queues: dict[str, deque[_Waiter]] = {p: deque() for p in PRIORITIES}
+        self.stats = {p: _ClassStats(model, p) for p in PRIORITIES}
+        # Start-time fair queuing : temps virtuel global et fin par classe
+        self.virtual_time = 0.0
+        self.finish = {p: 0.0 for p in PRIORITIES}
+        self.timer: asyncio.TimerHandle | None = None
+
+    def wait_time(self, tokens: int) -> float:
+        return max(
+            self.tokens.wait_time(tokens) if self.tokens else 0.0,
+            self.requests.wait_time(1) if self.requests else 0.0
+        )
+
+    def consume(self, tokens: int):
+        if self.tokens:
+            self.tokens.consume(tokens)
+        if self.requests:
+            self.requests.consume(1)
+
+    def refund(self, tokens: int):
+        if self.tokens:
+            self.tokens.adjust(-tokens)
+        if self.requests:
+            self.requests.adjust(-1)
+
+
+class Reservation:
+    """Budget réservé pour un appel ; `settle` corrige avec l'usage réel."""
+
+    def __init__(self, estimated: int):
+        self.estimated = estimated
+        self.used: int | None = None
+
+    def settle(self, used: int):
+        self.used = used
+
+
+class UpstreamScheduler:
+    """Admet les appels amont selon le budget tokens/minute (et requêtes/
+    minute) de chaque modèle.
+
+    Les appels en attente sont rangés par classe de priorité (chat >
+    analysis > batch) et servis en weighted fair queuing, pondéré par les
+    tokens estimés : les lots ne peuvent plus affamer le chat interactif,
+    sans pour autant être bloqués indéfiniment. Un appel annulé (client
+    déconnecté) quitte la file sans consommer de budget.
+    """
+
+    def __init__(
+        self,
+        tokens_per_minute: int | None = None,
+        requests_per_minute: int | None = None,
+        model_tokens_per_minute: dict[str, int] | None = None,
+        weights: dict[str, float] | None = None
+    ):
+        self._tpm = settings.upstream_tokens_per_minute if tokens_per_minute is None else tokens_per_minute
+        self._rpm = settings.upstream_requests_per_minute if requests_per_minute is None else requests_per_minute
+        self._model_tpm = (
+            settings.upstream_model_tokens_per_minute
+            if model_tokens_per_minute is None else model_tokens_per_minute
+        )
+        weights = weights or settings.scheduler_weights
+        self._weights = {p: float(weights.get(p, 1)) for p in PRIORITIES}
+        self._models: dict[str, _ModelQueue] = {}
+
+    def _queue(self, model: str) -> _ModelQueue:
+        queue = self._models.get(model)
+        if queue is None:
+            queue = _ModelQueue(model, self._model_tpm.get(model, self._tpm), self._rpm)
+            self._models[model] = queue
+        return queue
+
+    @asynccontextmanager
+    async def reserve(
+        self,
+        model: str,
+        tokens: int,
+        priority: str | None = None
+    ) -> AsyncIterator[Reservation]:
+        """Attend l'admission, puis corrige le budget avec l'usage réel
+        (`Reservation.settle`) ; sans usage connu (erreur), l'estimation
+        est rendue."""
+        queue = self._queue(model)
+        await self._admit(queue, tokens, priority or current_priority.get())
+        reservation = Reservation(tokens)
+        try:
+            yield reservation
+        finally:
+            used = reservation.used if reservation.used is not None else 0
+            if queue.tokens:
+                queue.tokens.adjust(used - tokens)
+                self._dispatch(queue)
+
+    async def _admit(self, queue: _ModelQueue, tokens: int, priority: str):
+        if priority not in queue.queues:
+            priority = "analysis"
+        stats = queue.stats[priority]
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(future, tokens)
+        queue.queues[priority].append(waiter)
+        stats.enqueued()
+        self._dispatch(queue)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Admis au même moment : rendre le budget
+                queue.refund(tokens)
+                stats.admitted -= 1
+            else:
+                stats.cancelled_before_admission()
+            stats.cancelled += 1
+            stats.cancelled_counter.inc()
+            self._dispatch(queue)
+            raise
+
+    def _next_class(self, queue: _ModelQueue) -> str | None:
+        best, best_start = None, 0.0
+        for priority in PRIORITIES:
+            waiters = queue.queues[priority]
+            # Appelants annulés : retirés paresseusement
+            while waiters and waiters[0].future.done():
+                waiters.popleft()
+            if not waiters:
+                continue
+            start = max(queue.virtual_time, queue.finish[priority])
+            if best is None or start < best_start:
+                best, best_start = priority, start
+        return best
+
+    def _dispatch(self, queue: _ModelQueue):
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        while (priority := self._next_class(queue)) is not None:
+            waiter = queue.queues[priority][0]
+            wait = queue.wait_time(waiter.tokens)
+            if wait > 0:
+                # Pas de dépassement de file : la tête attend son budget
+                queue.timer = asyncio.get_running_loop().call_later(wait, self._dispatch, queue)
+                return
+            queue.queues[priority].popleft()
+            queue.consume(waiter.tokens)
+            start = max(queue.virtual_time, queue.finish[priority])
+            queue.virtual_time = start
+            queue.finish[priority] = start + waiter.tokens / self._weights[priority]
+
+            queue.stats[priority].admitted_after(time.perf_counter() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def stats(self) -> dict:
+        """Profondeur de file et temps d'attente par modèle et par priorité."""
+        return {
+            model: {priority: queue.stats[priority].to_dict() for priority in PRIORITIES}
+            for model, queue in self._models.items()
+        }
+
+
+async def cancel_on_disconnect(request: Request, awaitable: Awaitable[Any]) -> Any:
+    """Exécute `awaitable` et l'annule si le client se déconnecte (un appel
+    encore en file d'attente la quitte alors sans consommer de budget).
+
+    À appeler une fois le corps de la requête lu.
+    """
+    task = asyncio.ensure_future(awaitable)
+
+    async def disconnected():
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.create_task(disconnected())
+    try:
+        done, _ = await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if task in done:
+            return task.result()
+        raise HTTPException(status_code=499, detail="Client disconnected")
+    finally:
+        watcher.cancel()
+        task.cancel()
@@ -0,0 +1,168 @@
+# Cache sémantique (quasi-doublons)
+# app/services/semantic_cache.py
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from app.config import settings
+from app.services.embeddings import Embedder, np
+
+logger = logging.getLogger("ai_backend")
+
+SNAPSHOT_VECTORS = "vectors.npy"
+SNAPSHOT_META = "meta.json"
+
+
+@dataclass
+class SemanticMatch:
+    slot: int
+    result_id: str
+    score: float
+
+
+class SemanticCache:
+    """Index des plus proches voisins, en NumPy, sur les textes déjà analysés.
+
+    Chaque entrée associe un vecteur à l'id d'un résultat (AnalysisResultStore)
+    dans un espace de noms (opération, modèle, prompts, catégories) : seules
+    les requêtes du même espace sont comparées. La recherche est un produit
+    matriciel sur toutes les lignes occupées.
+
+    La mémoire est bornée : `max_entries` lignes préallouées ; plein, la
+    ligne utilisée le moins récemment est remplacée. L'instantané (vecteurs
+    en .npy, métadonnées en JSON) est relu en mmap copy-on-write au
+    démarrage : les pages ne sont chargées qu'à l'usage.
+    """
+
+    def __init__(
+        self,
+        embedder: Embedder,
+        max_entries: int | None = None,
+        threshold: float | None = None,
+        snapshot_path: str | None = None
+    ):
+        self.embedder = embedder
+        self.max_entries = max_entries or settings.semantic_cache_max_entries
+        self.threshold = settings.semantic_cache_threshold if threshold is None else threshold
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else (
+            Path(settings.semantic_cache_snapshot_path) if settings.semantic_cache_snapshot_path else None
+        )
+        dim = embedder.dim
+        self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+        # Espace de noms de chaque ligne (-1 : libre) et dernier usage (0 : libre)
+        self._slot_namespaces = np.full(self.max_entries, -1, dtype=np.int32)
+        self._last_used = np.zeros(self.max_entries, dtype=np.float64)
+        self._ids: list[str | None] = [None] * self.max_entries
+        self._namespaces: dict[str, int] = {}
+        self._size = 0  # Lignes déjà utilisées au moins une fois
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale = 0
+
+    async def embed(self, text: str) -> "np.ndarray":
+        return (await self.embedder.embed([text]))[0]
+
+    def search(self, namespace: str, vector: "np.ndarray") -> SemanticMatch | None:
+        """Voisin le plus proche du même espace de noms, si assez proche."""
+        namespace_id = self._namespaces.get(namespace)
+        if namespace_id is None or self._size == 0:
+            self.misses += 1
+            return None
+        scores = self._vectors[:self._size] @ vector
+        scores[self._slot_namespaces[:self._size] != namespace_id] = -np.inf
+        slot = int(np.argmax(scores))
+        score = float(scores[slot])
+        if score < self.threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._last_used[slot] = time.time()
+        return SemanticMatch(slot, self._ids[slot], min(score, 1.0))
+
+    def add(self, namespace: str, vector: "np.ndarray", result_id: str):
+        if self._size < self.max_entries:
+            slot = self._size
+            self._size += 1
+        else:
+            # Ligne libre (0) ou la moins récemment utilisée
+            slot = int(np.argmin(self._last_used))
+            if self._ids[slot] is not None:
+                self.evictions += 1
+        namespace_id = self._namespaces.setdefault(namespace, len(self._namespaces))
+        self._vectors[slot] = vector
+        self._slot_namespaces[slot] = namespace_id
+        self._last_used[slot] = time.time()
+        self._ids[slot] = result_id
+
+    def discard(self, match: SemanticMatch):
+        """Résultat disparu du stockage (expiré, évincé) : ligne libérée."""
+        if self._ids[match.slot] == match.result_id:
+            self._ids[match.slot] = None
+            self._slot_namespaces[match.slot] = -1
+            self._last_used[match.slot] = 0
+            self.stale += 1
+
+    def load(self):
+        """Relit l'instantané (vecteurs en mmap) s'il correspond à la configuration."""
+        if self.snapshot_path is None or not (self.snapshot_path / SNAPSHOT_META).exists():
+            return
+        try:
+            meta = json.loads((self.snapshot_path / SNAPSHOT_META).read_text())
+            vectors = np.load(self.snapshot_path / SNAPSHOT_VECTORS, mmap_mode="c")
+        except (OSError, ValueError) as e:
+            logger.warning(f"Semantic cache snapshot ignored: {e}")
+            return
+        if (
+            meta.get("embedder") != self.embedder.name
+            or vectors.shape != self._vectors.shape
+            or vectors.dtype != self._vectors.dtype
+        ):
+            logger.warning("Semantic cache snapshot ignored: embedder or size changed")
+            return
+        size = meta["size"]
+        self._vectors = vectors
+        self._slot_namespaces[:size] = meta["slot_namespaces"]
+        self._last_used[:size] = meta["last_used"]
+        self._ids[:size] = meta["ids"]
+        self._namespaces = meta["namespaces"]
+        self._size = size
+
+    def save(self):
+        """Écrit l'instantané (fichiers temporaires puis renommage)."""
+        if self.snapshot_path is None:
+            return
+        self.snapshot_path.mkdir(parents=True, exist_ok=True)
+        vectors_tmp = self.snapshot_path / f"{SNAPSHOT_VECTORS}.tmp"
+        with open(vectors_tmp, "wb") as f:
+            np.save(f, self._vectors)
+        meta_tmp = self.snapshot_path / f"{SNAPSHOT_META}.tmp"
+        meta_tmp.write_text(json.dumps({
+            "embedder": self.embedder.name,
+            "size": self._size,
+            "ids": self._ids[:self._size],
+            "namespaces": self._namespaces,
+            "slot_namespaces": self._slot_namespaces[:self._size].tolist(),
+            "last_used": self._last_used[:self._size].tolist(),
+        }))
+        # Le mmap courant garde l'ancien fichier (même inode) jusqu'à sa fermeture
+        os.replace(vectors_tmp, self.snapshot_path / SNAPSHOT_VECTORS)
+        os.replace(meta_tmp, self.snapshot_path / SNAPSHOT_META)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "embedder": self.embedder.name,
+            "entries": int((self._slot_namespaces[:self._size] >= 0).sum()),
+            "max_entries": self.max_entries,
+            "memory_bytes": self._vectors.nbytes,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "stale": self.stale,
+        }
@@ -0,0 +1,251 @@
+# Décompte des tokens par client (registre d'usage)
+# app/services/usage.py
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.config import settings
+from app.models.database import UsageRecord, get_async_engine, get_async_sessionmaker
+from app.services.api_keys import APIKeyIdentity, current_api_key, current_user_id
+from app.utils.metrics import current_endpoint
+
+logger = logging.getLogger("ai_backend")
+
+# (période, clé, utilisateur, modèle, route)
+UsageKey = Tuple[str, str, str, str, str]
+
+
+def current_period() -> str:
+    """Période de facturation : mois calendaire UTC (YYYY-MM)."""
+    return datetime.now(timezone.utc).strftime("%Y-%m")
+
+
+class UsageLedger:
+    """Tokens consommés par clé API / utilisateur / modèle / route.
+
+    Les appels ne font qu'incrémenter des compteurs en mémoire ; une tâche
+    de fond les écrit par lots (un upsert par ligne agrégée, un commit par
+    flush) et recharge au passage les totaux du mois de chaque clé, écrits
+    par tous les workers. Le budget mensuel est vérifié sur ces totaux,
+    sans accès à la base. Un appel déjà en vol peut dépasser le budget de
+    sa propre consommation.
+    """
+
+    def __init__(self, flush_interval: float | None = None):
+        self.flush_interval = flush_interval or settings.usage_flush_interval
+        # Deltas non encore écrits : clé -> [requêtes, tokens prompt, tokens réponse]
+        self._pending: Dict[UsageKey, List[int]] = {}
+        # Tokens du mois par clé API (base + deltas en attente)
+        self._totals: Dict[str, int] = {}
+        self._period = current_period()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: asyncio.Task | None = None
+        self._stopping = asyncio.Event()
+        self.recorded = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.flush_errors = 0
+        self.rejected = 0
+
+    async def start(self):
+        await self._load_totals()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Arrêt : dernier flush (appelé depuis le lifespan)."""
+        self._stopping.set()
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+    def check_budget(self):
+        """Refuse l'appel si la clé de la requête a épuisé son budget du mois."""
+        identity = current_api_key.get()
+        if identity is None or identity.monthly_token_budget is None:
+            return
+        self._roll_period()
+        if self._totals.get(identity.key_id, 0) >= identity.monthly_token_budget:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Monthly token budget exceeded")
+
+    def record(self, model: str, prompt_tokens: int, completion_tokens: int):
+        """Consommation d'un appel, attribuée à la clé et à la route courantes."""
+        self._roll_period()
+        identity = current_api_key.get()
+        key_id = identity.key_id if identity else ""
+        key = (self._period, key_id, current_user_id.get() or "", model, current_endpoint())
+        counters = self._pending.get(key)
+        if counters is None:
+            counters = self._pending[key] = [0, 0, 0]
+        counters[0] += 1
+        counters[1] += prompt_tokens
+        counters[2] += completion_tokens
+        if key_id:
+            self._totals[key_id] = self._totals.get(key_id, 0) + prompt_tokens + completion_tokens
+        self.recorded += 1
+
+    def _roll_period(self):
+        period = current_period()
+        if period != self._period:
+            # Nouveau mois : les budgets repartent de zéro
+            self._period = period
+            self._totals = {}
+
+    async def _flush_loop(self):
+        # Arrêt coopératif : jamais annulé au milieu d'une écriture
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.flush()
+
+    async def flush(self):
+        """Écrit les compteurs agrégés en un seul commit."""
+        async with self._flush_lock:
+            if self._pending:
+                batch, self._pending = self._pending, {}
+                try:
+                    await self._write_batch(batch)
+                except Exception as e:
+                    # Réintégrer le lot pour le prochain essai
+                    self._merge(batch)
+                    self.flush_errors += 1
+                    logger.error(f"Usage flush failed ({len(batch)} rows): {e}")
+                    return
+                except BaseException:
+                    # Annulé en cours d'écriture : les tokens restent à écrire
+                    self._merge(batch)
+                    raise
+                self.flushes += 1
+                self.rows_written += len(batch)
+            try:
+                await self._load_totals()
+            except Exception as e:
+                logger.error(f"Usage totals reload failed: {e}")
+
+    def _merge(self, batch: Dict[UsageKey, List[int]]):
+        for key, (requests, prompt_tokens, completion_tokens) in batch.items():
+            counters = self._pending.setdefault(key, [0, 0, 0])
+            counters[0] += requests
+            counters[1] += prompt_tokens
+            counters[2] += completion_tokens
+
+    @staticmethod
+    async def _write_batch(batch: Dict[UsageKey, List[int]]):
+        engine = get_async_engine()
+        dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+        now = datetime.utcnow()
+        rows = [
+            {
+                "period": period,
+                "api_key_id": key_id,
+                "user_id": user_id,
+                "model": model,
+                "endpoint": endpoint,
+                "requests": requests,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "updated_at": now,
+            }
+            for (period, key_id, user_id, model, endpoint), (requests, prompt_tokens, completion_tokens)
+            in batch.items()
+        ]
+        stmt = dialect.insert(UsageRecord)
+        table = UsageRecord.__table__
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[c.name for c in table.primary_key.columns],
+            set_={
+                "requests": table.c.requests + stmt.excluded.requests,
+                "prompt_tokens": table.c.prompt_tokens + stmt.excluded.prompt_tokens,
+                "completion_tokens": table.c.completion_tokens + stmt.excluded.completion_tokens,
+                "updated_at": stmt.excluded.updated_at,
+            }
+        )
+        async with get_async_sessionmaker()() as db:
+            await db.execute(stmt, rows)
+            await db.commit()
+
+    async def _load_totals(self):
+        """Totaux du mois par clé (tous workers), plus les deltas locaux non écrits."""
+        period = current_period()
+        async with get_async_sessionmaker()() as db:
+            rows = (await db.execute(
+                select(
+                    UsageRecord.api_key_id,
+                    func.sum(UsageRecord.prompt_tokens + UsageRecord.completion_tokens)
+                )
+                .where(UsageRecord.period == period, UsageRecord.api_key_id != "")
+                .group_by(UsageRecord.api_key_id)
+            )).all()
+        totals = {key_id: int(tokens) for key_id, tokens in rows}
+        for (row_period, key_id, _, _, _), (_, prompt_tokens, completion_tokens) in self._pending.items():
+            if key_id and row_period == period:
+                totals[key_id] = totals.get(key_id, 0) + prompt_tokens + completion_tokens
+        self._period = period
+        self._totals = totals
+
+    async def usage(self, identity: APIKeyIdentity) -> dict:
+        """Consommation du mois d'une clé (écrite et en attente), par modèle,
+        route et utilisateur."""
+        period = current_period()
+        async with get_async_sessionmaker()() as db:
+            rows = (await db.execute(
+                select(
+                    UsageRecord.user_id,
+                    UsageRecord.model,
+                    UsageRecord.endpoint,
+                    UsageRecord.requests,
+                    UsageRecord.prompt_tokens,
+                    UsageRecord.completion_tokens
+                )
+                .where(UsageRecord.period == period, UsageRecord.api_key_id == identity.key_id)
+            )).all()
+
+        breakdown: Dict[Tuple[str, str, str], List[int]] = {
+            (user_id, model, endpoint): [requests, prompt_tokens, completion_tokens]
+            for user_id, model, endpoint, requests, prompt_tokens, completion_tokens in rows
+        }
+        for (row_period, key_id, user_id, model, endpoint), counters in self._pending.items():
+            if key_id == identity.key_id and row_period == period:
+                current = breakdown.setdefault((user_id, model, endpoint), [0, 0, 0])
+                for i, value in enumerate(counters):
+                    current[i] += value
+
+        used = sum(prompt_tokens + completion_tokens for _, prompt_tokens, completion_tokens in breakdown.values())
+        budget = identity.monthly_token_budget
+        return {
+            "period": period,
+            "api_key_id": identity.key_id,
+            "tokens_used": used,
+            "monthly_token_budget": budget,
+            "remaining": max(0, budget - used) if budget is not None else None,
+            "breakdown": [
+                {
+                    "user_id": user_id or None,
+                    "model": model,
+                    "endpoint": endpoint,
+                    "requests": requests,
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                }
+                for (user_id, model, endpoint), (requests, prompt_tokens, completion_tokens)
+                in sorted(breakdown.items())
+            ],
+        }
+
+    def stats(self) -> dict:
+        return {
+            "recorded": self.recorded,
+            "pending_rows": len(self._pending),
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "flush_errors": self.flush_errors,
+            "budget_rejections": self.rejected,
+        }
@@ -0,0 +1,97 @@
+# Découpage de documents en chunks
+# app/utils/chunking.py
+import re
+import zlib
+from dataclasses import dataclass
+from typing import List
+
+from app.utils.tokens import count_tokens
+
+# Fin de phrase ou de paragraphe (le séparateur reste attaché à la phrase)
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n\s*\n")
+
+
+@dataclass
+class Chunk:
+    index: int
+    start: int  # Offset du chunk dans le document
+    end: int
+    text: str
+
+
+def split_sentences(text: str) -> List[tuple[int, int]]:
+    """Positions (start, end) des phrases ; les séparateurs sont inclus."""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END.finditer(text):
+        spans.append((start, match.end()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def chunk_text(
+    text: str,
+    max_tokens: int = 1500,
+    overlap_tokens: int = 100,
+    target_tokens: int | None = None
+) -> List[Chunk]:
+    """Découpe un texte en chunks bornés en tokens, qui se chevauchent.
+
+    Les coupures sont définies par le contenu : on coupe après une phrase
+    dont l'empreinte tombe sur un multiple donné (taille moyenne
+    `target_tokens`), ou quand `max_tokens` serait dépassé. Une modification
+    locale du document ne déplace donc que les coupures voisines, et les
+    autres chunks restent identiques (réutilisables depuis le cache).
+    """
+    target_tokens = target_tokens or max_tokens // 2
+    sentences: List[tuple[int, int]] = []
+    counts: List[int] = []
+    for s, e in split_sentences(text):
+        count = count_tokens(text[s:e])
+        if count <= max_tokens - overlap_tokens:
+            sentences.append((s, e))
+            counts.append(count)
+            continue
+        # Phrase trop longue : découpe en fenêtres de caractères
+        step = max(1, (e - s) * (max_tokens - overlap_tokens) // count)
+        for sub in range(s, e, step):
+            sentences.append((sub, min(e, sub + step)))
+            counts.append(count_tokens(text[sub:min(e, sub + step)]))
+
+    if not sentences:
+        return []
+    # Coupure en moyenne toutes les `modulus` phrases
+    average_sentence = max(1, sum(counts) // len(counts))
+    modulus = max(1, round(target_tokens / average_sentence))
+
+    # Regroupement des phrases en segments sans chevauchement
+    # (en réservant la place du chevauchement dans `max_tokens`)
+    segment_tokens = max(1, max_tokens - overlap_tokens)
+    segments: List[tuple[int, int]] = []  # (première phrase, dernière phrase exclue)
+    first, tokens = 0, 0
+    for i, count in enumerate(counts):
+        if i > first and tokens + count > segment_tokens:
+            segments.append((first, i))
+            first, tokens = i, 0
+        tokens += count
+        s, e = sentences[i]
+        fingerprint = zlib.crc32(text[s:e].strip().encode("utf-8"))
+        if fingerprint % modulus == 0:
+            segments.append((first, i + 1))
+            first, tokens = i + 1, 0
+    if first < len(sentences):
+        segments.append((first, len(sentences)))
+
+    chunks: List[Chunk] = []
+    for first, last in segments:
+        # Chevauchement : reprendre les dernières phrases du segment précédent
+        start_sentence, overlap = first, 0
+        while start_sentence > 0 and overlap + counts[start_sentence - 1] <= overlap_tokens:
+            start_sentence -= 1
+            overlap += counts[start_sentence]
+        start = sentences[start_sentence][0]
+        end = sentences[last - 1][1]
+        chunks.append(Chunk(index=len(chunks), start=start, end=end, text=text[start:end]))
+    return chunks
@@ -0,0 +1,150 @@
+# Logging asynchrone (file bornée + thread d'écriture)
+# app/utils/log_pipeline.py
+import json
+import logging
+import queue
+import sys
+import threading
+from contextvars import ContextVar
+from typing import BinaryIO
+
+from app.config import settings
+from app.utils.metrics import LOG_DROPPED, LOG_WRITTEN
+
+try:
+    import orjson
+except ImportError:  # Optionnel : json de la stdlib sinon
+    orjson = None
+
+# Identifiant de la requête courante (hérité par les tâches qu'elle crée)
+current_request_id: ContextVar[str | None] = ContextVar("current_request_id", default=None)
+
+_STOP = object()
+
+
+def _dumps(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, default=str) + b"\n"
+    return (json.dumps(data, default=str, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class QueuedLogHandler(logging.Handler):
+    """Handler non bloquant : l'enregistrement est sérialisé en JSON dans le
+    thread appelant (request_id compris), puis déposé dans une file bornée ;
+    un thread dédié écrit les lignes par lots.
+
+    File pleine : l'enregistrement est abandonné et compté, l'appelant
+    n'attend jamais le sink.
+    """
+
+    def __init__(self, stream: BinaryIO, queue_size: int = 10000, batch_size: int = 256):
+        super().__init__()
+        self.stream = stream
+        self.batch_size = batch_size
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._thread: threading.Thread | None = None
+        self.written = 0
+        self.dropped = 0
+
+    def serialize(self, record: logging.LogRecord) -> bytes:
+        data = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": current_request_id.get(),
+            "message": record.getMessage(),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            data.update(fields)
+        if record.exc_info:
+            data["exception"] = logging.Formatter().formatException(record.exc_info)
+        return _dumps(data)
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.serialize(record)
+        except Exception:
+            self.handleError(record)
+            return
+        try:
+            self._queue.put_nowait(line)
+        except queue.Full:
+            self.dropped += 1
+            LOG_DROPPED.inc()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """Vide la file puis arrête le thread d'écriture."""
+        if self._thread is not None:
+            try:
+                self._queue.put(_STOP, timeout=5)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=5)
+            self._thread = None
+        super().close()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = item is _STOP
+            if not stop:
+                batch.append(item)
+            # Lot : tout ce qui est déjà en file, dans la limite de batch_size
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch: list[bytes]):
+        try:
+            self.stream.write(b"".join(batch))
+            self.stream.flush()
+        except Exception:
+            # Sink indisponible : les lignes sont perdues, pas l'application
+            self.dropped += len(batch)
+            LOG_DROPPED.inc(len(batch))
+            return
+        self.written += len(batch)
+        LOG_WRITTEN.inc(len(batch))
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+def setup_logging() -> QueuedLogHandler:
+    """Branche le handler asynchrone sur le logger `ai_backend` (lifespan)."""
+    stream = open(settings.log_file, "ab") if settings.log_file else sys.stderr.buffer
+    handler = QueuedLogHandler(stream, settings.log_queue_size, settings.log_batch_size)
+    handler.start()
+    logger = logging.getLogger("ai_backend")
+    logger.setLevel(settings.log_level.upper())
+    logger.addHandler(handler)
+    logger.propagate = False
+    return handler
+
+
+def shutdown_logging(handler: QueuedLogHandler):
+    logger = logging.getLogger("ai_backend")
+    logger.removeHandler(handler)
+    handler.close()
+    if handler.stream is not sys.stderr.buffer:
+        handler.stream.close()
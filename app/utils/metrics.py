@@ -0,0 +1,152 @@
+# Métriques Prometheus
+# app/utils/metrics.py
+import os
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Plusieurs workers uvicorn : PROMETHEUS_MULTIPROC_DIR (répertoire vide au
+# démarrage) doit être défini avant le lancement ; chaque worker écrit ses
+# valeurs dans des fichiers mmap agrégés par /metrics.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120)
+TTFT_BUCKETS = (0.05, 0.1, 0.2, 0.35, 0.5, 0.75, 1, 1.5, 2.5, 5, 10)
+
+
+class _Children(dict):
+    """Enfants `labels(...)` créés une fois par combinaison de labels : le
+    chemin chaud fait une lecture de dict (clé tuple), pas un `labels()`."""
+
+    def __init__(self, metric):
+        super().__init__()
+        self.metric = metric
+
+    def __missing__(self, key: tuple):
+        child = self[key] = self.metric.labels(*key)
+        return child
+
+
+# HTTP
+HTTP_REQUESTS = _Children(Counter(
+    "http_requests_total", "Requêtes HTTP traitées", ["method", "route", "status"]
+))
+HTTP_DURATION = _Children(Histogram(
+    "http_request_duration_seconds", "Durée des requêtes HTTP (jusqu'au dernier octet)",
+    ["method", "route"], buckets=LATENCY_BUCKETS
+))
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requêtes HTTP en cours", multiprocess_mode="livesum"
+)
+
+# Appels amont
+UPSTREAM_DURATION = _Children(Histogram(
+    "llm_upstream_duration_seconds", "Durée des complétions amont (non streamées)",
+    ["provider", "model"], buckets=UPSTREAM_BUCKETS
+))
+UPSTREAM_TTFT = _Children(Histogram(
+    "llm_time_to_first_token_seconds", "Délai avant le premier chunk d'un flux amont",
+    ["provider", "model"], buckets=TTFT_BUCKETS
+))
+UPSTREAM_ERRORS = _Children(Counter(
+    "llm_upstream_errors_total", "Erreurs des appels amont", ["provider", "status"]
+))
+UPSTREAM_IN_FLIGHT = _Children(Gauge(
+    "llm_upstream_in_flight", "Appels amont en cours", ["provider"], multiprocess_mode="livesum"
+))
+TOKENS = _Children(Counter(
+    "llm_tokens_total", "Tokens consommés en amont",
+    ["model", "endpoint", "direction"]
+))
+
+# Cache, ordonnanceur, rate limiting
+_CACHE = Counter("llm_cache_requests_total", "Consultations du cache de réponses", ["result"])
+CACHE_HITS = _CACHE.labels("hit")
+CACHE_MISSES = _CACHE.labels("miss")
+
+SCHEDULER_WAIT = _Children(Histogram(
+    "llm_scheduler_wait_seconds", "Attente d'admission par l'ordonnanceur amont",
+    ["model", "priority"], buckets=LATENCY_BUCKETS
+))
+SCHEDULER_QUEUE = _Children(Gauge(
+    "llm_scheduler_queue_depth", "Appels en attente d'admission",
+    ["model", "priority"], multiprocess_mode="livesum"
+))
+SCHEDULER_CANCELLED = _Children(Counter(
+    "llm_scheduler_cancelled_total", "Appels annulés avant admission", ["model", "priority"]
+))
+
+_RATE_LIMIT = Counter("rate_limit_decisions_total", "Décisions du rate limiting", ["result"])
+RATE_LIMIT_ALLOWED = _RATE_LIMIT.labels("allowed")
+RATE_LIMIT_REJECTED = _RATE_LIMIT.labels("rejected")
+
+# Logging (file asynchrone)
+_LOG_RECORDS = Counter("log_records_total", "Lignes de log par issue", ["outcome"])
+LOG_WRITTEN = _LOG_RECORDS.labels("written")
+LOG_DROPPED = _LOG_RECORDS.labels("dropped")
+LOG_SAMPLED_OUT = _LOG_RECORDS.labels("sampled_out")
+
+
+# Route de la requête courante (label `endpoint` des tokens)
+current_scope: ContextVar[dict | None] = ContextVar("current_scope", default=None)
+
+
+def route_template(scope: dict) -> str:
+    """Gabarit de la route (`/api/jobs/{job_id}`), pour borner la cardinalité
+    des labels ; « unmatched » si aucune route n'a été trouvée.
+
+    Reconstruit depuis le chemin et les `path_params` : le `path` de la route
+    n'inclut pas toujours le préfixe du router inclus.
+    """
+    if "route" not in scope:
+        return "unmatched"
+    path = scope["path"]
+    params = scope.get("path_params")
+    if not params:
+        return path
+    names = {str(value): name for name, value in params.items()}
+    return "/".join(
+        f"{{{names[segment]}}}" if segment in names else segment
+        for segment in path.split("/")
+    )
+
+
+def current_endpoint() -> str:
+    """Route de la requête en cours ; les tâches créées pendant la requête
+    (jobs) en héritent."""
+    scope = current_scope.get()
+    if scope is None:
+        return "background"
+    return route_template(scope)
+
+
+def record_tokens(model: str, prompt_tokens: int, completion_tokens: int):
+    endpoint = current_endpoint()
+    TOKENS[(model, endpoint, "in")].inc(prompt_tokens)
+    TOKENS[(model, endpoint, "out")].inc(completion_tokens)
+
+
+def render() -> tuple[bytes, str]:
+    """Exposition texte de toutes les métriques (tous workers confondus)."""
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_process_dead():
+    """Arrêt du worker : ses jauges `livesum` ne sont plus comptées."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
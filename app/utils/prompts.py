@@ -1 +1,249 @@
 # Templates de prompts
+# app/utils/prompts.py
+import re
+from dataclasses import dataclass
+from string import Formatter
+
+from app.config import settings
+from app.models.schemas import Message, Role
+from app.utils.tokens import count_tokens
+
+# Délimiteur des blocs de texte fournis par l'utilisateur
+DELIMITER = '"""'
+
+_CONTROL = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+
+def escape(value) -> str:
+    """Valeur de slot : caractères de contrôle retirés et délimiteurs
+    neutralisés, pour que le texte ne puisse pas fermer son bloc."""
+    text = value if isinstance(value, str) else str(value)
+    return _CONTROL.sub("", text).replace(DELIMITER, "'''")
+
+
+@dataclass
+class PromptStats:
+    renders: int = 0
+    cached: int = 0
+    prompt_tokens: int = 0
+    static_tokens: int = 0
+    completion_tokens: int = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "renders": self.renders,
+            "cached_responses": self.cached,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.renders, 1) if self.renders else 0.0,
+            "static_share": round(self.static_tokens / self.prompt_tokens, 4) if self.prompt_tokens else 0.0,
+        }
+
+
+class Rendered:
+    """Prompt rendu ; `tokens` (estimation) évite de re-tokeniser le prompt
+    pour le budget amont (`LLMService.complete(prompt_tokens=...)`)."""
+
+    __slots__ = ("template", "text", "tokens")
+
+    def __init__(self, template: "PromptTemplate", text: str, tokens: int):
+        self.template = template
+        self.text = text
+        self.tokens = tokens
+
+    def messages(self) -> list[Message]:
+        return [Message(role=Role.USER, content=self.text)]
+
+    def record(self, result: dict):
+        """Tokens de réponse, pour les statistiques du template."""
+        stats = self.template.stats
+        if result.get("cached"):
+            stats.cached += 1
+        else:
+            stats.completion_tokens += result.get("completion_tokens", 0)
+
+
+class PromptTemplate:
+    """Template compilé : préfixe statique (instructions, format de sortie)
+    puis corps à slots `{nom}`.
+
+    Le préfixe est identique d'un appel à l'autre (cache de prompt amont) ;
+    le corps est découpé une fois en parties littérales et slots, et les
+    tokens des parties statiques sont comptés une fois par modèle.
+    """
+
+    def __init__(self, name: str, version: int, prefix: str, body: str):
+        self.name = name
+        self.version = version
+        self.prefix = prefix
+        self._parts: list[tuple[str, str | None]] = []
+        for literal, field, spec, conversion in Formatter().parse(body):
+            if field is not None and (not field.isidentifier() or spec or conversion):
+                raise ValueError(f"Prompt '{name}': invalid slot {{{field}}}")
+            self._parts.append((literal, field))
+        self.slots = frozenset(field for _, field in self._parts if field is not None)
+        self._static_tokens: dict[str, int] = {}
+        self.stats = PromptStats()
+
+    @property
+    def key(self) -> str:
+        return f"{self.name}@v{self.version}"
+
+    def static_tokens(self, model: str | None = None) -> int:
+        model = model or settings.default_model
+        tokens = self._static_tokens.get(model)
+        if tokens is None:
+            static = self.prefix + "".join(literal for literal, _ in self._parts)
+            tokens = self._static_tokens[model] = count_tokens(static, model)
+        return tokens
+
+    def render(self, model: str | None = None, **values) -> Rendered:
+        if values.keys() != self.slots:
+            raise ValueError(
+                f"Prompt '{self.key}' expects slots {sorted(self.slots)}, got {sorted(values)}"
+            )
+        model = model or settings.default_model
+        escaped = {name: escape(value) for name, value in values.items()}
+        text = self.prefix + "".join(
+            literal + (escaped[field] if field is not None else "")
+            for literal, field in self._parts
+        )
+        static = self.static_tokens(model)
+        tokens = static + sum(count_tokens(v, model) for v in escaped.values() if v)
+
+        self.stats.renders += 1
+        self.stats.prompt_tokens += tokens
+        self.stats.static_tokens += static
+        return Rendered(self, text, tokens)
+
+
+class PromptRegistry:
+    """Templates nommés et versionnés. Par défaut la dernière version est
+    utilisée ; `prompt_versions` (Settings) permet d'en épingler une."""
+
+    def __init__(self):
+        self._templates: dict[str, dict[int, PromptTemplate]] = {}
+
+    def register(self, name: str, version: int, prefix: str, body: str) -> PromptTemplate:
+        versions = self._templates.setdefault(name, {})
+        if version in versions:
+            raise ValueError(f"Prompt '{name}' v{version} already registered")
+        template = versions[version] = PromptTemplate(name, version, prefix, body)
+        return template
+
+    def get(self, name: str, version: int | None = None) -> PromptTemplate:
+        versions = self._templates[name]
+        version = version or settings.prompt_versions.get(name) or max(versions)
+        return versions[version]
+
+    def warm(self, model: str | None = None):
+        """Compte les tokens statiques de tous les templates (au démarrage)."""
+        for versions in self._templates.values():
+            for template in versions.values():
+                template.static_tokens(model)
+
+    def stats(self) -> dict:
+        """Rendus et tokens par template, du plus coûteux au moins coûteux."""
+        templates = [t for versions in self._templates.values() for t in versions.values()]
+        templates.sort(key=lambda t: t.stats.prompt_tokens + t.stats.completion_tokens, reverse=True)
+        return {
+            t.key: {"static_tokens": t.static_tokens(), **t.stats.to_dict()}
+            for t in templates if t.stats.renders
+        }
+
+
+prompts = PromptRegistry()
+
+
+# Analyse
+prompts.register("analysis.document", 1, prefix="""\
+Analyse le document fourni à la fin (entre triple guillemets) et retourne un JSON avec cette structure exacte :
+{
+  "summary": "Résumé en 2-3 phrases",
+  "sentiment": {
+    "sentiment": "POSITIVE|NEGATIVE|NEUTRAL",
+    "confidence": 0.0-1.0,
+    "explanation": "Explication courte"
+  },
+  "entities": [
+    {"text": "entité", "type": "PERSON|ORG|LOCATION|DATE", "start": 0, "end": 10}
+  ],
+  "key_points": ["Point 1", "Point 2", "Point 3"]
+}
+Réponds uniquement avec le JSON, sans markdown.
+""", body='''
+Document :
+"""
+{text}
+"""
+''')
+
+prompts.register("analysis.merge", 1, prefix="""\
+Voici les résumés des parties successives d'un même document.
+Fusionne-les et retourne un JSON avec cette structure exacte :
+{"summary": "Résumé global en 2-3 phrases", "key_points": ["Point 1", "Point 2", "Point 3"]}
+Réponds uniquement avec le JSON, sans markdown.
+""", body="""
+{sections}
+""")
+
+# Classification
+prompts.register("classify.single", 1, prefix="""\
+Classifie le texte fourni à la fin (entre triple guillemets) dans UNE des catégories données.
+Réponds avec un JSON :
+{"category": "CATÉGORIE", "confidence": 0.0-1.0, "reasoning": "explication"}
+JSON uniquement.
+""", body='''
+Catégories : {categories}
+Texte :
+"""
+{text}
+"""
+''')
+
+prompts.register("classify.batch", 1, prefix="""\
+Classifie chacun des textes numérotés fournis à la fin dans UNE des catégories données.
+Réponds avec un objet JSON dont "results" contient un objet par texte, avec son index :
+{"results": [{"index": 0, "category": "CATÉGORIE", "confidence": 0.0-1.0, "reasoning": "explication"}]}
+JSON uniquement.
+""", body="""
+Catégories : {categories}
+Textes :
+{items}
+""")
+
+# Traitement par batch
+prompts.register("batch.summarize", 1, prefix="""\
+Résume en une phrase le texte fourni (entre triple guillemets).
+""", body='''"""
+{text}
+"""''')
+
+prompts.register("batch.sentiment", 1, prefix="""\
+Donne le sentiment (POSITIVE/NEGATIVE/NEUTRAL) du texte fourni (entre triple guillemets).
+Réponds avec juste le mot.
+""", body='''"""
+{text}
+"""''')
+
+# Services
+prompts.register("conversation.summary", 1, prefix="""\
+Mets à jour le résumé de la conversation avec les nouveaux échanges. \
+Garde les faits, décisions et préférences utiles pour la suite, en quelques phrases.
+""", body="""
+Résumé actuel : {previous}
+
+Nouveaux échanges :
+{transcript}
+
+Résumé mis à jour :""")
+
+prompts.register("structured.repair", 1, prefix="""\
+Le JSON suivant est invalide ou ne respecte pas le schéma. \
+Corrige-le sans changer son contenu et réponds uniquement avec le JSON corrigé.
+""", body="""
+Schéma : {schema}
+
+Erreur : {error}
+
+JSON : {content}""")
@@ -0,0 +1,92 @@
+# Encodage Server-Sent Events
+# app/utils/sse.py
+import asyncio
+import json
+import time
+from json.encoder import encode_basestring
+from typing import AsyncIterator
+
+# Frames constantes, encodées une seule fois
+DONE_FRAME = b"data: [DONE]\n\n"
+HEARTBEAT_FRAME = b": ping\n\n"
+
+_CONTENT_PREFIX = b'data: {"content": '
+_FRAME_SUFFIX = b"}\n\n"
+
+
+def content_frame(text: str) -> bytes:
+    """Équivalent de `data: {json.dumps({'content': text}, ensure_ascii=False)}`
+    (non-ASCII laissé tel quel, en UTF-8) sans dict intermédiaire."""
+    return _CONTENT_PREFIX + encode_basestring(text).encode("utf-8") + _FRAME_SUFFIX
+
+
+def json_frame(payload: dict) -> bytes:
+    return b"data: " + json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n\n"
+
+
+async def sse_content_frames(
+    chunks: AsyncIterator[str],
+    coalesce_ms: float = 0,
+    coalesce_bytes: int = 0,
+    heartbeat_interval: float = 15.0
+) -> AsyncIterator[bytes]:
+    """Transforme des chunks de texte en frames SSE.
+
+    Avec `coalesce_ms`, les chunks reçus pendant cette fenêtre sont regroupés
+    en une seule frame (moins d'écritures réseau) ; `coalesce_bytes` force
+    l'envoi dès que le regroupement atteint cette taille. Les deux seuils
+    sont indépendants : avec la taille seule, un regroupement incomplet part
+    au plus tard après `heartbeat_interval`. Un commentaire de heartbeat est
+    émis si rien n'a été envoyé depuis `heartbeat_interval`.
+    """
+    iterator = chunks.__aiter__()
+    buffer: list[str] = []
+    buffered = 0
+    deadline = 0.0
+    pending: asyncio.Future | None = None
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+
+            timeout = heartbeat_interval
+            if buffer:
+                timeout = max(0.0, min(timeout, deadline - time.monotonic()))
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+
+            if not done:
+                if buffer:
+                    yield content_frame("".join(buffer))
+                    buffer, buffered = [], 0
+                else:
+                    yield HEARTBEAT_FRAME
+                continue
+
+            task, pending = pending, None
+            try:
+                chunk = task.result()
+            except StopAsyncIteration:
+                break
+
+            if not coalesce_ms and not coalesce_bytes:
+                yield content_frame(chunk)
+                continue
+
+            if not buffer:
+                deadline = time.monotonic() + (coalesce_ms / 1000 if coalesce_ms else heartbeat_interval)
+            buffer.append(chunk)
+            buffered += len(chunk)
+            if coalesce_bytes and buffered >= coalesce_bytes:
+                yield content_frame("".join(buffer))
+                buffer, buffered = [], 0
+
+        if buffer:
+            yield content_frame("".join(buffer))
+    finally:
+        if pending is not None and not pending.done():
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, Exception):
+                pass
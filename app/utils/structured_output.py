@@ -0,0 +1,240 @@
+# Sorties structurées (JSON) des LLMs
+# app/utils/structured_output.py
+import json
+import logging
+import re
+from collections import defaultdict
+from typing import Any, Iterable, Type, TypeVar
+
+from pydantic import BaseModel, ValidationError
+
+from app.container import current_container
+from app.models.schemas import Message
+from app.utils.prompts import prompts
+
+try:
+    import orjson
+except ImportError:  # Optionnel : json de la stdlib sinon
+    orjson = None
+
+logger = logging.getLogger("ai_backend")
+
+T = TypeVar("T", bound=BaseModel)
+
+# Modèles OpenAI acceptant `response_format`
+JSON_SCHEMA_MODELS = ("gpt-4o", "gpt-4.1", "o1", "o3", "o4")
+JSON_MODE_MODELS = ("gpt-4-turbo", "gpt-4-1106", "gpt-4-0125", "gpt-3.5-turbo") + JSON_SCHEMA_MODELS
+
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+class StructuredOutputError(ValueError):
+    """Réponse du LLM impossible à interpréter, même après réparation."""
+
+
+def _loads(raw: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def strip_code_fence(content: str) -> str:
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.split("```")[1]
+        if content.startswith("json"):
+            content = content[4:]
+    return content.strip()
+
+
+def extract_json_block(content: str) -> str | None:
+    """Premier objet ou tableau JSON équilibré du texte (chaînes prises en compte)."""
+    start = next((i for i, c in enumerate(content) if c in "{["), None)
+    if start is None:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(content)):
+        c = content[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c in "{[":
+            depth += 1
+        elif c in "}]":
+            depth -= 1
+            if depth == 0:
+                return content[start:i + 1]
+    return content[start:]  # Non terminé : laisser la réparation tenter sa chance
+
+
+def remove_trailing_commas(raw: str) -> str:
+    """Supprime les virgules avant `}` / `]`, hors des chaînes."""
+    parts = re.split(r'("(?:[^"\\]|\\.)*")', raw)
+    return "".join(
+        part if i % 2 else _TRAILING_COMMA.sub(r"\1", part)
+        for i, part in enumerate(parts)
+    )
+
+
+def parse_json(content: str) -> Any:
+    """Parse tolérant : JSON direct, sinon bloc extrait (fences, texte autour,
+    virgules finales)."""
+    candidates = [content, strip_code_fence(content)]
+    block = extract_json_block(candidates[-1])
+    if block is not None:
+        candidates += [block, remove_trailing_commas(block)]
+
+    error: Exception | None = None
+    for candidate in candidates:
+        try:
+            return _loads(candidate)
+        except ValueError as e:  # JSONDecodeError / orjson.JSONDecodeError
+            error = e
+    raise StructuredOutputError(f"Invalid JSON: {error}")
+
+
+def response_format_for(
+    model: str,
+    schema_model: Type[BaseModel] | None = None,
+    exclude: Iterable[str] = ()
+) -> dict | None:
+    """`response_format` le plus strict supporté par le modèle."""
+    if schema_model is not None and model.startswith(JSON_SCHEMA_MODELS):
+        schema = schema_model.model_json_schema()
+        for field in exclude:
+            schema.get("properties", {}).pop(field, None)
+            if field in schema.get("required", []):
+                schema["required"].remove(field)
+        return {
+            "type": "json_schema",
+            "json_schema": {"name": schema_model.__name__, "schema": schema},
+        }
+    if model.startswith(JSON_MODE_MODELS):
+        return {"type": "json_object"}
+    return None
+
+
+class ParseStats:
+    """Taux d'échec du parsing par endpoint."""
+
+    def __init__(self):
+        self._counters: dict[str, dict[str, int]] = defaultdict(
+            lambda: {"responses": 0, "parse_failures": 0, "repaired": 0, "failed": 0}
+        )
+
+    def record(self, endpoint: str, event: str):
+        self._counters[endpoint][event] += 1
+
+    def to_dict(self) -> dict:
+        return {
+            endpoint: {
+                **counters,
+                "parse_failure_rate": round(
+                    counters["parse_failures"] / counters["responses"], 4
+                ) if counters["responses"] else 0.0,
+            }
+            for endpoint, counters in self._counters.items()
+        }
+
+
+parse_stats = ParseStats()
+
+
+def validate(content: str, model_cls: Type[T], extra: dict | None = None) -> T:
+    data = parse_json(content)
+    try:
+        return model_cls.model_validate({**data, **(extra or {})} if isinstance(data, dict) else data)
+    except ValidationError as e:
+        raise StructuredOutputError(str(e)) from e
+
+
+def is_valid(content: str, model_cls: Type[BaseModel], extra: dict | None = None) -> bool:
+    try:
+        validate(content, model_cls, extra)
+    except StructuredOutputError:
+        return False
+    return True
+
+
+async def repair(
+    content: str,
+    error: str,
+    model_cls: Type[BaseModel],
+    exclude: Iterable[str] = (),
+    extra: dict | None = None
+) -> dict:
+    """Appel de réparation ciblé : corrige le JSON sans refaire l'analyse."""
+    llm_service = current_container().llm_service
+    schema = model_cls.model_json_schema()
+    for field in exclude:
+        schema.get("properties", {}).pop(field, None)
+    prompt = prompts.get("structured.repair").render(
+        schema=json.dumps(schema, ensure_ascii=False),
+        error=error[:500],
+        content=content
+    )
+    result = await llm_service.complete(
+        messages=prompt.messages(),
+        temperature=0.0,
+        max_tokens=min(4000, len(content) // 2 + 200),
+        response_format=response_format_for(llm_service.default_model),
+        prompt_tokens=prompt.tokens,
+        cache_if=lambda r: is_valid(r["content"], model_cls, extra)
+    )
+    prompt.record(result)
+    return result
+
+
+async def complete_structured(
+    messages: list[Message],
+    model_cls: Type[T],
+    endpoint: str,
+    result_fields: dict[str, str] | None = None,
+    **complete_kwargs
+) -> tuple[T, dict]:
+    """Complétion validée dans `model_cls`.
+
+    `result_fields` : champs du modèle remplis depuis le résultat de la
+    complétion plutôt que par le LLM (ex: {"tokens_used": "tokens"}) ; ils
+    sont exclus du schéma demandé. Retourne (modèle validé, résultat brut).
+    Seules les réponses valides sont mises en cache.
+    """
+    llm_service = current_container().llm_service
+    result_fields = result_fields or {}
+    model = complete_kwargs.get("model") or llm_service.default_model
+    result = await llm_service.complete(
+        messages=messages,
+        response_format=response_format_for(model, model_cls, exclude=result_fields),
+        cache_if=lambda r: is_valid(
+            r["content"], model_cls, {field: r[key] for field, key in result_fields.items()}
+        ),
+        **complete_kwargs
+    )
+    parse_stats.record(endpoint, "responses")
+    try:
+        extra = {field: result[key] for field, key in result_fields.items()}
+        return validate(result["content"], model_cls, extra), result
+    except StructuredOutputError as e:
+        parse_stats.record(endpoint, "parse_failures")
+        error = str(e)
+
+    logger.warning(f"Structured output parse failure on {endpoint}, attempting repair: {error[:200]}")
+    extra = {field: result[key] for field, key in result_fields.items()}
+    repaired = await repair(result["content"], error, model_cls, exclude=result_fields, extra=extra)
+    result = {**result, "tokens": result["tokens"] + repaired["tokens"]}
+    try:
+        extra = {field: result[key] for field, key in result_fields.items()}
+        parsed = validate(repaired["content"], model_cls, extra)
+    except StructuredOutputError:
+        parse_stats.record(endpoint, "failed")
+        raise
+    parse_stats.record(endpoint, "repaired")
+    return parsed, result
@@ -0,0 +1,34 @@
+# Comptage de tokens
+# app/utils/tokens.py
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # Optionnel : approximation si absent
+    tiktoken = None
+
+# Surcoût approximatif par message (rôle + séparateurs du format chat)
+MESSAGE_OVERHEAD = 4
+
+
+@lru_cache(maxsize=16)
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str = "gpt-4-turbo") -> int:
+    """Nombre de tokens d'un texte (≈ 4 caractères par token sans tiktoken)."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return max(1, (len(text) + 3) // 4)
+    return len(encoding.encode(text))
+
+
+def count_message_tokens(content: str, model: str = "gpt-4-turbo") -> int:
+    """Tokens d'un message chat, surcoût de format inclus."""
+    return count_tokens(content, model) + MESSAGE_OVERHEAD
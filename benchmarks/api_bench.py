@@ -0,0 +1,299 @@
+# Benchmark de l'API sur le fournisseur fake
+# benchmarks/api_bench.py
+#
+# Usage : python -m benchmarks.api_bench [--requests 500] [--concurrency 20]
+#             [--scenarios chat chat_stream ...] [--latency-ms 20] [--distribution lognormal]
+#             [--output bench.json] [--compare baseline.json] [--threshold 10]
+#
+# Chaque scénario tourne dans un processus neuf, l'appel amont étant servi
+# par le fournisseur fake (Settings fake_* : latence, TTFT, débit, erreurs) :
+# on mesure le coût du service lui-même. L'application ASGI est pilotée
+# directement (sans serveur ni réseau) ; les entrées sont toutes distinctes,
+# les caches ne servent donc pas les réponses.
+#
+# Par scénario : débit, latence p50/p95/p99 (et premier chunk en streaming),
+# erreurs et mémoire (RSS). `--output` écrit le résultat en JSON (avec le
+# commit git) ; `--compare` le confronte à un résultat précédent et signale
+# les régressions au-delà de `--threshold` %.
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+CATEGORIES = ["support", "facturation", "commercial"]
+SSE_ERROR = b'data: {"error"'
+
+# Corps de requête du i-ème appel de chaque scénario
+SCENARIOS = {
+    "chat": ("/api/chat/", lambda i: {"message": f"Bonjour, question numéro {i} sur ma commande"}),
+    "chat_stream": ("/api/chat/stream", lambda i: {"message": f"Raconte-moi l'histoire numéro {i}"}),
+    "analysis_document": ("/api/analysis/document", lambda i: {
+        "text": f"Rapport {i} : le trimestre a été marqué par une hausse des ventes à Paris et Lyon."
+    }),
+    "analysis_classify": ("/api/analysis/classify", lambda i: {
+        "text": f"Ma facture {i} est incorrecte", "categories": CATEGORIES
+    }),
+    "analysis_classify_batch": ("/api/analysis/classify/batch", lambda i: {
+        "texts": [f"Ticket {i}-{j} : je n'arrive pas à me connecter" for j in range(20)],
+        "categories": CATEGORIES
+    }),
+    "analysis_batch": ("/api/analysis/batch", lambda i: {
+        "texts": [f"Texte {i}-{j} à résumer en une phrase." for j in range(5)],
+        "operation": "summarize"
+    }),
+}
+
+# Réponses JSON du fake pour les templates structurés (FAKE_REPLIES)
+FAKE_REPLIES = {
+    "analysis.document": json.dumps({
+        "summary": "Hausse des ventes sur le trimestre.",
+        "sentiment": {"sentiment": "POSITIVE", "confidence": 0.9, "explanation": "Résultats en hausse"},
+        "entities": [{"text": "Paris", "type": "LOCATION", "start": 0, "end": 5}],
+        "key_points": ["Ventes en hausse", "Paris et Lyon"],
+    }, ensure_ascii=False),
+    "classify.single": json.dumps(
+        {"category": "support", "confidence": 0.9, "reasoning": "Problème de compte"}
+    ),
+    "classify.batch": json.dumps({"results": [
+        {"index": i, "category": "support", "confidence": 0.9, "reasoning": "Problème de compte"}
+        for i in range(64)
+    ]}),
+}
+
+
+def rss_mb() -> float:
+    """RSS courant (Linux), sinon pic du processus."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values: list[float], p: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+async def call(app, path: str, payload: dict, client_ip: str) -> tuple[int, float, float]:
+    """POST JSON ; retourne (statut, premier chunk, total) en secondes.
+    Une trame d'erreur SSE compte comme un statut 502."""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [
+            (b"host", b"bench"),
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+        ],
+        "client": (client_ip, 1234),
+        "server": ("bench", 80),
+    }
+    disconnect = asyncio.Event()
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    start = time.perf_counter()
+    status = 500
+    first_chunk = None
+
+    async def send(message):
+        nonlocal status, first_chunk
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body" and message.get("body"):
+            if first_chunk is None:
+                first_chunk = time.perf_counter() - start
+            if SSE_ERROR in message["body"]:
+                status = 502
+
+    await app(scope, receive, send)
+    disconnect.set()
+    total = time.perf_counter() - start
+    return status, first_chunk or total, total
+
+
+async def run_scenario(name: str, requests: int, concurrency: int, warmup: int) -> dict:
+    from app.main import app
+
+    path, payload = SCENARIOS[name]
+    semaphore = asyncio.Semaphore(concurrency)
+    results: list[tuple[int, float, float]] = []
+
+    async def one(i: int, record: bool):
+        async with semaphore:
+            result = await call(app, path, payload(i), f"10.{i % 250}.0.1")
+            if record:
+                results.append(result)
+
+    async with app.router.lifespan_context(app):
+        await asyncio.gather(*[one(-1 - i, False) for i in range(warmup)])
+        gc.collect()
+        rss_before = rss_mb()
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i, True) for i in range(requests)])
+        elapsed = time.perf_counter() - start
+        rss_after = rss_mb()
+
+    totals = [total for _, _, total in results]
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for status, _, _ in results if status >= 400),
+        "requests_per_second": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(totals, 50) * 1000, 2),
+        "p95_ms": round(percentile(totals, 95) * 1000, 2),
+        "p99_ms": round(percentile(totals, 99) * 1000, 2),
+        "rss_mb": round(rss_after, 1),
+        "rss_growth_mb": round(rss_after - rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+    if name == "chat_stream":
+        firsts = [first for _, first, _ in results]
+        report["first_chunk_p50_ms"] = round(percentile(firsts, 50) * 1000, 2)
+        report["first_chunk_p99_ms"] = round(percentile(firsts, 99) * 1000, 2)
+    return report
+
+
+def git_commit() -> str | None:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fake_env(args: argparse.Namespace) -> dict:
+    env = {
+        "LLM_PROVIDERS": '["fake"]',
+        "FAKE_LATENCY_MS": str(args.latency_ms),
+        "FAKE_LATENCY_DISTRIBUTION": args.distribution,
+        "FAKE_LATENCY_JITTER": str(args.jitter),
+        "FAKE_TOKENS_PER_SECOND": str(args.tokens_per_second),
+        "FAKE_ERROR_RATE": str(args.error_rate),
+        "FAKE_STREAM_ABORT_RATE": str(args.stream_abort_rate),
+        "FAKE_SEED": str(args.seed),
+    }
+    if args.ttft_ms is not None:
+        env["FAKE_TTFT_MS"] = str(args.ttft_ms)
+    return env
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Régressions de débit ou de p95 au-delà de `threshold` %."""
+    regressions = []
+    print(f"\nComparaison avec {baseline.get('commit')} (seuil {threshold:g} %) :", file=sys.stderr)
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        rps = (result["requests_per_second"] / previous["requests_per_second"] - 1) * 100
+        p95 = (result["p95_ms"] / previous["p95_ms"] - 1) * 100
+        flag = ""
+        if rps < -threshold or p95 > threshold:
+            flag = "  <-- régression"
+            regressions.append(name)
+        print(f"  {name:26} rps {rps:+6.1f} %   p95 {p95:+6.1f} %{flag}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--distribution", choices=["fixed", "uniform", "lognormal"], default="lognormal")
+    parser.add_argument("--jitter", type=float, default=0.25)
+    parser.add_argument("--ttft-ms", type=float)
+    parser.add_argument("--tokens-per-second", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--stream-abort-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Fichier JSON de résultats")
+    parser.add_argument("--compare", help="Résultat précédent (JSON) à comparer")
+    parser.add_argument("--threshold", type=float, default=10, help="Seuil de régression en %%")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run_scenario(args.child, args.requests, args.concurrency, args.warmup))
+        print(json.dumps(result))
+        return
+
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench"),
+        "RATE_LIMIT_REQUESTS": str(10 ** 9),
+        "LOG_FILE": os.devnull,
+        "FAKE_REPLIES": json.dumps(FAKE_REPLIES),
+        **fake_env(args),
+    }
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "fake": {k: v for k, v in fake_env(args).items() if k.startswith("FAKE_")},
+        },
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.api_bench", "--child", name,
+             "--requests", str(args.requests), "--concurrency", str(args.concurrency),
+             "--warmup", str(args.warmup)],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout
+        report["scenarios"][name] = json.loads(output.strip().splitlines()[-1])
+        print(f"{name:26} {json.dumps(report['scenarios'][name])}", file=sys.stderr)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
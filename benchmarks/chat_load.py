@@ -0,0 +1,92 @@
+# Test de charge du chat : débit avec et sans persistance des conversations
+# benchmarks/chat_load.py
+#
+# Usage : python -m benchmarks.chat_load [--users 50] [--turns 20] [--latency-ms 20]
+#
+# L'appel amont est remplacé par le fournisseur fake à latence fixe, afin de
+# mesurer uniquement le coût du service (historique, persistance, middlewares).
+# Chaque configuration tourne dans un processus séparé (les Settings sont mis
+# en cache au premier accès).
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def run(users: int, turns: int, latency: float) -> dict:
+    import httpx
+    from app.config import settings
+    from app.container import current_container
+    from app.main import app
+    from app.services.provider_router import ProviderRouter
+    from app.services.providers import FakeProvider
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        current_container().llm_service.router = ProviderRouter(
+            [FakeProvider(latency=latency, reply="Réponse de test.")]
+        )
+
+        async def user(i: int):
+            conversation_id = None
+            for turn in range(turns):
+                response = await client.post("/api/chat/", json={
+                    "message": f"Utilisateur {i}, message {turn}",
+                    "conversation_id": conversation_id,
+                })
+                response.raise_for_status()
+                conversation_id = response.json()["conversation_id"]
+
+        start = time.perf_counter()
+        await asyncio.gather(*[user(i) for i in range(users)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "persistence": settings.conversation_persistence,
+        "requests": users * turns,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(users * turns / elapsed, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = asyncio.run(run(args.users, args.turns, args.latency_ms / 1000))
+        print(json.dumps(result))
+        return
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for persistence in ("false", "true"):
+            env = {
+                **os.environ,
+                "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench"),
+                "CONVERSATION_PERSISTENCE": persistence,
+                "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+                "RATE_LIMIT_REQUESTS": str(10 ** 9),
+            }
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.chat_load", "--child",
+                 "--users", str(args.users), "--turns", str(args.turns),
+                 "--latency-ms", str(args.latency_ms)],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
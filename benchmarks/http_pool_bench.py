@@ -0,0 +1,118 @@
+# Pool de connexions du client OpenAI : réutilisation sous forte concurrence
+# benchmarks/http_pool_bench.py
+#
+# Usage : python -m benchmarks.http_pool_bench [--concurrency 500] [--bursts 3] [--latency-ms 50]
+#
+# Un faux serveur OpenAI local (HTTP/1.1 keep-alive) compte les connexions
+# TCP acceptées. Plusieurs rafales de `concurrency` complétions sont
+# envoyées avec le client par défaut du SDK, puis avec le client configuré
+# par les Settings (build_http_client) : idéalement, aucune nouvelle
+# connexion n'est ouverte après la première rafale.
+import argparse
+import asyncio
+import json
+import os
+import time
+
+os.environ.setdefault("OPENAI_API_KEY", "bench")
+
+RESPONSE = json.dumps({
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "gpt-4-turbo",
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "Réponse de test."},
+        "finish_reason": "stop",
+    }],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+}).encode("utf-8")
+
+
+class FakeOpenAIServer:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.connections = 0
+        self.requests = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                length = 0
+                for line in head.split(b"\r\n"):
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":", 1)[1])
+                await reader.readexactly(length)
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(RESPONSE)).encode() + b"\r\n"
+                    b"Connection: keep-alive\r\n\r\n" + RESPONSE
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def run_client(name: str, client, server: FakeOpenAIServer, concurrency: int, bursts: int) -> dict:
+    async def one():
+        await client.chat.completions.create(
+            model="gpt-4-turbo",
+            messages=[{"role": "user", "content": "Bonjour"}],
+            max_tokens=10
+        )
+
+    server.connections = 0
+    connections_per_burst = []
+    start = time.perf_counter()
+    for _ in range(bursts):
+        before = server.connections
+        await asyncio.gather(*[one() for _ in range(concurrency)])
+        connections_per_burst.append(server.connections - before)
+        await asyncio.sleep(0.2)  # Pause entre deux rafales
+    elapsed = time.perf_counter() - start
+    await client.close()
+    return {
+        "client": name,
+        "requests": concurrency * bursts,
+        "seconds": round(elapsed, 3),
+        "new_connections_per_burst": connections_per_burst,
+    }
+
+
+async def main(concurrency: int, bursts: int, latency: float):
+    server = FakeOpenAIServer(latency)
+    tcp = await asyncio.start_server(server.handle, "127.0.0.1", 0, backlog=4096)
+    port = tcp.sockets[0].getsockname()[1]
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+
+    from openai import AsyncOpenAI
+    from app.config import settings
+    from app.services.providers import build_http_client
+
+    results = [
+        await run_client("sdk_default", AsyncOpenAI(max_retries=0), server, concurrency, bursts),
+        await run_client(
+            "settings",
+            AsyncOpenAI(http_client=build_http_client(), max_retries=settings.openai_max_retries),
+            server, concurrency, bursts
+        ),
+    ]
+    tcp.close()
+    await tcp.wait_closed()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--bursts", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency, args.bursts, args.latency_ms / 1000))
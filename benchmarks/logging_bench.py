@@ -0,0 +1,100 @@
+# Logging sur un sink lent : handler synchrone vs file asynchrone
+# benchmarks/logging_bench.py
+#
+# Usage : python -m benchmarks.logging_bench [--requests 3000] [--concurrency 50] [--sink-ms 1]
+#
+# Le sink simule un stdout/fichier lent (chaque write bloque `sink-ms`).
+# On mesure le débit et la latence (p50/p99) de /health derrière
+# LoggingMiddleware, avec un StreamHandler classique puis QueuedLogHandler.
+import argparse
+import asyncio
+import io
+import json
+import logging
+import statistics
+import time
+
+from fastapi import FastAPI
+
+from app.middleware.logging import LoggingMiddleware
+from app.utils.log_pipeline import QueuedLogHandler
+from benchmarks.middleware_bench import call
+
+
+class SlowSink(io.RawIOBase):
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.writes = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        time.sleep(self.delay)
+        self.writes += 1
+        return len(data)
+
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy"}
+
+    app.add_middleware(LoggingMiddleware, sample_rate=1.0, slow_request_ms=1000)
+    return app
+
+
+async def run(app, requests: int, concurrency: int) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            _, total = await call(app, "GET", "/health", f"10.0.{i % 250}.1")
+            latencies.append(total)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+    }
+
+
+async def main(requests: int, concurrency: int, sink_delay: float):
+    logger = logging.getLogger("ai_backend")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    app = build_app()
+    report = {}
+
+    sink = SlowSink(sink_delay)
+    handler = logging.StreamHandler(io.TextIOWrapper(sink, write_through=True))
+    logger.addHandler(handler)
+    report["sync StreamHandler"] = {**await run(app, requests, concurrency), "sink_writes": sink.writes}
+    logger.removeHandler(handler)
+
+    sink = SlowSink(sink_delay)
+    handler = QueuedLogHandler(sink)
+    handler.start()
+    logger.addHandler(handler)
+    result = await run(app, requests, concurrency)
+    logger.removeHandler(handler)
+    handler.close()
+    report["QueuedLogHandler"] = {**result, "sink_writes": sink.writes, **handler.stats()}
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--sink-ms", type=float, default=1)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.sink_ms / 1000))
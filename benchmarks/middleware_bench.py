@@ -0,0 +1,186 @@
+# Micro-benchmark des middlewares (BaseHTTPMiddleware vs ASGI pur)
+# benchmarks/middleware_bench.py
+#
+# Usage : python -m benchmarks.middleware_bench [--requests 5000] [--concurrency 50]
+#
+# Pilote l'application ASGI directement (sans serveur ni réseau) pour isoler
+# le coût des middlewares : requêtes/seconde sur /health et latence du
+# premier chunk sur un endpoint SSE, avec et sans MetricsMiddleware.
+import argparse
+import asyncio
+import json
+import logging
+import statistics
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware.logging import LoggingMiddleware
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.rate_limit import RateLimitMiddleware
+
+logging.getLogger("ai_backend").setLevel(logging.WARNING)
+
+CHUNKS = 20
+CHUNK_DELAY = 0.005
+
+
+# Implémentations précédentes (BaseHTTPMiddleware), pour comparaison
+class LegacyLoggingMiddleware(BaseHTTPMiddleware):
+    async def dispatch(self, request: Request, call_next):
+        start_time = time.time()
+        logging.getLogger("ai_backend").info(json.dumps({
+            "type": "request",
+            "method": request.method,
+            "path": request.url.path,
+            "client_ip": request.client.host,
+        }))
+        response = await call_next(request)
+        logging.getLogger("ai_backend").info(json.dumps({
+            "type": "response",
+            "method": request.method,
+            "path": request.url.path,
+            "status_code": response.status_code,
+            "duration_ms": round((time.time() - start_time) * 1000, 2)
+        }))
+        return response
+
+
+class LegacyRateLimitMiddleware(BaseHTTPMiddleware):
+    def __init__(self, app, requests_per_minute: int = 60):
+        super().__init__(app)
+        self.requests_per_minute = requests_per_minute
+        self.requests: dict[str, list[datetime]] = defaultdict(list)
+        self._lock = asyncio.Lock()
+
+    async def dispatch(self, request: Request, call_next):
+        client_id = request.client.host
+        async with self._lock:
+            now = datetime.now()
+            window_start = now - timedelta(minutes=1)
+            self.requests[client_id] = [
+                ts for ts in self.requests[client_id] if ts > window_start
+            ]
+            self.requests[client_id].append(now)
+        return await call_next(request)
+
+
+def build_app(legacy: bool, metrics: bool = False) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/health")
+    async def health():
+        return {"status": "healthy", "version": "1.0.0"}
+
+    @app.post("/stream")
+    async def stream():
+        async def generate():
+            for i in range(CHUNKS):
+                yield f"data: {json.dumps({'content': str(i)})}\n\n"
+                await asyncio.sleep(CHUNK_DELAY)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    limit = 10 ** 9
+    if legacy:
+        app.add_middleware(LegacyLoggingMiddleware)
+        app.add_middleware(LegacyRateLimitMiddleware, requests_per_minute=limit)
+    else:
+        app.add_middleware(LoggingMiddleware, sample_rate=1.0, slow_request_ms=1000)
+        app.add_middleware(RateLimitMiddleware, requests_per_minute=limit, window_seconds=60)
+    if metrics:
+        app.add_middleware(MetricsMiddleware)
+    return app
+
+
+async def call(app, method: str, path: str, client_ip: str) -> tuple[float, float]:
+    """Exécute une requête ; retourne (premier chunk, total) en secondes."""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"bench")],
+        "client": (client_ip, 1234),
+        "server": ("bench", 80),
+    }
+    disconnect = asyncio.Event()
+    body_sent = False
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnect.wait()
+        return {"type": "http.disconnect"}
+
+    start = time.perf_counter()
+    first_chunk = None
+
+    async def send(message):
+        nonlocal first_chunk
+        if message["type"] == "http.response.body" and message.get("body") and first_chunk is None:
+            first_chunk = time.perf_counter() - start
+
+    await app(scope, receive, send)
+    disconnect.set()
+    total = time.perf_counter() - start
+    return first_chunk or total, total
+
+
+async def bench_health(app, requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            await call(app, "GET", "/health", f"10.0.{i % 250}.1")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(requests)])
+    return requests / (time.perf_counter() - start)
+
+
+async def bench_stream(app, streams: int) -> list[float]:
+    results = await asyncio.gather(*[
+        call(app, "POST", "/stream", "10.0.0.1") for _ in range(streams)
+    ])
+    return [first for first, _ in results]
+
+
+async def main(requests: int, concurrency: int, streams: int):
+    report = {}
+    configs = (
+        ("before (BaseHTTPMiddleware)", True, False),
+        ("after (ASGI)", False, False),
+        ("after (ASGI) + metrics", False, True),
+    )
+    for name, legacy, metrics in configs:
+        app = build_app(legacy, metrics)
+        await bench_health(app, 200, concurrency)  # Warm-up
+        rps = await bench_health(app, requests, concurrency)
+        ttfb = await bench_stream(app, streams)
+        report[name] = {
+            "health_rps": round(rps, 1),
+            "stream_first_chunk_ms_p50": round(statistics.median(ttfb) * 1000, 3),
+            "stream_first_chunk_ms_max": round(max(ttfb) * 1000, 3),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--streams", type=int, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests, args.concurrency, args.streams))
@@ -0,0 +1,81 @@
+# Démarrage à froid d'un worker : import, lifespan et première requête
+# benchmarks/startup_bench.py
+#
+# Usage : python -m benchmarks.startup_bench [--runs 5]
+#
+# Chaque mesure tourne dans un processus neuf (caches d'import Python
+# compris, hors bytecode déjà compilé), avec le fournisseur fake : on mesure
+# le coût du démarrage de l'application, pas celui du réseau.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+
+async def child() -> dict:
+    start = time.perf_counter()
+    from app.main import app
+    imported = time.perf_counter()
+
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        response = await client.post("/api/chat/", json={"message": "Bonjour"})
+        response.raise_for_status()
+        first = time.perf_counter()
+
+    return {
+        "import_ms": (imported - start) * 1000,
+        "lifespan_ms": (started - imported) * 1000,
+        "first_request_ms": (first - started) * 1000,
+        "total_ms": (first - start) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--persistence", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(child())))
+        return
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "bench"),
+            "LLM_PROVIDERS": '["fake"]',
+            "CONVERSATION_PERSISTENCE": "true" if args.persistence else "false",
+            "DATABASE_URL": f"sqlite:///{tmp}/bench.db",
+        }
+        for _ in range(args.runs):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.startup_bench", "--child"],
+                env=env, check=True, capture_output=True, text=True
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(json.dumps({
+        "runs": args.runs,
+        "persistence": args.persistence,
+        **{
+            f"median_{key}": round(statistics.median(run[key] for run in runs), 1)
+            for key in runs[0]
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()